@@ -1,18 +1,21 @@
+import collections
 import os
 import sys
-import imagehash
-from PIL import Image
+import threading
 from PyQt6 import QtWidgets, QtCore, QtGui
-from PyQt6.QtWidgets import QMainWindow, QFrame, QVBoxLayout, QHBoxLayout, QLabel, QLineEdit, QPushButton, QSlider, QCheckBox, QScrollArea, QProgressDialog, QMessageBox, QApplication, QWidget, QSpinBox
+from PyQt6.QtWidgets import QMainWindow, QFrame, QVBoxLayout, QHBoxLayout, QLabel, QLineEdit, QPushButton, QSlider, QCheckBox, QProgressDialog, QMessageBox, QApplication, QWidget, QSpinBox, QComboBox
 from PyQt6.QtCore import QThread, pyqtSignal, QSize, QUrl, Qt
-from PyQt6.QtGui import QFont, QImage, QPixmap, QIcon, QPalette, QColor, QDesktopServices
+from PyQt6.QtGui import QImage, QPixmap, QIcon, QPalette, QColor, QDesktopServices
 from datetime import datetime
-from concurrent.futures import ThreadPoolExecutor
-
-#To stop the mousewheel moving the sliders over if the cursor was positioned over them when scrolling
-class NonWheelSlider(QSlider):
-    def wheelEvent(self, event):
-        event.ignore()
+import multiprocessing
+from duplinator import SUPPORTED_EXTENSIONS
+from duplinator.cache import CacheOptions, default_cache_path
+from duplinator.frames import DEFAULT_MAX_FRAMES, FrameOptions
+from duplinator.grouping import DuplicateGrouper
+from duplinator.hashing import DecodeOptions, parse_hash_specs
+from duplinator.scanner import DuplicateScanner
+from duplinator.thumbnails import THUMBNAIL_SIZE, ThumbnailCache, default_thumbnail_cache_path, load_thumbnail
+from duplinator.walker import WalkOptions
 
 # Helper function to get the correct path to resources
 def resource_path(relative_path):
@@ -43,107 +46,713 @@ def apply_dark_theme(app):
     dark_palette.setColor(QPalette.ColorRole.HighlightedText, QColor(0, 0, 0))
     app.setPalette(dark_palette)
 
-# Function to allow extended subfolder searches greater than a single subfolder
-def list_files(folder_path, max_depth, included_extensions):
-    for root, dirs, files in os.walk(folder_path, topdown=True):
-        depth = root[len(folder_path):].count(os.sep)
-        if max_depth is not None and depth > max_depth:
-            dirs[:] = []  # Prevent descending further
-            continue
-        for file in files:
-            if file.lower().endswith(included_extensions):
-                yield os.path.join(root, file)
-
-# Function to find duplicate images
-def find_duplicate_images(folder_path, hash_size, threshold, max_depth, included_extensions, multi_thread, num_threads):
-    included_extensions = tuple(included_extensions)
-    image_files = list(list_files(folder_path, max_depth, included_extensions))
-    
-    image_hashes = {}
-    if multi_thread:
-        def compute_hash(filepath):
-            try:
-                with Image.open(filepath) as img:
-                    return filepath, imagehash.phash(img, hash_size=hash_size)
-            except Exception as e:
-                print(f"Error processing {filepath}: {e}")
-                return filepath, None
-        
-        with ThreadPoolExecutor(max_workers=num_threads) as executor:
-            futures = [executor.submit(compute_hash, filepath) for filepath in image_files]
-            for future in futures:
-                filepath, hash_value = future.result()
-                if hash_value is not None:
-                    image_hashes[filepath] = hash_value
-    else:
-        for filepath in image_files:
-            try:
-                with Image.open(filepath) as img:
-                    image_hashes[filepath] = imagehash.phash(img, hash_size=hash_size)
-            except Exception as e:
-                print(f"Error processing {filepath}: {e}")
-    
-    duplicates = []
-    filepaths = list(image_hashes.keys())
-    for i in range(len(filepaths)):
-        for j in range(i + 1, len(filepaths)):
-            filepath1 = filepaths[i]
-            filepath2 = filepaths[j]
-            hash1 = image_hashes[filepath1]
-            hash2 = image_hashes[filepath2]
-            if (hash1 - hash2) <= threshold:
-                duplicates.append((filepath1, filepath2))
-    return duplicates
-
 # ScanThread class
 class ScanThread(QThread):
     finished = pyqtSignal(object)
+    progress_changed = pyqtSignal(object)
+    pairs_found = pyqtSignal(object)
+    groups_changed = pyqtSignal(object, object)
+
+    def __init__(self, folder_path, hash_size, threshold, max_depth, included_extensions, multi_thread, num_threads, cache_path=None, backend="thread", exact_first=False, thumbnail_cache_path=None, keep_policy=None, skip_hidden=False, follow_symlinks=False, algorithm="phash", cascade=False, extra_hashes=(), memory_limit="auto", reduced_decode=True, frames=None):
+        super().__init__()
+        self.scanner = DuplicateScanner(folder_path, hash_size, threshold, max_depth, included_extensions, multi_thread, num_threads, caching=CacheOptions(cache_path, thumbnail_cache_path, extra_hashes), backend=backend, exact_first=exact_first, expand_copies=keep_policy is None, walk=WalkOptions(skip_hidden, follow_symlinks), algorithm=algorithm, cascade=cascade, decode=DecodeOptions(reduced_decode, memory_limit), frames=frames)
+        # With a keep policy, pairs are merged into groups on this thread rather than the GUI thread,
+        # as picking each group's best file means reading the image headers of its members
+        self.grouper = DuplicateGrouper(keep_policy, self.scanner.hash_distance) if keep_policy else None
+        # Files that couldn't be hashed or were skipped, reported once the scan finishes
+        self.problems = []
+
+    def cancel(self):
+        self.scanner.cancel()
+
+    def run(self):
+        try:
+            for event, data in self.scanner.scan():
+                if event == "problems":
+                    self.problems.extend(data)
+                elif event == "progress":
+                    if self.grouper is not None:
+                        data["groups"] = len(self.grouper)
+                    data["stats"] = self.scanner.scan_stats.summary(data)
+                    self.progress_changed.emit(data)
+                elif self.grouper is None:
+                    self.pairs_found.emit(data)
+                else:
+                    with self.scanner.scan_stats.stage("grouping", len(data)):
+                        changed, removed = self.grouper.add_pairs(data)
+                    self.groups_changed.emit([self.grouper.group(root) for root in changed], removed)
+            self.finished.emit(dict(self.scanner.progress))
+        except Exception as e:
+            self.finished.emit(e)
+
+# Re-matches a finished scan's hash index at the current threshold and file types, regrouping the pairs when
+# the scan was grouped. Raising the threshold past what the index has matched takes one pass over its hashes;
+# anything else only filters pairs already in memory.
+class RequeryThread(QThread):
+    finished = pyqtSignal(object)
 
-    def __init__(self, folder_path, hash_size, threshold, max_depth, included_extensions, multi_thread, num_threads):
+    def __init__(self, index, threshold, included_extensions, keep_policy=None, attributes=None):
         super().__init__()
-        self.folder_path = folder_path
-        self.hash_size = hash_size
+        self.index = index
         self.threshold = threshold
-        self.max_depth = max_depth
         self.included_extensions = included_extensions
-        self.multi_thread = multi_thread
-        self.num_threads = num_threads
+        self.keep_policy = keep_policy
+        self.attributes = attributes
+        self.cancel_event = threading.Event()
+
+    def cancel(self):
+        self.cancel_event.set()
 
     def run(self):
         try:
-            duplicates = find_duplicate_images(self.folder_path, self.hash_size, self.threshold, self.max_depth, self.included_extensions, self.multi_thread, self.num_threads)
-            self.finished.emit(duplicates)
+            pairs = self.index.pairs(self.threshold, self.included_extensions, self.keep_policy is None, self.cancel_event)
+            if self.keep_policy is None:
+                self.finished.emit(pairs)
+                return
+            grouper = DuplicateGrouper(self.keep_policy, self.index.hash_distance, self.attributes)
+            grouper.add_pairs(pairs)
+            self.finished.emit(grouper.groups())
         except Exception as e:
             self.finished.emit(e)
-            
-#Make the thumbnail view clickable
-class ClickableLabel(QLabel):
-    def __init__(self, filepath, parent=None):
+
+# Matches a finished scan's index up to the highest threshold the slider allows while the results are being
+# reviewed, so moving the slider up afterwards is as quick as moving it down. It goes one threshold at a time,
+# each a moment's work, so a query for a threshold past the ones matched never waits long behind it, and stops
+# at thresholds only matched by comparing every hash with every other (see HashIndex.lookup_bands()), which are
+# left until they are asked for. max_pairs stops a folder full of similar images from filling memory with pairs
+# nobody will look at.
+class IndexWarmupThread(QThread):
+    MAX_PAIRS = 2_000_000
+
+    def __init__(self, index, threshold):
+        super().__init__()
+        self.index = index
+        self.threshold = threshold
+        self.cancel_event = threading.Event()
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    def run(self):
+        threshold = self.index.max_distance + 1
+        while threshold <= self.threshold and not self.cancel_event.is_set() and self.index.lookup_bands(threshold) is not None:
+            if self.index.extend(threshold, self.MAX_PAIRS, self.cancel_event) < threshold:
+                break
+            threshold = self.index.max_distance + 1
+
+# Deletes files on a background thread so removing thousands of them doesn't freeze the window. Progress is
+# reported every BATCH_SIZE files, and failures are collected and handed back together with the deleted files.
+# Files that no longer exist count as deleted.
+class DeleteThread(QThread):
+    finished = pyqtSignal(object, object)
+    progress_changed = pyqtSignal(int)
+    BATCH_SIZE = 100
+
+    def __init__(self, filepaths):
+        super().__init__()
+        self.filepaths = sorted(filepaths)
+
+    def run(self):
+        deleted, failed = [], []
+        for count, filepath in enumerate(self.filepaths, 1):
+            try:
+                os.remove(filepath)
+                deleted.append(filepath)
+            except FileNotFoundError:
+                # Already gone, so it has to leave the results all the same
+                deleted.append(filepath)
+            except OSError as e:
+                failed.append((filepath, e))
+            if count % self.BATCH_SIZE == 0:
+                self.progress_changed.emit(count)
+        self.finished.emit(deleted, failed)
+
+# Shows a larger preview of an image in a popup. The popup is returned so the caller can keep it alive.
+def show_large_image(filepath):
+    image = QImage(filepath)
+    if image.isNull():
+        return None
+    large_pixmap = QPixmap.fromImage(image).scaled(
+        400, 400,
+        QtCore.Qt.AspectRatioMode.KeepAspectRatio,
+        QtCore.Qt.TransformationMode.SmoothTransformation
+    )
+    popup = ImagePopup(large_pixmap)
+    popup.show()
+    return popup
+
+def open_image(filepath):
+    QDesktopServices.openUrl(QUrl.fromLocalFile(filepath))
+
+# Reads the size, dates and resolution of a file and its thumbnail, taking the thumbnail from the thumbnail cache
+# while it's up to date. Runs on the loader threads, so the thumbnail is returned as a QImage rather than a QPixmap.
+# stat can pass in an os.stat() result already taken for the file, e.g. by the scan's walk.
+# Returns (info, thumbnail), or (None, None) if the file couldn't be read, which its row shows in place of the info.
+def load_file_details(filepath, thumbnail_cache=None, stat=None):
+    try:
+        if stat is None:
+            stat = os.stat(filepath)
+        cache_key = os.path.abspath(filepath)
+        record = thumbnail_cache.get(cache_key, stat) if thumbnail_cache else None
+        if record is None:
+            record = load_thumbnail(filepath, THUMBNAIL_SIZE)
+            if thumbnail_cache:
+                thumbnail_cache.store([(cache_key, stat.st_size, stat.st_mtime_ns, *record)])
+        width, height, data = record
+        thumbnail = QImage.fromData(data)
+    except Exception:
+        return None, None
+    info = {
+        "size_kb": stat.st_size / 1024,
+        "width": width,
+        "height": height,
+        "created": datetime.fromtimestamp(stat.st_ctime).strftime('%Y-%m-%d %H:%M:%S'),
+        "modified": datetime.fromtimestamp(stat.st_mtime).strftime('%Y-%m-%d %H:%M:%S'),
+    }
+    return info, thumbnail
+
+# Loads file details on a few background threads and hands them back to the GUI thread through `loaded`.
+# Requests are served newest first so the rows just scrolled to come in before ones already scrolled past,
+# and only the latest max_pending requests are kept; anything dropped is asked for again if it's painted.
+# If the thumbnail cache can't be opened, the files are decoded instead and `problem` says so, once per cache.
+class ThumbnailLoader(QtCore.QObject):
+    loaded = pyqtSignal(str, object, object)
+    problem = pyqtSignal(str)
+
+    def __init__(self, num_workers=4, max_pending=256, parent=None):
         super().__init__(parent)
-        self.filepath = filepath
-        self.setAlignment(QtCore.Qt.AlignmentFlag.AlignCenter)
+        # Thumbnail cache used by the workers, or None to always decode the files
+        self.cache_path = None
+        # Function returning a file's stat from the scan (DuplicateScanner.file_stat), or None to stat it here
+        self.file_stat = None
+        self.max_pending = max_pending
+        self.pending = collections.OrderedDict()
+        self.loading = set()
+        self.failed_caches = set()
+        self.condition = threading.Condition()
+        for _ in range(num_workers):
+            threading.Thread(target=self.run, daemon=True).start()
 
-    def mousePressEvent(self, event):
-        if event.button() == QtCore.Qt.MouseButton.LeftButton:
-            self.show_large_image()
-
-    def mouseDoubleClickEvent(self, event):
-        if event.button() == QtCore.Qt.MouseButton.LeftButton:
-            self.open_image()
-
-    def show_large_image(self):
-        image = QImage(self.filepath)
-        if not image.isNull():
-            large_pixmap = QPixmap.fromImage(image).scaled(
-                400, 400,
-                QtCore.Qt.AspectRatioMode.KeepAspectRatio,
-                QtCore.Qt.TransformationMode.SmoothTransformation
-            )
-            popup = ImagePopup(large_pixmap)
-            popup.show()
-
-    def open_image(self):
-        QDesktopServices.openUrl(QUrl.fromLocalFile(self.filepath))
+    def request(self, filepath):
+        with self.condition:
+            if filepath in self.pending or filepath in self.loading:
+                return
+            self.pending[filepath] = None
+            if len(self.pending) > self.max_pending:
+                self.pending.popitem(last=False)
+            self.condition.notify()
+
+    def clear(self):
+        with self.condition:
+            self.pending.clear()
+
+    def run(self):
+        # SQLite connections can't be shared between threads, so each worker opens its own
+        caches = {}
+        while True:
+            with self.condition:
+                idle = not self.pending
+            if idle:
+                # Thumbnail use times are held back (see ThumbnailCache.get()), so write them once the rows in
+                # view have loaded; losing them only changes which thumbnails are pruned first
+                for cache in caches.values():
+                    try:
+                        if cache is not None:
+                            cache.flush_touches()
+                    except Exception:
+                        pass
+            with self.condition:
+                while not self.pending:
+                    self.condition.wait()
+                filepath, _ = self.pending.popitem(last=True)
+                self.loading.add(filepath)
+                cache_path = self.cache_path
+                file_stat = self.file_stat
+            if cache_path and cache_path not in caches:
+                try:
+                    caches[cache_path] = ThumbnailCache(cache_path)
+                except Exception as e:
+                    caches[cache_path] = None
+                    with self.condition:
+                        reported = cache_path in self.failed_caches
+                        self.failed_caches.add(cache_path)
+                    if not reported:
+                        self.problem.emit(f"Couldn't open the thumbnail cache {cache_path}, thumbnails won't be cached: {e}")
+            info, thumbnail = load_file_details(filepath, caches.get(cache_path), file_stat(filepath) if file_stat else None)
+            self.loaded.emit(filepath, info, thumbnail)
+            with self.condition:
+                self.loading.discard(filepath)
+
+# Base for the results models. File info and thumbnails are only requested once a row is actually painted, are
+# loaded in the background by a ThumbnailLoader shared between the models, and only the most recently used
+# MAX_CACHED_DETAILS files are kept in memory. Each row is a dict holding the user's "choice" for it.
+class ResultListModel(QtCore.QAbstractListModel):
+    ItemRole = Qt.ItemDataRole.UserRole + 1
+    ChoiceRole = Qt.ItemDataRole.UserRole + 2
+    MAX_CACHED_DETAILS = 500
+    ITEM_NAME = "result"
+
+    def __init__(self, loader, parent=None):
+        super().__init__(parent)
+        self.items = []
+        self.root_folder = ""
+        self.details = collections.OrderedDict()
+        self.loader = loader
+        self.loader.loaded.connect(self.on_details_loaded)
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        return 0 if parent.isValid() else len(self.items)
+
+    def flags(self, index):
+        return Qt.ItemFlag.ItemIsEnabled | Qt.ItemFlag.ItemIsSelectable
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid():
+            return None
+        item = self.items[index.row()]
+        if role == self.ItemRole:
+            return item
+        if role == self.ChoiceRole:
+            return item["choice"]
+        return None
+
+    def clear(self, root_folder=""):
+        self.beginResetModel()
+        self.items = []
+        self.details.clear()
+        self.loader.clear()
+        self.root_folder = root_folder
+        self.clear_lookups()
+        self.endResetModel()
+
+    # Resets any per-file lookup tables a subclass keeps alongside its rows
+    def clear_lookups(self):
+        pass
+
+    # Rows that show a file, so they can be repainted once its details arrive; every subclass provides it
+    def rows_for_file(self, filepath):
+        raise NotImplementedError
+
+    # (info, thumbnail pixmap) for a file, or None while it's still being loaded
+    def file_details(self, filepath):
+        details = self.details.get(filepath)
+        if details is None:
+            self.loader.request(filepath)
+            return None
+        self.details.move_to_end(filepath)
+        return details
+
+    def on_details_loaded(self, filepath, info, thumbnail):
+        rows = self.rows_for_file(filepath)
+        if not rows:
+            # Loaded for the other model or a previous scan's results
+            return
+        self.details[filepath] = (info, QPixmap.fromImage(thumbnail) if thumbnail is not None else None)
+        while len(self.details) > self.MAX_CACHED_DETAILS:
+            self.details.popitem(last=False)
+        self.dataChanged.emit(self.index(min(rows)), self.index(max(rows)), [self.ItemRole])
+
+    def relative_path(self, filepath):
+        return os.path.relpath(filepath, self.root_folder) if self.root_folder else filepath
+
+    # Swaps in a new set of rows for the same scan, keeping loaded details and any choice that still applies
+    def replace_items(self, items):
+        self.beginResetModel()
+        self.items = items
+        self.clear_lookups()
+        self.index_items()
+        self.endResetModel()
+
+    # Rebuilds a subclass's per-file lookup tables from self.items
+    def index_items(self):
+        pass
+
+# Results model with one row per duplicate pair. The left/neither/right choice for each pair lives here rather
+# than in a slider widget per pair.
+class PairListModel(ResultListModel):
+    ITEM_NAME = "pair"
+
+    # Choice values, matching the old slider positions: 0 deletes the left image, 2 deletes the right one
+    DELETE_LEFT, KEEP_BOTH, DELETE_RIGHT = 0, 1, 2
+
+    def __init__(self, loader, parent=None):
+        super().__init__(loader, parent)
+        self.rows_by_file = collections.defaultdict(list)
+
+    def clear_lookups(self):
+        self.rows_by_file.clear()
+
+    def rows_for_file(self, filepath):
+        return self.rows_by_file.get(filepath)
+
+    def setData(self, index, value, role=Qt.ItemDataRole.EditRole):
+        if not index.isValid() or role != self.ChoiceRole:
+            return False
+        self.items[index.row()]["choice"] = max(self.DELETE_LEFT, min(self.DELETE_RIGHT, value))
+        self.dataChanged.emit(index, index, [role])
+        return True
+
+    def step_choice(self, index, step):
+        self.setData(index, index.data(self.ChoiceRole) + step, self.ChoiceRole)
+
+    def index_items(self):
+        for row, pair in enumerate(self.items):
+            self.rows_by_file[pair["file1"]].append(row)
+            self.rows_by_file[pair["file2"]].append(row)
+
+    # Drops every pair involving a deleted file
+    def remove_files(self, filepaths, hash_distance=None):
+        self.replace_items([pair for pair in self.items if pair["file1"] not in filepaths and pair["file2"] not in filepaths])
+
+    def set_pairs(self, duplicate_pairs):
+        choices = {(pair["file1"], pair["file2"]): pair["choice"] for pair in self.items if pair["choice"] != self.KEEP_BOTH}
+        self.replace_items([{"file1": pair[0], "file2": pair[1], "choice": choices.get(pair[:2], self.KEEP_BOTH)} for pair in duplicate_pairs])
+
+    def append_pairs(self, duplicate_pairs):
+        if not duplicate_pairs:
+            return
+        first = len(self.items)
+        self.beginInsertRows(QtCore.QModelIndex(), first, first + len(duplicate_pairs) - 1)
+        for row, pair in enumerate(duplicate_pairs, first):
+            self.items.append({"file1": pair[0], "file2": pair[1], "choice": self.KEEP_BOTH})
+            self.rows_by_file[pair[0]].append(row)
+            self.rows_by_file[pair[1]].append(row)
+        self.endInsertRows()
+
+    def files_to_delete(self):
+        to_delete = set()
+        for pair in self.items:
+            if pair["choice"] == self.DELETE_LEFT:
+                to_delete.add(pair["file1"])
+            elif pair["choice"] == self.DELETE_RIGHT:
+                to_delete.add(pair["file2"])
+        return to_delete
+
+# Results model with one row per group of duplicates (see duplinator.grouping), kept up to date as the scan
+# finds new members and merges groups. A group's choice is the file to keep, with every other file in the group
+# deleted, or None to keep them all.
+class GroupListModel(ResultListModel):
+    ITEM_NAME = "group"
+
+    def __init__(self, loader, parent=None):
+        super().__init__(loader, parent)
+        self.group_rows = {}
+        self.file_groups = {}
+
+    def clear_lookups(self):
+        self.group_rows = {}
+        self.file_groups = {}
+
+    def rows_for_file(self, filepath):
+        row = self.group_rows.get(self.file_groups.get(filepath))
+        return None if row is None else [row]
+
+    def setData(self, index, value, role=Qt.ItemDataRole.EditRole):
+        if not index.isValid() or role != self.ChoiceRole:
+            return False
+        group = self.items[index.row()]
+        if value is not None and value not in (filepath for filepath, distance in group["files"]):
+            return False
+        group["choice"] = value
+        self.dataChanged.emit(index, index, [role])
+        return True
+
+    # Cycles through keeping every file and keeping each file of the group in turn
+    def step_choice(self, index, step):
+        group = self.items[index.row()]
+        options = [None] + [filepath for filepath, distance in group["files"]]
+        self.setData(index, options[(options.index(group["choice"]) + step) % len(options)], self.ChoiceRole)
+
+    # Applies an update from DuplicateGrouper: `changed` holds the new or grown groups and `removed` the ids of
+    # groups that were merged into another one
+    def update_groups(self, changed, removed):
+        if removed:
+            for row in sorted((self.group_rows[group_id] for group_id in removed if group_id in self.group_rows), reverse=True):
+                self.beginRemoveRows(QtCore.QModelIndex(), row, row)
+                del self.items[row]
+                self.endRemoveRows()
+            self.group_rows = {group["id"]: row for row, group in enumerate(self.items)}
+        new_groups = []
+        for group in changed:
+            for filepath, distance in group["files"]:
+                self.file_groups[filepath] = group["id"]
+            # A group that grew goes back to keeping every file, so nothing the user hasn't seen gets deleted
+            group = dict(group, choice=None)
+            row = self.group_rows.get(group["id"])
+            if row is None:
+                new_groups.append(group)
+            else:
+                self.items[row] = group
+                self.dataChanged.emit(self.index(row), self.index(row))
+        if new_groups:
+            first = len(self.items)
+            self.beginInsertRows(QtCore.QModelIndex(), first, first + len(new_groups) - 1)
+            for row, group in enumerate(new_groups, first):
+                self.group_rows[group["id"]] = row
+            self.items.extend(new_groups)
+            self.endInsertRows()
+
+    def index_items(self):
+        for row, group in enumerate(self.items):
+            self.group_rows[group["id"]] = row
+            for filepath, distance in group["files"]:
+                self.file_groups[filepath] = group["id"]
+
+    # Replaces every group, e.g. after regrouping at another threshold. A group keeps its choice only if it
+    # still holds exactly the same files.
+    def set_groups(self, groups):
+        choices = {frozenset(filepath for filepath, distance in group["files"]): group["choice"] for group in self.items if group["choice"] is not None}
+        self.replace_items([dict(group, choice=choices.get(frozenset(filepath for filepath, distance in group["files"]))) for group in groups])
+
+    # Takes deleted files out of their groups and drops groups left with a single file. A group whose best file
+    # was deleted keeps the user's choice, or its next file, in its place, measuring distances with hash_distance.
+    def remove_files(self, filepaths, hash_distance=None):
+        groups = []
+        for group in self.items:
+            files = [(filepath, distance) for filepath, distance in group["files"] if filepath not in filepaths]
+            if len(files) < 2:
+                continue
+            if group["keep"] in filepaths:
+                keep = group["choice"] if group["choice"] is not None else files[0][0]
+                others = [filepath for filepath, distance in files if filepath != keep]
+                files = [(keep, 0)] + [(filepath, hash_distance(keep, filepath) if hash_distance else None) for filepath in others]
+                group = dict(group, keep=keep)
+            groups.append(dict(group, files=files))
+        self.replace_items(groups)
+
+    # Keeps each group's best file under the scan's keep policy and marks the rest for deletion
+    def keep_best(self):
+        for group in self.items:
+            group["choice"] = group["keep"]
+        if self.items:
+            self.dataChanged.emit(self.index(0), self.index(len(self.items) - 1), [self.ChoiceRole])
+
+    def files_to_delete(self):
+        to_delete = set()
+        for group in self.items:
+            if group["choice"] is not None:
+                to_delete.update(filepath for filepath, distance in group["files"] if filepath != group["choice"])
+        return to_delete
+
+# Shared painting and mouse handling for the results delegates. Subclasses place their files with file_panes()
+# and can map clicks to a new choice in hit_test(). Clicking a thumbnail shows a larger preview and double
+# clicking opens the file, as the old labels did.
+class ResultDelegate(QtWidgets.QStyledItemDelegate):
+    ROW_HEIGHT = 250
+    THUMBNAIL_SIZE = THUMBNAIL_SIZE
+    MARGIN = 8
+
+    def sizeHint(self, option, index):
+        return QSize(option.rect.width(), self.ROW_HEIGHT)
+
+    def thumbnail_rect(self, pane):
+        return QtCore.QRect(pane.center().x() - self.THUMBNAIL_SIZE // 2, pane.top(), self.THUMBNAIL_SIZE, self.THUMBNAIL_SIZE)
+
+    def text_rect(self, pane):
+        thumb_rect = self.thumbnail_rect(pane)
+        return QtCore.QRect(pane.left(), thumb_rect.bottom() + self.MARGIN, pane.width(), pane.bottom() - thumb_rect.bottom() - self.MARGIN)
+
+    # [(filepath, pane rect), ...] for the files shown in a row; every subclass provides it
+    def file_panes(self, rect, item):
+        raise NotImplementedError
+
+    # The text under a file's thumbnail once its details have loaded
+    def file_text(self, info, rel_path, filepath, item):
+        return f"Filename: {rel_path}\nSize: {info['size_kb']:.2f} KB\nRes: {info['width']}x{info['height']}\nCreated: {info['created']}\nModified: {info['modified']}"
+
+    def paint_file(self, painter, option, model, filepath, pane, deleted, item):
+        details = model.file_details(filepath)
+        info, pixmap = details if details is not None else (None, None)
+        rel_path = model.relative_path(filepath)
+        thumb_rect = self.thumbnail_rect(pane)
+        painter.setPen(option.palette.color(QPalette.ColorRole.WindowText))
+        if pixmap is not None:
+            if deleted:
+                # Only the colour thumbnail is kept; the greyed out version is cheap to make at this size
+                pixmap = QPixmap.fromImage(pixmap.toImage().convertToFormat(QImage.Format.Format_Grayscale8))
+            painter.drawPixmap(thumb_rect.center().x() - pixmap.width() // 2, thumb_rect.center().y() - pixmap.height() // 2, pixmap)
+        if details is None:
+            painter.drawText(thumb_rect, Qt.AlignmentFlag.AlignCenter, "Loading...")
+            text = f"Filename: {rel_path}"
+        elif info is not None:
+            text = self.file_text(info, rel_path, filepath, item)
+        else:
+            text = f"{rel_path}\n[Error retrieving info]"
+        painter.drawText(self.text_rect(pane), Qt.AlignmentFlag.AlignHCenter | Qt.AlignmentFlag.AlignTop | Qt.TextFlag.TextWrapAnywhere, text)
+
+    # Returns ("choice", value) or ("file", filepath) for a point in a row, or None
+    def hit_test(self, rect, pos, item):
+        for filepath, pane in self.file_panes(rect, item):
+            if self.thumbnail_rect(pane).contains(pos):
+                return "file", filepath
+        return None
+
+    def editorEvent(self, event, model, option, index):
+        if event.type() not in (QtCore.QEvent.Type.MouseButtonPress, QtCore.QEvent.Type.MouseButtonDblClick):
+            return False
+        if event.button() != Qt.MouseButton.LeftButton:
+            return False
+        hit = self.hit_test(option.rect, event.position().toPoint(), index.data(ResultListModel.ItemRole))
+        if hit is None:
+            return False
+        kind, value = hit
+        if kind == "choice":
+            model.setData(index, value, ResultListModel.ChoiceRole)
+        elif event.type() == QtCore.QEvent.Type.MouseButtonDblClick:
+            open_image(value)
+        else:
+            self.popup = show_large_image(value)
+        return True
+
+    def helpEvent(self, event, view, option, index):
+        if event.type() == QtCore.QEvent.Type.ToolTip and index.isValid():
+            for filepath, pane in self.file_panes(option.rect, index.data(ResultListModel.ItemRole)):
+                if pane.contains(event.pos()):
+                    QtWidgets.QToolTip.showText(event.globalPos(), filepath, view)
+                    return True
+        return super().helpEvent(event, view, option, index)
+
+# Paints a pair row: both thumbnails with their file info, and a three-way Left/Neither/Right control between them
+class PairDelegate(ResultDelegate):
+    CHOICE_WIDTH = 180
+    CHOICE_LABELS = ("Left", "Neither", "Right")
+
+    # Splits a row into its left pane, choice control and right pane
+    def row_layout(self, rect):
+        rect = rect.adjusted(self.MARGIN, self.MARGIN, -self.MARGIN, -self.MARGIN)
+        pane_width = max(0, (rect.width() - self.CHOICE_WIDTH) // 2)
+        left = QtCore.QRect(rect.left(), rect.top(), pane_width, rect.height())
+        choice = QtCore.QRect(left.right() + 1, rect.top(), self.CHOICE_WIDTH, rect.height())
+        right = QtCore.QRect(choice.right() + 1, rect.top(), pane_width, rect.height())
+        return left, choice, right
+
+    def file_panes(self, rect, pair):
+        left, choice_rect, right = self.row_layout(rect)
+        return [(pair["file1"], left), (pair["file2"], right)]
+
+    # Centres of the three choice positions on the groove
+    def choice_points(self, choice_rect):
+        y = choice_rect.top() + self.THUMBNAIL_SIZE // 2
+        step = (choice_rect.width() - 40) // 2
+        return [QtCore.QPoint(choice_rect.left() + 20 + step * position, y) for position in range(3)]
+
+    def paint(self, painter, option, index):
+        model = index.model()
+        pair = index.data(ResultListModel.ItemRole)
+        painter.save()
+        painter.setRenderHint(QtGui.QPainter.RenderHint.Antialiasing)
+        left, choice_rect, right = self.row_layout(option.rect)
+        for filepath, pane, deleted in ((pair["file1"], left, pair["choice"] == PairListModel.DELETE_LEFT), (pair["file2"], right, pair["choice"] == PairListModel.DELETE_RIGHT)):
+            self.paint_file(painter, option, model, filepath, pane, deleted, pair)
+        self.paint_choice(painter, option, choice_rect, pair["choice"])
+        # Separator between pairs
+        painter.setPen(option.palette.color(QPalette.ColorRole.Mid))
+        painter.drawLine(option.rect.bottomLeft(), option.rect.bottomRight())
+        painter.restore()
+
+    # Drawn to match the stylesheet of the per-pair sliders this replaces
+    def paint_choice(self, painter, option, choice_rect, choice):
+        points = self.choice_points(choice_rect)
+        groove = QtCore.QRect(points[0].x() - 10, points[0].y() - 5, points[2].x() - points[0].x() + 20, 10)
+        painter.setPen(QtGui.QPen(QColor("#ffffff"), 2))
+        painter.setBrush(QColor("#5a5a5a"))
+        painter.drawRoundedRect(groove, 4, 4)
+        handle = QtCore.QRect(points[choice].x() - 7, points[choice].y() - 9, 14, 18)
+        painter.setPen(QColor("#777777"))
+        painter.setBrush(QColor("#b3b3b3"))
+        painter.drawRoundedRect(handle, 4, 4)
+        painter.setPen(option.palette.color(QPalette.ColorRole.WindowText))
+        for point, label in zip(points, self.CHOICE_LABELS):
+            painter.drawText(QtCore.QRect(point.x() - 30, point.y() + 14, 60, 20), Qt.AlignmentFlag.AlignCenter, label)
+
+    def hit_test(self, rect, pos, pair):
+        left, choice_rect, right = self.row_layout(rect)
+        if choice_rect.contains(pos):
+            points = self.choice_points(choice_rect)
+            if abs(pos.y() - points[0].y()) <= 35:
+                return "choice", min(range(3), key=lambda position: abs(points[position].x() - pos.x()))
+        return super().hit_test(rect, pos, pair)
+
+# Paints a group row: the best file under the keep policy first, then the rest of the group left to right, with
+# a "+N more" cell when they don't all fit. Clicking a file's details makes it the one to keep and clicking them
+# again keeps every file; files that will be deleted are greyed out and the kept one is framed.
+class GroupDelegate(ResultDelegate):
+    CELL_WIDTH = 190
+    KEEP_COLOUR = QColor(80, 200, 120)
+
+    # Returns ([(filepath, pane), ...] for the cells shown, the "+N more" pane or None, the hidden files)
+    def cells(self, rect, group):
+        rect = rect.adjusted(self.MARGIN, self.MARGIN, -self.MARGIN, -self.MARGIN)
+        capacity = max(1, rect.width() // self.CELL_WIDTH)
+        files = [filepath for filepath, distance in group["files"]]
+        shown = files if len(files) <= capacity else files[:max(1, capacity - 1)]
+        panes = [QtCore.QRect(rect.left() + position * self.CELL_WIDTH, rect.top(), self.CELL_WIDTH - self.MARGIN, rect.height()) for position in range(len(shown) + 1)]
+        more_pane = panes[len(shown)] if len(shown) < len(files) else None
+        return list(zip(shown, panes)), more_pane, files[len(shown):]
+
+    def file_panes(self, rect, group):
+        return self.cells(rect, group)[0]
+
+    def file_text(self, info, rel_path, filepath, group):
+        if filepath == group["keep"]:
+            label = "Best"
+        else:
+            label = f"Distance: {dict(group['files'])[filepath]}"
+        return f"{rel_path}\n{info['width']}x{info['height']}, {info['size_kb']:.0f} KB\n{label}"
+
+    def paint(self, painter, option, index):
+        model = index.model()
+        group = index.data(ResultListModel.ItemRole)
+        painter.save()
+        painter.setRenderHint(QtGui.QPainter.RenderHint.Antialiasing)
+        shown, more_pane, hidden = self.cells(option.rect, group)
+        for filepath, pane in shown:
+            deleted = group["choice"] is not None and filepath != group["choice"]
+            self.paint_file(painter, option, model, filepath, pane, deleted, group)
+            if filepath == group["choice"]:
+                painter.setPen(QtGui.QPen(self.KEEP_COLOUR, 3))
+                painter.setBrush(Qt.BrushStyle.NoBrush)
+                painter.drawRect(self.thumbnail_rect(pane).adjusted(-3, -3, 3, 3))
+        if more_pane is not None:
+            painter.setPen(option.palette.color(QPalette.ColorRole.WindowText))
+            painter.drawText(self.thumbnail_rect(more_pane), Qt.AlignmentFlag.AlignCenter, f"+{len(hidden)} more")
+        # Separator between groups
+        painter.setPen(option.palette.color(QPalette.ColorRole.Mid))
+        painter.drawLine(option.rect.bottomLeft(), option.rect.bottomRight())
+        painter.restore()
+
+    def hit_test(self, rect, pos, group):
+        for filepath, pane in self.file_panes(rect, group):
+            if self.text_rect(pane).contains(pos):
+                return "choice", None if group["choice"] == filepath else filepath
+        return super().hit_test(rect, pos, group)
+
+    def helpEvent(self, event, view, option, index):
+        if event.type() == QtCore.QEvent.Type.ToolTip and index.isValid():
+            shown, more_pane, hidden = self.cells(option.rect, index.data(ResultListModel.ItemRole))
+            if more_pane is not None and more_pane.contains(event.pos()):
+                text = "\n".join(hidden[:30]) + (f"\n... and {len(hidden) - 30} more" if len(hidden) > 30 else "")
+                QtWidgets.QToolTip.showText(event.globalPos(), text, view)
+                return True
+        return super().helpEvent(event, view, option, index)
+
+# Results list. Rows all have the same height so only the visible ones are ever laid out or painted.
+# The left and right arrow keys change the current row's choice.
+class ResultListView(QtWidgets.QListView):
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setUniformItemSizes(True)
+        self.setVerticalScrollMode(QtWidgets.QAbstractItemView.ScrollMode.ScrollPerPixel)
+        self.verticalScrollBar().setSingleStep(30)
+        self.setSelectionMode(QtWidgets.QAbstractItemView.SelectionMode.SingleSelection)
+        self.setMouseTracking(True)
+
+    def keyPressEvent(self, event):
+        index = self.currentIndex()
+        if index.isValid() and event.key() in (Qt.Key.Key_Left, Qt.Key.Key_Right):
+            self.model().step_choice(index, -1 if event.key() == Qt.Key.Key_Left else 1)
+            return
+        super().keyPressEvent(event)
 
 #Larger preview popout functionality      
 class ImagePopup(QWidget):
@@ -168,8 +777,6 @@ class MainWindow(QMainWindow):
         self.setWindowTitle("Duplinator")
         icon_path = resource_path("img/icon.png")
         self.setWindowIcon(QIcon(icon_path))
-        self.thumbnails = {}
-        self.pairs = []
         self.setup_ui()
         self.resize(800, 800)
 
@@ -197,7 +804,7 @@ class MainWindow(QMainWindow):
         file_types_label = QLabel("File Types:")
         file_types_layout.addWidget(file_types_label)
         self.file_type_checkboxes = {}
-        for ext in ['.png', '.jpg', '.jpeg', '.gif', '.bmp', '.tiff', '.webp']:
+        for ext in SUPPORTED_EXTENSIONS:
             checkbox = QCheckBox(ext)
             checkbox.setChecked(True)
             file_types_layout.addWidget(checkbox)
@@ -218,6 +825,16 @@ class MainWindow(QMainWindow):
         hash_size_layout.addWidget(hash_size_label)
         hash_size_layout.addWidget(self.hash_size_slider)
         hash_size_layout.addWidget(self.hash_size_value_label)
+        algorithm_label = QLabel("Algorithm:")
+        self.algorithm_combo = QComboBox()
+        self.algorithm_combo.addItem("Perceptual (pHash)", "phash")
+        self.algorithm_combo.addItem("Difference (dHash)", "dhash")
+        self.algorithm_combo.addItem("Average (aHash)", "ahash")
+        self.algorithm_combo.addItem("Wavelet (wHash)", "whash")
+        self.algorithm_combo.addItem("Colour (colorhash)", "colorhash")
+        self.algorithm_combo.setToolTip("How images are hashed. pHash is the most robust; dHash and aHash are quicker but more easily fooled; wHash needs a hash size of 4, 8, 16 or 32; colorhash compares colours only.")
+        hash_size_layout.addWidget(algorithm_label)
+        hash_size_layout.addWidget(self.algorithm_combo)
         params_layout.addLayout(hash_size_layout)
         threshold_layout = QHBoxLayout()
         threshold_label = QLabel("Threshold:")
@@ -246,33 +863,149 @@ class MainWindow(QMainWindow):
         subfolder_levels_layout.addStretch()
         params_layout.addLayout(subfolder_levels_layout)
         self.include_subfolders_checkbox.toggled.connect(self.subfolder_levels_spinbox.setEnabled)
+        self.skip_hidden_checkbox = QCheckBox("Skip hidden folders")
+        self.skip_hidden_checkbox.setToolTip("Don't look inside hidden subfolders, such as those starting with a dot.")
+        self.follow_symlinks_checkbox = QCheckBox("Follow links")
+        self.follow_symlinks_checkbox.setToolTip("Look inside subfolders that are symbolic links. Each linked folder is only scanned once, so links can't make the scan loop.")
+        subfolder_levels_layout.insertWidget(subfolder_levels_layout.count() - 1, self.skip_hidden_checkbox)
+        subfolder_levels_layout.insertWidget(subfolder_levels_layout.count() - 1, self.follow_symlinks_checkbox)
         
         self.multi_thread_checkbox = QCheckBox("Multi-thread")
         self.multi_thread_checkbox.setToolTip("Enable multi-threading for faster hash computation. Only required when scanning a folder with lots of large images. Default is 4.")
         thread_count_layout = QHBoxLayout()
         thread_count_label = QLabel("Threads:")
         self.thread_count_spinbox = QSpinBox()
-        self.thread_count_spinbox.setRange(1, 32)
+        self.thread_count_spinbox.setRange(0, 64)
+        self.thread_count_spinbox.setSpecialValueText("Auto")
         self.thread_count_spinbox.setValue(4)
         self.thread_count_spinbox.setEnabled(False)
+        self.thread_count_spinbox.setToolTip("Number of hashing workers. 'Auto' uses one per CPU core.")
+        backend_label = QLabel("Backend:")
+        self.backend_combo = QComboBox()
+        self.backend_combo.addItem("Threads", "thread")
+        self.backend_combo.addItem("Processes", "process")
+        self.backend_combo.setEnabled(False)
+        self.backend_combo.setToolTip("Processes use every CPU core and are fastest for local drives. Threads are lighter and suit slow network drives.")
         thread_count_layout.addWidget(self.multi_thread_checkbox)
         thread_count_layout.addWidget(thread_count_label)
         thread_count_layout.addWidget(self.thread_count_spinbox)
+        thread_count_layout.addWidget(backend_label)
+        thread_count_layout.addWidget(self.backend_combo)
+        memory_limit_label = QLabel("Memory:")
+        self.memory_limit_spinbox = QSpinBox()
+        self.memory_limit_spinbox.setRange(0, 1 << 20)
+        self.memory_limit_spinbox.setSingleStep(256)
+        self.memory_limit_spinbox.setSuffix(" MB")
+        self.memory_limit_spinbox.setSpecialValueText("Auto")
+        self.memory_limit_spinbox.setValue(0)
+        self.memory_limit_spinbox.setToolTip("Memory the images being decoded at once may take. Very large images wait for others to finish, are decoded at reduced size or, if even that won't fit, are skipped and listed when the scan ends. 'Auto' uses half the computer's memory.")
+        thread_count_layout.addWidget(memory_limit_label)
+        thread_count_layout.addWidget(self.memory_limit_spinbox)
         thread_count_layout.addStretch()
         params_layout.addLayout(thread_count_layout)
+
+        self.use_cache_checkbox = QCheckBox("Use hash cache")
+        self.use_cache_checkbox.setChecked(True)
+        self.use_cache_checkbox.setToolTip("Remember image hashes and thumbnails between scans so unchanged files don't need to be processed again. Default is on.")
+        also_hash_label = QLabel("Also cache:")
+        self.also_hash_entry = QLineEdit()
+        self.also_hash_entry.setPlaceholderText("e.g. 12, 16, dhash")
+        self.also_hash_entry.setToolTip("Other hash sizes or algorithms to work out while each image is open and keep in the cache, so scanning again with any of them is almost instant. Useful for trying different hash sizes. Enter sizes, algorithms (ahash, dhash, phash, whash, colorhash) or both, like whash:16.")
+        cache_layout = QHBoxLayout()
+        cache_layout.addWidget(self.use_cache_checkbox)
+        cache_layout.addWidget(also_hash_label)
+        cache_layout.addWidget(self.also_hash_entry)
+        cache_layout.addStretch()
+        params_layout.addLayout(cache_layout)
+        self.use_cache_checkbox.toggled.connect(self.also_hash_entry.setEnabled)
+
+        self.exact_first_checkbox = QCheckBox("Find exact copies first")
+        self.exact_first_checkbox.setToolTip("Match byte-identical files by their contents before hashing, so only one copy of each needs to be processed. Speeds up folders with lots of straight copies.")
+        params_layout.addWidget(self.exact_first_checkbox)
+
+        self.cascade_checkbox = QCheckBox("Fast pre-filter (cascade)")
+        self.cascade_checkbox.setToolTip("Compare a quick hash of each photo's built-in thumbnail first and only fully process the images that might have a duplicate. Much faster on folders of camera photos, but a very small number of pairs may be missed.")
+        params_layout.addWidget(self.cascade_checkbox)
+
+        self.reduced_decode_checkbox = QCheckBox("Fast decode (reduced size)")
+        self.reduced_decode_checkbox.setChecked(True)
+        self.reduced_decode_checkbox.setToolTip("Decode each image only as large as hashing needs, which is several times faster on large photos. Hashes may differ from a full-size decode by a bit or two; untick to decode every image in full. Both kinds are cached separately.")
+        params_layout.addWidget(self.reduced_decode_checkbox)
+
+        frames_layout = QHBoxLayout()
+        self.frames_checkbox = QCheckBox("Compare animation frames")
+        self.frames_checkbox.setToolTip("Also compare a sample of the frames of animated GIF, WebP and PNG images, so copies that were resized, trimmed or start on a different frame are found. Animated images are then only paired with each other this way.")
+        frame_count_label = QLabel("Frames:")
+        self.frame_count_spinbox = QSpinBox()
+        self.frame_count_spinbox.setRange(2, 256)
+        self.frame_count_spinbox.setValue(DEFAULT_MAX_FRAMES)
+        self.frame_count_spinbox.setEnabled(False)
+        self.frame_count_spinbox.setToolTip("Most frames to sample from each animation, spread evenly over it.")
+        frames_layout.addWidget(self.frames_checkbox)
+        frames_layout.addWidget(frame_count_label)
+        frames_layout.addWidget(self.frame_count_spinbox)
+        frames_layout.addStretch()
+        params_layout.addLayout(frames_layout)
+        self.frames_checkbox.toggled.connect(self.frame_count_spinbox.setEnabled)
+
+        group_layout = QHBoxLayout()
+        self.group_checkbox = QCheckBox("Group duplicates")
+        self.group_checkbox.setToolTip("Show each set of similar images as one group instead of every pair between them.")
+        keep_policy_label = QLabel("Keep:")
+        self.keep_policy_combo = QComboBox()
+        self.keep_policy_combo.addItem("Highest resolution", "resolution")
+        self.keep_policy_combo.addItem("Largest file", "size")
+        self.keep_policy_combo.addItem("Oldest", "oldest")
+        self.keep_policy_combo.setEnabled(False)
+        self.keep_policy_combo.setToolTip("Which image of each group is suggested as the one to keep.")
+        group_layout.addWidget(self.group_checkbox)
+        group_layout.addWidget(keep_policy_label)
+        group_layout.addWidget(self.keep_policy_combo)
+        group_layout.addStretch()
+        params_layout.addLayout(group_layout)
+        self.group_checkbox.toggled.connect(self.keep_policy_combo.setEnabled)
         main_layout.addWidget(params_frame)
 
         self.hash_size_slider.valueChanged.connect(lambda: self.hash_size_value_label.setText(str(self.hash_size_slider.value())))
         self.threshold_slider.valueChanged.connect(lambda: self.threshold_value_label.setText(str(self.threshold_slider.value())))
         self.multi_thread_checkbox.toggled.connect(self.toggle_thread_count)
 
-        # Scroll area
-        self.scroll_area = QScrollArea()
-        self.scroll_area.setWidgetResizable(True)
-        self.inner_widget = QtWidgets.QWidget()
-        self.inner_layout = QVBoxLayout(self.inner_widget)
-        self.scroll_area.setWidget(self.inner_widget)
-        main_layout.addWidget(self.scroll_area)
+        # Results can be reviewed while a scan is running but only deleted once it has finished, since deletions
+        # are applied to the finished scan's index, and one deletion runs at a time
+        self.scanning = False
+        self.deleting = False
+        # Once a scan has finished, changing the threshold or file types re-filters its hash index rather than
+        # rescanning. The timer waits for the slider to settle before querying.
+        self.scan_index = None
+        self.requery_thread = None
+        self.warmup_thread = None
+        self.requery_timer = QtCore.QTimer(self)
+        self.requery_timer.setSingleShot(True)
+        self.requery_timer.setInterval(150)
+        self.requery_timer.timeout.connect(self.start_requery)
+        self.threshold_slider.valueChanged.connect(lambda: self.requery_timer.start())
+        for checkbox in self.file_type_checkboxes.values():
+            checkbox.toggled.connect(lambda: self.requery_timer.start())
+
+        # Results list, showing either pairs or groups depending on how the last scan was run
+        self.thumbnail_loader = ThumbnailLoader(parent=self)
+        self.pair_model = PairListModel(self.thumbnail_loader, self)
+        self.group_model = GroupListModel(self.thumbnail_loader, self)
+        self.results_model = self.pair_model
+        self.results_view = ResultListView()
+        self.pair_delegate = PairDelegate(self.results_view)
+        self.group_delegate = GroupDelegate(self.results_view)
+        self.results_view.setModel(self.results_model)
+        self.results_view.setItemDelegate(self.pair_delegate)
+        self.keep_best_button = QPushButton("Keep Best in Every Group")
+        self.keep_best_button.setToolTip("Mark every image except the best one of each group for deletion.")
+        self.keep_best_button.clicked.connect(self.group_model.keep_best)
+        self.keep_best_button.hide()
+        main_layout.addWidget(self.keep_best_button)
+        main_layout.addWidget(self.results_view)
+        self.no_results_label = QLabel("No duplicate images found.")
+        self.no_results_label.hide()
+        main_layout.addWidget(self.no_results_label)
 
         # New bottom layout with icon buttons
         bottom_layout = QHBoxLayout()
@@ -308,9 +1041,23 @@ class MainWindow(QMainWindow):
         self.status_bar = QtWidgets.QStatusBar()
         self.setStatusBar(self.status_bar)
         self.status_bar.showMessage("Ready")
+        self.thumbnail_loader.problem.connect(self.status_bar.showMessage)
 
     def toggle_thread_count(self, checked):
         self.thread_count_spinbox.setEnabled(checked)
+        self.backend_combo.setEnabled(checked)
+
+    # Switches the results list between pairs and groups
+    def set_results_mode(self, grouped):
+        model = self.group_model if grouped else self.pair_model
+        if model is not self.results_model:
+            selection_model = self.results_view.selectionModel()
+            self.results_model = model
+            self.results_view.setModel(model)
+            self.results_view.setItemDelegate(self.group_delegate if grouped else self.pair_delegate)
+            selection_model.deleteLater()
+        self.keep_best_button.setVisible(grouped)
+        self.keep_best_button.setEnabled(False)
 
     def select_folder(self):
         folder = QtWidgets.QFileDialog.getExistingDirectory(self, "Select Folder")
@@ -326,17 +1073,35 @@ class MainWindow(QMainWindow):
         if not included_extensions:
             QMessageBox.critical(self, "Error", "No file types selected.")
             return
-        self.thumbnails.clear()
-        for widget in self.inner_widget.findChildren(QtWidgets.QWidget):
-            widget.deleteLater()
-        self.pairs = []
-        self.start_button.setEnabled(True)
+        algorithm = self.algorithm_combo.currentData()
+        hash_size = self.hash_size_slider.value()
+        if algorithm == "whash" and hash_size & (hash_size - 1):
+            QMessageBox.critical(self, "Error", "Wavelet hashing needs a hash size of 4, 8, 16 or 32.")
+            return
+        try:
+            extra_hashes = parse_hash_specs(self.also_hash_entry.text(), algorithm, hash_size) if self.use_cache_checkbox.isChecked() else []
+        except ValueError as e:
+            QMessageBox.critical(self, "Error", f"Invalid 'Also cache' entry: {e}")
+            return
+        grouped = self.group_checkbox.isChecked()
+        self.stop_index_threads()
+        self.scan_index = None
+        self.set_results_mode(grouped)
+        for model in (self.pair_model, self.group_model):
+            model.clear(folder_path)
+        self.no_results_label.hide()
+        self.scanning = True
+        self.start_button.setEnabled(False)
+        self.delete_button.setEnabled(False)
         self.status_bar.showMessage("Scanning...")
-        self.progress_dialog = QProgressDialog("Scanning for duplicates... This can take a while if there's lots of images", None, 0, 0, self)
-        self.progress_dialog.setWindowModality(QtCore.Qt.WindowModality.ApplicationModal)
+        # Non-modal so results can be reviewed while the scan is still running
+        self.progress_dialog = QProgressDialog("Scanning for duplicates...", "Cancel", 0, 0, self)
+        self.progress_dialog.setWindowModality(QtCore.Qt.WindowModality.NonModal)
         self.progress_dialog.setMinimumDuration(0)
+        self.progress_dialog.setAutoClose(False)
+        self.progress_dialog.setAutoReset(False)
+        self.progress_dialog.canceled.connect(self.cancel_scan)
         self.progress_dialog.show()
-        hash_size = self.hash_size_slider.value()
         threshold = self.threshold_slider.value()
         include_subfolders = self.include_subfolders_checkbox.isChecked()
         subfolder_levels = self.subfolder_levels_spinbox.value()
@@ -345,224 +1110,183 @@ class MainWindow(QMainWindow):
         else:
             max_depth = 0
         multi_thread = self.multi_thread_checkbox.isChecked()
-        num_threads = self.thread_count_spinbox.value() if multi_thread else 1
-        self.scan_thread = ScanThread(folder_path, hash_size, threshold, max_depth, included_extensions, multi_thread, num_threads)
+        num_threads = (self.thread_count_spinbox.value() or "auto") if multi_thread else 1
+        backend = self.backend_combo.currentData()
+        use_cache = self.use_cache_checkbox.isChecked()
+        cache_path = default_cache_path() if use_cache else None
+        thumbnail_cache_path = default_thumbnail_cache_path() if use_cache else None
+        self.thumbnail_loader.cache_path = thumbnail_cache_path
+        keep_policy = self.keep_policy_combo.currentData() if grouped else None
+        self.scan_thread = ScanThread(folder_path, hash_size, threshold, max_depth, included_extensions, multi_thread, num_threads, cache_path, backend, self.exact_first_checkbox.isChecked(), thumbnail_cache_path, keep_policy, self.skip_hidden_checkbox.isChecked(), self.follow_symlinks_checkbox.isChecked(), algorithm, self.cascade_checkbox.isChecked(), extra_hashes, (self.memory_limit_spinbox.value() << 20) or "auto", self.reduced_decode_checkbox.isChecked(), FrameOptions(self.frame_count_spinbox.value()) if self.frames_checkbox.isChecked() else None)
+        self.thumbnail_loader.file_stat = self.scan_thread.scanner.file_stat
+        self.scan_query = (0, threshold, tuple(included_extensions))
+        self.scan_keep_policy = keep_policy
+        self.scan_thread.progress_changed.connect(self.on_scan_progress)
+        self.scan_thread.pairs_found.connect(self.on_scan_pairs)
+        self.scan_thread.groups_changed.connect(self.on_scan_groups)
         self.scan_thread.finished.connect(self.on_scan_finished)
         self.scan_thread.start()
 
+    def cancel_scan(self):
+        self.progress_dialog.setLabelText("Cancelling...")
+        self.scan_thread.cancel()
+
+    def on_scan_progress(self, progress):
+        if self.scan_thread.scanner.cancelled:
+            return
+        done = progress["hashed"] + progress["cached"] + progress["failed"] + progress["skipped"]
+        if progress["walk_done"] and progress["stage"] == "hashing":
+            self.progress_dialog.setRange(0, max(progress["queued"], 1))
+            self.progress_dialog.setValue(done)
+        else:
+            self.progress_dialog.setRange(0, 0)
+        text = f"Found {progress['discovered']} images"
+        if progress["stage"] == "comparing file contents":
+            text += "\nComparing file contents to find exact copies..."
+        else:
+            text += f"\nProcessed {done} ({progress['hash_rate']:.1f} images/s)"
+            if progress["cached"]:
+                text += f", {progress['cached']} from cache"
+            if progress["refined"]:
+                text += f"\n{progress['refined']} possible duplicate(s) checked in full"
+            if progress["failed"] or progress["skipped"]:
+                text += f"\n{progress['failed']} unreadable, {progress['skipped']} too large to decode"
+        text += f"\n{progress['pairs']} duplicate pair(s) found so far"
+        if "groups" in progress:
+            text += f" in {progress['groups']} group(s)"
+        self.progress_dialog.setLabelText(text)
+        text = f"Scanning... {done} of {progress['discovered']} images processed, {progress['pairs']} pair(s) found"
+        if progress["stats"]:
+            text += f"  [{progress['stats']}]"
+        self.status_bar.showMessage(text)
+
+    # Results arriving from the scan are timed as its results stage
+    def on_scan_pairs(self, duplicate_pairs):
+        with self.scan_thread.scanner.scan_stats.stage("results", len(duplicate_pairs)):
+            self.add_result_pairs(duplicate_pairs)
+
+    def on_scan_groups(self, changed, removed):
+        with self.scan_thread.scanner.scan_stats.stage("results", len(changed) + len(removed)):
+            self.update_result_groups(changed, removed)
+
     def on_scan_finished(self, result):
-        self.progress_dialog.setLabelText("Processing results... Duplinator may appear unresponsive for a moment")
-        QApplication.processEvents()
+        self.progress_dialog.hide()
+        self.scanning = False
         if isinstance(result, Exception):
-            self.progress_dialog.hide()
             QMessageBox.critical(self, "Error", str(result))
-        else:
-            self.display_results(result)
-        self.progress_dialog.hide()
+        elif not self.results_model.rowCount():
+            self.no_results_label.show()
         self.start_button.setEnabled(True)
-        self.status_bar.showMessage("Done.")
+        self.delete_button.setEnabled(self.can_delete() and bool(self.results_model.rowCount()))
+        problems = self.scan_thread.problems
+        if self.scan_thread.scanner.cancelled:
+            self.status_bar.showMessage(f"Scan cancelled. {self.results_model.rowCount()} {self.results_model.ITEM_NAME}(s) found before stopping.")
+        elif problems:
+            self.status_bar.showMessage(f"Done. {len(problems)} image(s) couldn't be processed.")
+        else:
+            self.status_bar.showMessage("Done.")
+        if problems and not isinstance(result, Exception):
+            lines = [f"{problem.filepath}: {problem.message}" + (" (skipped)" if problem.status == "skipped" else "") for problem in problems[:20]]
+            if len(problems) > 20:
+                lines.append(f"... and {len(problems) - 20} more")
+            QMessageBox.warning(self, "Warning", f"{len(problems)} image(s) couldn't be processed and were left out of the results:\n\n" + "\n".join(lines))
+        scanner = self.scan_thread.scanner
+        if scanner.index is not None:
+            self.scan_index = scanner.index
+            # Bumped whenever files are removed from the index, so results queried before that are redone
+            self.index_generation = 0
+            self.scanned_extensions = scanner.included_extensions
+            self.shown_query = self.scan_query
+            self.file_attributes = self.scan_thread.grouper.attributes if self.scan_thread.grouper is not None else None
+            if self.warmup_thread is not None:
+                # Already cancelled by run_scan, so this returns almost at once
+                self.warmup_thread.wait()
+            self.warmup_thread = IndexWarmupThread(self.scan_index, self.threshold_slider.maximum())
+            self.warmup_thread.start()
+            # Catches up with any threshold or file type changes made during the scan
+            self.start_requery()
 
-    def display_results(self, duplicate_pairs):
-        self.pairs = []
-        if not duplicate_pairs:
-            no_duplicates_label = QLabel("No duplicate images found.")
-            self.inner_layout.addWidget(no_duplicates_label)
+    # Cancels matching for a previous scan's index; the threads finish on their own shortly after
+    def stop_index_threads(self):
+        self.requery_timer.stop()
+        for thread in (self.requery_thread, self.warmup_thread):
+            if thread is not None:
+                thread.cancel()
+
+    # Re-filters the last scan's results for the current threshold and file types, one query at a time;
+    # changes made while a query runs are picked up when it finishes
+    def start_requery(self):
+        if self.scan_index is None or (self.requery_thread is not None and self.requery_thread.isRunning()):
+            return
+        threshold = self.threshold_slider.value()
+        checked = [ext for ext in self.file_type_checkboxes if self.file_type_checkboxes[ext].isChecked()]
+        included_extensions = [ext for ext in checked if ext in self.scanned_extensions]
+        query = (self.index_generation, threshold, tuple(included_extensions))
+        if query == self.shown_query:
+            self.show_requery_status(checked)
+            return
+        if threshold > self.scan_index.max_distance:
+            self.status_bar.showMessage(f"Matching at threshold {threshold}...")
+        # Only the types that were scanned can be filtered; None means every one of them
+        extension_filter = included_extensions if len(included_extensions) < len(self.scanned_extensions) else None
+        thread = RequeryThread(self.scan_index, threshold, extension_filter, self.scan_keep_policy, self.file_attributes)
+        thread.finished.connect(lambda result: self.on_requery_finished(thread, query, checked, result))
+        self.requery_thread = thread
+        thread.start()
+
+    def on_requery_finished(self, thread, query, checked, result):
+        if thread.cancel_event.is_set():
+            # From a previous scan; a query for the current one may have been held back behind it
+            self.start_requery()
+            return
+        if isinstance(result, Exception):
+            QMessageBox.critical(self, "Error", str(result))
+            return
+        if self.scan_keep_policy is None:
+            self.pair_model.set_pairs(result)
         else:
-            folder_path = self.folder_entry.text()
-            for i, (filepath1, filepath2) in enumerate(duplicate_pairs):
-                if i > 0:
-                    separator = QFrame()
-                    separator.setFrameShape(QFrame.Shape.HLine)
-                    self.inner_layout.addWidget(separator)
-                pair_layout = QHBoxLayout()
-                # Left image processing
-                try:
-                    stat1 = os.stat(filepath1)
-                    size_kb1 = stat1.st_size / 1024
-                    created1 = datetime.fromtimestamp(stat1.st_ctime).strftime('%Y-%m-%d %H:%M:%S')
-                    modified1 = datetime.fromtimestamp(stat1.st_mtime).strftime('%Y-%m-%d %H:%M:%S')
-                    with Image.open(filepath1) as img1:
-                        width1, height1 = img1.size
-                        if filepath1 not in self.thumbnails:
-                            max_size = 150
-                            if width1 > height1:
-                                new_width1 = max_size
-                                new_height1 = int((height1 / width1) * max_size)
-                            else:
-                                new_height1 = max_size
-                                new_width1 = int((width1 / height1) * max_size)
-                            thumbnail1 = img1.resize((new_width1, new_height1), Image.Resampling.LANCZOS).convert("RGB")
-                            grey_thumbnail1 = thumbnail1.convert("L").convert("RGB")
-                            qt_img1 = QImage(thumbnail1.tobytes(), thumbnail1.width, thumbnail1.height, thumbnail1.width * 3, QImage.Format.Format_RGB888)
-                            grey_qt_img1 = QImage(grey_thumbnail1.tobytes(), grey_thumbnail1.width, grey_thumbnail1.height, grey_thumbnail1.width * 3, QImage.Format.Format_RGB888)
-                            self.thumbnails[filepath1] = {
-                                "original": QPixmap.fromImage(qt_img1),
-                                "grey": QPixmap.fromImage(grey_qt_img1)
-                            }
-                except Exception as e:
-                    print(f"Error processing {filepath1}: {e}")
-                    size_kb1, width1, height1, created1, modified1 = None, 0, 0, "Unknown", "Unknown"
-                    self.thumbnails[filepath1] = None
-                left_frame = QFrame()
-                left_layout = QVBoxLayout(left_frame)
-                rel_path1 = os.path.relpath(filepath1, folder_path)
-                if size_kb1 is not None:
-                    thumbnail_label1 = ClickableLabel(filepath1)
-                    if self.thumbnails[filepath1]:
-                        thumbnail_label1.setPixmap(self.thumbnails[filepath1]["original"])
-                    else:
-                        thumbnail_label1.setText("[Thumbnail Error]")
-                    left_layout.addWidget(thumbnail_label1)
-                    info_text1 = f"Filename: {rel_path1}\nSize: {size_kb1:.2f} KB\nRes: {width1}x{height1}\nCreated: {created1}\nModified: {modified1}"
-                    info_label1 = QLabel(info_text1)
-                    info_label1.setToolTip(filepath1)
-                    info_label1.setWordWrap(True)
-                    left_layout.addWidget(info_label1)
-                else:
-                    error_label1 = QLabel(f"{rel_path1}\n[Error retrieving info]")
-                    left_layout.addWidget(error_label1)
-                pair_layout.addWidget(left_frame, stretch=1)
-
-                choice_frame = QFrame()
-                choice_layout = QVBoxLayout(choice_frame)
-                choice_label = QLabel("Delete which image?")
-                choice_layout.addWidget(choice_label)
-                
-                slider = NonWheelSlider(Qt.Orientation.Horizontal)
-                slider.setMinimum(0)  # Left: Delete left image
-                slider.setMaximum(2)  # Right: Delete right image
-                slider.setValue(1)   # Center: Neither (default)
-                slider.setTickPosition(QSlider.TickPosition.TicksBelow)
-                slider.setTickInterval(1)
-                slider.setSingleStep(1)
-                slider.setPageStep(1)
-                #Stylesheet for slider customisation
-                slider.setStyleSheet("""
-                    QSlider::groove:horizontal {
-                        border: 5px solid #fff;
-                        background: #5a5a5a;
-                        height: 10px;
-                        border-radius: 4px;
-                    }
-                    QSlider::sub-page:horizontal {
-                        background: #5a5a5a;
-                    }
-                    QSlider::add-page:horizontal {
-                        background: #5a5a5a;
-                    }
-                    QSlider::handle:horizontal {
-                        background: #b3b3b3;
-                        border: 1px solid #777;
-                        width: 13px;
-                        margin-top: -2px;
-                        margin-bottom: -2px;
-                        border-radius: 4px;
-                    }
-                """)
-                choice_layout.addWidget(slider)
-
-                # Labels below slider
-                labels_layout = QHBoxLayout()
-                left_label = QLabel("Left")
-                neither_label = QLabel("Neither")
-                right_label = QLabel("Right")
-                labels_layout.addStretch(1)
-                labels_layout.addWidget(left_label)
-                labels_layout.addStretch(1)
-                labels_layout.addWidget(neither_label)
-                labels_layout.addStretch(1)
-                labels_layout.addWidget(right_label)
-                labels_layout.addStretch(1)
-                choice_layout.addLayout(labels_layout)
-                pair_layout.addWidget(choice_frame, stretch=0)
-
-                # Right image processing
-                try:
-                    stat2 = os.stat(filepath2)
-                    size_kb2 = stat2.st_size / 1024
-                    created2 = datetime.fromtimestamp(stat2.st_ctime).strftime('%Y-%m-%d %H:%M:%S')
-                    modified2 = datetime.fromtimestamp(stat2.st_mtime).strftime('%Y-%m-%d %H:%M:%S')
-                    with Image.open(filepath2) as img2:
-                        width2, height2 = img2.size
-                        if filepath2 not in self.thumbnails:
-                            max_size = 150
-                            if width2 > height2:
-                                new_width2 = max_size
-                                new_height2 = int((height2 / width2) * max_size)
-                            else:
-                                new_height2 = max_size
-                                new_width2 = int((width2 / height2) * max_size)
-                            thumbnail2 = img2.resize((new_width2, new_height2), Image.Resampling.LANCZOS).convert("RGB")
-                            grey_thumbnail2 = thumbnail2.convert("L").convert("RGB")
-                            qt_img2 = QImage(thumbnail2.tobytes(), thumbnail2.width, thumbnail2.height, thumbnail2.width * 3, QImage.Format.Format_RGB888)
-                            grey_qt_img2 = QImage(grey_thumbnail2.tobytes(), grey_thumbnail2.width, grey_thumbnail2.height, grey_thumbnail2.width * 3, QImage.Format.Format_RGB888)
-                            self.thumbnails[filepath2] = {
-                                "original": QPixmap.fromImage(qt_img2),
-                                "grey": QPixmap.fromImage(grey_qt_img2)
-                            }
-                except Exception as e:
-                    print(f"Error processing {filepath2}: {e}")
-                    size_kb2, width2, height2, created2, modified2 = None, 0, 0, "Unknown", "Unknown"
-                    self.thumbnails[filepath2] = None
-                right_frame = QFrame()
-                right_layout = QVBoxLayout(right_frame)
-                rel_path2 = os.path.relpath(filepath2, folder_path)
-                if size_kb2 is not None:
-                    thumbnail_label2 = ClickableLabel(filepath2)
-                    if self.thumbnails[filepath2]:
-                        thumbnail_label2.setPixmap(self.thumbnails[filepath2]["original"])
-                    else:
-                        thumbnail_label2.setText("[Thumbnail Error]")
-                    right_layout.addWidget(thumbnail_label2)
-                    info_text2 = f"Filename: {rel_path2}\nSize: {size_kb2:.2f} KB\nRes: {width2}x{height2}\nCreated: {created2}\nModified: {modified2}"
-                    info_label2 = QLabel(info_text2)
-                    info_label2.setToolTip(filepath2)
-                    info_label2.setWordWrap(True)
-                    right_layout.addWidget(info_label2)
-                else:
-                    error_label2 = QLabel(f"{rel_path2}\n[Error retrieving info]")
-                    right_layout.addWidget(error_label2)
-                pair_layout.addWidget(right_frame, stretch=1)
-
-                self.inner_layout.addLayout(pair_layout)
-                self.pairs.append({
-                    "file1": filepath1,
-                    "file2": filepath2,
-                    "choice": 1,
-                    "left_label": thumbnail_label1,
-                    "right_label": thumbnail_label2
-                })
-                slider.valueChanged.connect(lambda value, idx=i: self.update_choice(idx, value))
-                
-                # Adding this bit to stop the application going non-responsive when processing a large number of files
-                if i % 10 == 0:
-                    QApplication.processEvents()
-            self.delete_button.setEnabled(True)
-
-    def update_choice(self, index, value):
-        pair = self.pairs[index]
-        pair["choice"] = value
-        left_label = pair["left_label"]
-        right_label = pair["right_label"]
-        if self.thumbnails[pair["file1"]] is not None:
-            if value == 0:  # Left selected for deletion
-                left_label.setPixmap(self.thumbnails[pair["file1"]]["grey"])
-            else:
-                left_label.setPixmap(self.thumbnails[pair["file1"]]["original"])
-        if self.thumbnails[pair["file2"]] is not None:
-            if value == 2:  # Right selected for deletion
-                right_label.setPixmap(self.thumbnails[pair["file2"]]["grey"])
-            else:
-                right_label.setPixmap(self.thumbnails[pair["file2"]]["original"])
+            self.group_model.set_groups(result)
+        self.shown_query = query
+        has_results = bool(self.results_model.rowCount())
+        self.no_results_label.setVisible(not has_results)
+        self.delete_button.setEnabled(has_results and self.can_delete())
+        self.keep_best_button.setEnabled(has_results)
+        self.show_requery_status(checked)
+        self.start_requery()
+
+    def show_requery_status(self, checked):
+        text = f"Showing {self.results_model.rowCount()} {self.results_model.ITEM_NAME}(s) at threshold {self.shown_query[1]}."
+        unscanned = [ext for ext in checked if ext not in self.scanned_extensions]
+        if unscanned:
+            text += f" Scan again to include {', '.join(unscanned)} files."
+        self.status_bar.showMessage(text)
+
+    def closeEvent(self, event):
+        self.stop_index_threads()
+        for thread in (self.requery_thread, self.warmup_thread):
+            if thread is not None:
+                thread.wait()
+        super().closeEvent(event)
+
+    # Appends pairs to the results list; called with each batch of pairs while a scan is still running
+    def add_result_pairs(self, duplicate_pairs):
+        self.pair_model.append_pairs(duplicate_pairs)
+        if self.pair_model.rowCount():
+            self.delete_button.setEnabled(self.can_delete())
+
+    # Applies a batch of group changes from a grouped scan
+    def update_result_groups(self, changed, removed):
+        self.group_model.update_groups(changed, removed)
+        if self.group_model.rowCount():
+            self.delete_button.setEnabled(self.can_delete())
+            self.keep_best_button.setEnabled(True)
+
+    # Whether the results can be deleted from now: not while a scan or another deletion is running
+    def can_delete(self):
+        return not self.scanning and not self.deleting
 
     def delete_selected(self):
-        to_delete = set()
-        for pair in self.pairs:
-            choice = pair["choice"]
-            if choice == 0:
-                to_delete.add(pair["file1"])
-            elif choice == 2:
-                to_delete.add(pair["file2"])
+        to_delete = self.results_model.files_to_delete()
         if not to_delete:
             QMessageBox.information(self, "Info", "No images selected for deletion.")
             return
@@ -572,17 +1296,41 @@ class MainWindow(QMainWindow):
             QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No
         )
         if confirm == QMessageBox.StandardButton.Yes:
-            for file in to_delete:
-                try:
-                    os.remove(file)
-                except Exception as e:
-                    QMessageBox.critical(self, "Error", f"Failed to delete {file}: {e}")
-            QMessageBox.information(self, "Info", "Selected images deleted.")
-            # Re-run the scan to refresh the list
-            self.run_scan()
+            self.deleting = True
+            self.start_button.setEnabled(False)
+            self.delete_button.setEnabled(False)
+            self.status_bar.showMessage(f"Deleting {len(to_delete)} image(s)...")
+            self.delete_thread = DeleteThread(to_delete)
+            self.delete_thread.progress_changed.connect(lambda count: self.status_bar.showMessage(f"Deleting... {count} of {len(to_delete)} image(s) done"))
+            self.delete_thread.finished.connect(self.on_delete_finished)
+            self.delete_thread.start()
+
+    # Drops the deleted files from the results and the scan's index instead of scanning the folder again
+    def on_delete_finished(self, deleted, failed):
+        self.deleting = False
+        deleted_files = set(deleted)
+        self.results_model.remove_files(deleted_files, self.scan_thread.scanner.hash_distance)
+        self.start_button.setEnabled(not self.scanning)
+        has_results = bool(self.results_model.rowCount())
+        self.no_results_label.setVisible(not has_results)
+        self.delete_button.setEnabled(has_results and self.can_delete())
+        self.keep_best_button.setEnabled(has_results)
+        self.status_bar.showMessage(f"{len(deleted)} image(s) deleted.")
+        if self.scan_index is not None and deleted:
+            self.scan_index.remove(deleted)
+            # Re-querying also splits groups that were only held together by a deleted file
+            self.index_generation += 1
+            self.start_requery()
+        if failed:
+            lines = [f"{filepath}: {error}" for filepath, error in failed[:20]]
+            if len(failed) > 20:
+                lines.append(f"... and {len(failed) - 20} more")
+            QMessageBox.critical(self, "Error", f"Failed to delete {len(failed)} image(s):\n\n" + "\n".join(lines))
 
 # Run the application
 if __name__ == "__main__":
+    # Needed so the process hashing backend works from a frozen PyInstaller build
+    multiprocessing.freeze_support()
     app = QtWidgets.QApplication([])
     apply_dark_theme(app)
     window = MainWindow()
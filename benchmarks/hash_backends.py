@@ -0,0 +1,48 @@
+# Compares the thread and process hashing backends on the same folder of images.
+#
+#   python benchmarks/hash_backends.py <folder> [--hash-size 8] [--workers auto] [--repeat 3]
+#
+# Both backends hash exactly the same file list and the hashes are checked against each other.
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from duplinator import list_files, hash_files_parallel, default_worker_count, SUPPORTED_EXTENSIONS
+
+
+def time_backend(filepaths, hash_size, backend, workers):
+    start = time.perf_counter()
+    hashes = dict(hash_files_parallel(filepaths, hash_size, backend, workers))
+    return time.perf_counter() - start, hashes
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the thread and process hashing backends")
+    parser.add_argument("folder")
+    parser.add_argument("--hash-size", type=int, default=8)
+    parser.add_argument("--workers", default="auto")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+    workers = args.workers if args.workers == "auto" else int(args.workers)
+
+    filepaths = list(list_files(args.folder, None, SUPPORTED_EXTENSIONS))
+    print(f"{len(filepaths)} files, {workers if workers != 'auto' else default_worker_count()} workers, hash size {args.hash_size}")
+    results = {}
+    for backend in ("thread", "process"):
+        times = []
+        for _ in range(args.repeat):
+            elapsed, hashes = time_backend(filepaths, args.hash_size, backend, workers)
+            times.append(elapsed)
+        results[backend] = hashes
+        best = min(times)
+        print(f"{backend:>8}: best {best:.2f}s  ({len(filepaths) / best:.1f} files/s)")
+    if results["thread"] != results["process"]:
+        print("WARNING: backends produced different hashes")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
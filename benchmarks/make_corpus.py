@@ -0,0 +1,190 @@
+# Generates a reproducible synthetic corpus of images with known near-duplicates for the benchmarks.
+#
+#   python benchmarks/make_corpus.py <folder> [--images 200] [--seed 0] [--sizes 640x480,1600x1200,4000x3000]
+#                                    [--formats jpg,png,webp] [--variants reencode,resize,crop,colour]
+#                                    [--variant-rate 0.5] [--folders 4]
+#
+# Each source image is drawn from its own seed, derived from --seed and its number, so the same settings always
+# give the same pixels and a corpus of 1000 images starts with the same 200 sources as a corpus of 200. A share
+# of the sources (--variant-rate) also get one or more near-duplicate variants:
+#   copy     - a byte-identical copy
+#   reencode - saved again as a low quality JPEG
+#   resize   - scaled down to 35-80%
+#   crop     - 1-5% cut from each edge
+#   colour   - saturation and brightness shifted
+# Files are spread over --folders subfolders, and corpus.json records every file's source and variant, which
+# is the ground truth benchmarks/pipeline.py measures recall and precision against.
+import argparse
+import json
+import os
+import shutil
+import sys
+
+import numpy as np
+
+VARIANTS = ("copy", "reencode", "resize", "crop", "colour")
+DEFAULT_VARIANTS = ("reencode", "resize", "crop", "colour")
+FORMATS = {"jpg": "JPEG", "png": "PNG", "webp": "WEBP", "bmp": "BMP", "tiff": "TIFF", "gif": "GIF"}
+MANIFEST_NAME = "corpus.json"
+
+
+# Draws a source image: overlapping shapes on a gradient, drawn small and scaled up so it has the broad
+# structure perceptual hashes look at, with a little grain so the files compress like photos
+def draw_source(rng, width, height):
+    from PIL import Image, ImageDraw
+    small_width = 96
+    small_height = max(8, round(small_width * height / width))
+    top, bottom = rng.integers(0, 256, 3), rng.integers(0, 256, 3)
+    ramp = np.linspace(0, 1, small_height)[:, None, None]
+    background = top * (1 - ramp) + bottom * ramp
+    img = Image.fromarray(np.broadcast_to(background, (small_height, small_width, 3)).astype(np.uint8))
+    draw = ImageDraw.Draw(img)
+    for _ in range(int(rng.integers(6, 14))):
+        x0, x1 = sorted(rng.integers(-small_width // 4, small_width * 5 // 4, 2))
+        y0, y1 = sorted(rng.integers(-small_height // 4, small_height * 5 // 4, 2))
+        box = (int(x0), int(y0), int(x1) + 2, int(y1) + 2)
+        colour = tuple(int(c) for c in rng.integers(0, 256, 3))
+        shape = int(rng.integers(3))
+        if shape == 0:
+            draw.ellipse(box, fill=colour)
+        elif shape == 1:
+            draw.rectangle(box, fill=colour)
+        else:
+            points = rng.integers(0, (small_width, small_height), (int(rng.integers(3, 6)), 2))
+            draw.polygon([tuple(int(v) for v in point) for point in points], fill=colour)
+    img = img.resize((width, height), Image.Resampling.BICUBIC)
+    pixels = np.asarray(img, dtype=np.int16) + rng.integers(-6, 7, (height, width, 1), dtype=np.int16)
+    return Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8))
+
+def save_image(img, path, image_format, quality=90):
+    if image_format in ("JPEG", "WEBP"):
+        img.save(path, image_format, quality=quality)
+    elif image_format == "GIF":
+        img.convert("P", palette=1, colors=256).save(path, image_format)
+    else:
+        img.save(path, image_format)
+
+# Makes one variant of a source image, returning (image, format, JPEG quality)
+def make_variant(rng, img, variant, image_format):
+    from PIL import Image, ImageEnhance
+    if variant == "reencode":
+        return img, "JPEG", int(rng.integers(40, 76))
+    if variant == "resize":
+        scale = rng.uniform(0.35, 0.8)
+        size = (max(1, round(img.width * scale)), max(1, round(img.height * scale)))
+        return img.resize(size, Image.Resampling.LANCZOS), image_format, 90
+    if variant == "crop":
+        left, top, right, bottom = rng.uniform(0.01, 0.05, 4)
+        box = (round(img.width * left), round(img.height * top), round(img.width * (1 - right)), round(img.height * (1 - bottom)))
+        return img.crop(box), image_format, 90
+    if variant == "colour":
+        img = ImageEnhance.Color(img).enhance(rng.uniform(0.7, 1.3))
+        return ImageEnhance.Brightness(img).enhance(rng.uniform(0.9, 1.1)), image_format, 90
+    raise ValueError(f"Unknown variant: {variant}")
+
+# Writes a corpus to folder and returns its manifest. Anything already in folder is left alone, except that a
+# previous corpus.json is replaced.
+def make_corpus(folder, images=200, seed=0, sizes=((640, 480), (1600, 1200), (4000, 3000)), formats=("jpg", "png", "webp"), variants=DEFAULT_VARIANTS, variant_rate=0.5, folders=4, progress=False):
+    files = []
+    for source in range(images):
+        rng = np.random.default_rng([seed, source])
+        width, height = sizes[int(rng.integers(len(sizes)))]
+        if rng.random() < 0.3:
+            width, height = height, width
+        extension = formats[int(rng.integers(len(formats)))]
+        img = draw_source(rng, width, height)
+        chosen = ["original"]
+        if variants and rng.random() < variant_rate:
+            count = int(rng.integers(1, len(variants) + 1))
+            chosen += [str(variant) for variant in rng.choice(variants, count, replace=False)]
+        for variant in chosen:
+            subfolder = f"part{int(rng.integers(folders))}" if folders > 1 else ""
+            os.makedirs(os.path.join(folder, subfolder), exist_ok=True)
+            if variant in ("original", "copy"):
+                variant_img, image_format, quality = img, FORMATS[extension], 90
+            else:
+                variant_img, image_format, quality = make_variant(rng, img, variant, FORMATS[extension])
+            variant_extension = "jpg" if image_format == "JPEG" else extension
+            relpath = os.path.join(subfolder, f"img{source:06d}_{variant}.{variant_extension}")
+            if variant == "copy":
+                shutil.copyfile(os.path.join(folder, original_path), os.path.join(folder, relpath))
+            else:
+                save_image(variant_img, os.path.join(folder, relpath), image_format, quality)
+            if variant == "original":
+                original_path = relpath
+            files.append({"file": relpath.replace(os.sep, "/"), "source": source, "variant": variant, "width": variant_img.width, "height": variant_img.height, "format": image_format})
+        if progress and (source + 1) % 50 == 0:
+            print(f"{source + 1}/{images} sources, {len(files)} files", file=sys.stderr)
+    manifest = {
+        "version": 1,
+        "settings": {"images": images, "seed": seed, "sizes": [list(size) for size in sizes], "formats": list(formats), "variants": list(variants), "variant_rate": variant_rate, "folders": folders},
+        "files": files,
+    }
+    with open(os.path.join(folder, MANIFEST_NAME), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=1)
+    return manifest
+
+# Reads the manifest of a corpus folder, or returns None if it has none
+def load_manifest(folder):
+    path = os.path.join(folder, MANIFEST_NAME)
+    if not os.path.isfile(path):
+        return None
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+# Every pair of files that are versions of the same source, as a set of (relpath, relpath) tuples in sorted order
+def ground_truth_pairs(manifest):
+    by_source = {}
+    for entry in manifest["files"]:
+        by_source.setdefault(entry["source"], []).append(entry["file"])
+    return {(a, b) if a < b else (b, a) for files in by_source.values() for i, a in enumerate(files) for b in files[i + 1:]}
+
+
+def size_list(value):
+    sizes = []
+    for size in value.split(","):
+        width, _, height = size.strip().lower().partition("x")
+        try:
+            sizes.append((int(width), int(height)))
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"not a WIDTHxHEIGHT size: {size}") from None
+    return sizes
+
+def choice_list(choices):
+    def parse(value):
+        items = [item.strip().lower() for item in value.split(",") if item.strip()]
+        for item in items:
+            if item not in choices:
+                raise argparse.ArgumentTypeError(f"{item} is not one of {', '.join(choices)}")
+        return items
+    return parse
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Generate a synthetic image corpus with known near-duplicates")
+    parser.add_argument("folder")
+    add_corpus_arguments(parser)
+    return parser
+
+# Corpus options, shared with benchmarks/pipeline.py, which generates a corpus if its folder doesn't exist
+def add_corpus_arguments(parser):
+    parser.add_argument("--images", type=int, default=200, help="number of source images (default: 200)")
+    parser.add_argument("--seed", type=int, default=0, help="random seed (default: 0)")
+    parser.add_argument("--sizes", type=size_list, default=[(640, 480), (1600, 1200), (4000, 3000)], help="comma separated source sizes, each WIDTHxHEIGHT; about 30%% are turned to portrait (default: 640x480,1600x1200,4000x3000)")
+    parser.add_argument("--formats", type=choice_list(tuple(FORMATS)), default=["jpg", "png", "webp"], help="comma separated source formats (default: jpg,png,webp)")
+    parser.add_argument("--variants", type=choice_list(VARIANTS), default=list(DEFAULT_VARIANTS), help=f"comma separated near-duplicate variants to make, from {', '.join(VARIANTS)} (default: {','.join(DEFAULT_VARIANTS)})")
+    parser.add_argument("--variant-rate", type=float, default=0.5, help="share of sources that get variants (default: 0.5)")
+    parser.add_argument("--folders", type=int, default=4, help="number of subfolders to spread the files over (default: 4)")
+
+def corpus_settings(args):
+    return {"images": args.images, "seed": args.seed, "sizes": args.sizes, "formats": args.formats, "variants": args.variants, "variant_rate": args.variant_rate, "folders": args.folders}
+
+
+def main():
+    args = build_parser().parse_args()
+    manifest = make_corpus(args.folder, **corpus_settings(args), progress=True)
+    print(f"{len(manifest['files'])} files from {args.images} sources, {len(ground_truth_pairs(manifest))} duplicate pairs, in {args.folder}")
+
+
+if __name__ == "__main__":
+    main()
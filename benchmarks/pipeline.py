@@ -0,0 +1,354 @@
+# Times each stage of a scan on a synthetic corpus (see benchmarks/make_corpus.py) and checks the duplicates
+# found against the corpus's ground truth.
+#
+#   python benchmarks/pipeline.py <corpus folder> [--output results.json] [--compare baseline.json]
+#                                 [--hash-size 8] [--algorithm phash] [--threshold 5] [--workers 1] [--backend thread]
+#                                 [--stages walk,decode,hash,match,thumbnail,render,scan] [--repeat 1] [--render-rows 500]
+#
+# If the folder doesn't exist a corpus is generated in it first, taking the same options as make_corpus.py.
+# Stages:
+#   walk      - listing the folder (walker.walk_files, with stats)
+#   decode    - opening and decoding every file as a scan does (reduced unless --full-decode)
+#   hash      - hashing the decoded images
+#   match     - finding every pair within the threshold (matching.find_hash_pairs)
+#   thumbnail - thumbnailing every file that is in a pair
+#   render    - showing the pairs in the GUI on Qt's offscreen platform, scrolling through the first --render-rows
+#               rows and waiting for each screenful's thumbnails (from a cache the thumbnail stage fills)
+#   scan      - a whole DuplicateScanner scan with --workers and --backend, without the hash cache
+# Decode and hash alternate file by file, so they are timed together in one process and reported separately.
+# Every stage runs in a fresh process, so its peak RSS is its own. Recall and precision are those of the scan
+# stage's pairs (or the match stage's without it) against every pair of files made from the same source.
+# Results are written as JSON; with --compare the run is set against an earlier one and the exit status is 1
+# if a stage got slower than --tolerance allows or recall or precision dropped.
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+sys.path.insert(0, ROOT)
+
+from duplinator import SUPPORTED_EXTENSIONS
+from make_corpus import add_corpus_arguments, corpus_settings, ground_truth_pairs, load_manifest, make_corpus
+
+STAGES = ("walk", "decode", "hash", "match", "thumbnail", "render", "scan")
+RESULTS_VERSION = 1
+MIN_REGRESSION_SECONDS = 0.01
+
+
+# Peak resident memory of this process so far in MB, or None where it can't be found (Windows). On Linux
+# ru_maxrss carries over the parent's peak into a freshly started process, so VmHWM is read instead.
+def peak_rss_mb():
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Bytes on macOS, KB elsewhere
+    return round(peak / (1 << 20) if sys.platform == "darwin" else peak / 1024, 1)
+
+
+def stage_walk(folder, settings):
+    from duplinator.walker import walk_files
+    start = time.perf_counter()
+    files = [filepath for filepath, stat in walk_files(folder, None, SUPPORTED_EXTENSIONS, with_stat=True)]
+    elapsed = time.perf_counter() - start
+    return {"walk": {"seconds": elapsed, "items": len(files)}}, files
+
+def stage_decode_hash(files, settings):
+    from PIL import Image
+    from duplinator.hashing import hash_bits, hash_image, hash_to_bytes, reduce_for_hashing
+    algorithm, hash_size = settings["algorithm"], settings["hash_size"]
+    decode_seconds = hash_seconds = 0.0
+    pixels = 0
+    hashes = []
+    failed = 0
+    for filepath in files:
+        start = time.perf_counter()
+        try:
+            with Image.open(filepath) as img:
+                pixels += img.width * img.height
+                decoded = reduce_for_hashing(img, hash_size, algorithm) if settings["reduced_decode"] else img
+                decoded.load()
+                decoded_at = time.perf_counter()
+                hash_value = hash_image(decoded if algorithm == "colorhash" else decoded.convert("L"), hash_size, algorithm)
+        except Exception:
+            failed += 1
+            hashes.append(None)
+            continue
+        hashes.append(hash_to_bytes(hash_value))
+        decode_seconds += decoded_at - start
+        hash_seconds += time.perf_counter() - decoded_at
+    stages = {
+        "decode": {"seconds": decode_seconds, "items": len(files) - failed, "megapixels": round(pixels / 1e6, 1), "failed": failed},
+        "hash": {"seconds": hash_seconds, "items": len(files) - failed, "bits": hash_bits(algorithm, hash_size)},
+    }
+    return stages, hashes
+
+def stage_match(files, hashes, settings):
+    from duplinator.hashing import hash_bits
+    from duplinator.matching import find_hash_pairs
+    hashed = [(filepath, hash_bytes) for filepath, hash_bytes in zip(files, hashes) if hash_bytes is not None]
+    start = time.perf_counter()
+    found = list(find_hash_pairs([hash_bytes for filepath, hash_bytes in hashed], hash_bits(settings["algorithm"], settings["hash_size"]), settings["threshold"], settings["engine"]))
+    elapsed = time.perf_counter() - start
+    pairs = [(hashed[i][0], hashed[j][0], distance) for i, j, distance in found]
+    return {"match": {"seconds": elapsed, "items": len(hashed), "pairs": len(pairs)}}, pairs
+
+def stage_thumbnail(pairs, thumbnail_cache_path, settings):
+    from duplinator.thumbnails import ThumbnailCache, load_thumbnail
+    filepaths = sorted({filepath for pair in pairs for filepath in pair[:2]})
+    entries = []
+    start = time.perf_counter()
+    for filepath in filepaths:
+        try:
+            record = load_thumbnail(filepath)
+        except Exception:
+            continue
+        stat = os.stat(filepath)
+        entries.append((os.path.abspath(filepath), stat.st_size, stat.st_mtime_ns, *record))
+    elapsed = time.perf_counter() - start
+    cache = ThumbnailCache(thumbnail_cache_path)
+    try:
+        cache.store(entries)
+    finally:
+        cache.close()
+    return {"thumbnail": {"seconds": elapsed, "items": len(entries), "bytes": sum(len(entry[-1]) for entry in entries)}}, None
+
+def stage_render(pairs, thumbnail_cache_path, settings):
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    try:
+        from PyQt6 import QtWidgets
+        import DuplinatorQt
+    except ImportError as e:
+        return {"render": {"skipped": f"PyQt6 is not available: {e}"}}, None
+    app = QtWidgets.QApplication.instance() or QtWidgets.QApplication([])
+    window = DuplinatorQt.MainWindow()
+    window.resize(1200, 900)
+    window.show()
+    window.thumbnail_loader.cache_path = thumbnail_cache_path
+    app.processEvents()
+    view = window.results_view
+    start = time.perf_counter()
+    window.display_results([pair[:2] for pair in pairs])
+    model = window.results_model
+    rows = min(model.rowCount(), settings["render_rows"])
+    row = screens = 0
+    while row < rows:
+        view.scrollTo(model.index(row), QtWidgets.QAbstractItemView.ScrollHint.PositionAtTop)
+        # Painting the rows asks for their thumbnails, which arrive from the loader threads
+        view.viewport().grab()
+        last = view.indexAt(view.viewport().rect().bottomLeft()).row()
+        last = rows - 1 if last < 0 else min(last, rows - 1)
+        wanted = {filepath for item in model.items[row:last + 1] for filepath in (item["file1"], item["file2"])}
+        deadline = time.perf_counter() + 30
+        while not wanted <= model.details.keys() and time.perf_counter() < deadline:
+            app.processEvents()
+            time.sleep(0.001)
+        view.viewport().grab()
+        screens += 1
+        row = last + 1
+    elapsed = time.perf_counter() - start
+    window.close()
+    return {"render": {"seconds": elapsed, "items": rows, "screens": screens}}, None
+
+def stage_scan(folder, settings):
+    from duplinator.hashing import DecodeOptions
+    from duplinator.matching import MatchOptions
+    from duplinator.scanner import DuplicateScanner
+    workers = settings["workers"]
+    scanner = DuplicateScanner(folder, settings["hash_size"], settings["threshold"], None, SUPPORTED_EXTENSIONS, workers != 1, workers, matching=MatchOptions(settings["engine"]), backend=settings["backend"], decode=DecodeOptions(settings["reduced_decode"]), algorithm=settings["algorithm"], cascade=settings["cascade"], exact_first=settings["exact_first"])
+    pairs = []
+    problems = 0
+    start = time.perf_counter()
+    for event, data in scanner.scan():
+        if event == "pairs":
+            pairs.extend(data)
+        elif event == "problems":
+            problems += len(data)
+    elapsed = time.perf_counter() - start
+    return {"scan": {"seconds": elapsed, "items": len(scanner.files), "pairs": len(pairs), "problems": problems}}, pairs
+
+# Runs a stage function in a fresh process and returns (stage results, output), each stage's results
+# gaining its peak RSS and throughput
+def run_stage(function, *args):
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as executor:
+        return executor.submit(_stage_process, function, *args).result()
+
+def _stage_process(function, *args):
+    sys.path.insert(0, ROOT)
+    stages, output = function(*args)
+    peak = peak_rss_mb()
+    for result in stages.values():
+        if "seconds" in result:
+            result["per_second"] = round(result["items"] / result["seconds"], 2) if result["seconds"] else None
+            result["seconds"] = round(result["seconds"], 4)
+            result["peak_rss_mb"] = peak
+    return stages, output
+
+# Runs a stage repeat times, keeping the fastest run
+def best_of(repeat, function, *args):
+    best = None
+    for _ in range(repeat):
+        stages, output = run_stage(function, *args)
+        if best is None or sum(result.get("seconds", 0) for result in stages.values()) < sum(result.get("seconds", 0) for result in best[0].values()):
+            best = stages, output
+    return best
+
+# Recall and precision of found pairs of files against the corpus's ground truth
+def accuracy(pairs, folder, manifest):
+    truth = ground_truth_pairs(manifest)
+    found = set()
+    for filepath1, filepath2, distance in pairs:
+        a = os.path.relpath(filepath1, folder).replace(os.sep, "/")
+        b = os.path.relpath(filepath2, folder).replace(os.sep, "/")
+        found.add((a, b) if a < b else (b, a))
+    true_positives = len(found & truth)
+    return {
+        "true_pairs": len(truth),
+        "found_pairs": len(found),
+        "true_positives": true_positives,
+        "recall": round(true_positives / len(truth), 4) if truth else None,
+        "precision": round(true_positives / len(found), 4) if found else None,
+    }
+
+
+def run(args):
+    folder = os.path.abspath(args.folder)
+    if not os.path.isdir(folder):
+        print(f"generating a corpus in {folder}", file=sys.stderr)
+        make_corpus(folder, **corpus_settings(args), progress=True)
+    manifest = load_manifest(folder)
+    settings = {
+        "hash_size": args.hash_size, "algorithm": args.algorithm, "threshold": args.threshold, "engine": args.engine,
+        "reduced_decode": not args.full_decode, "workers": args.workers, "backend": args.backend, "cascade": args.cascade,
+        "exact_first": args.exact_first, "render_rows": args.render_rows,
+    }
+    stages = {}
+    pairs = None
+    with tempfile.TemporaryDirectory() as temp_dir:
+        thumbnail_cache_path = os.path.join(temp_dir, "thumbnails.sqlite")
+        results, files = best_of(args.repeat, stage_walk, folder, settings)
+        stages.update(results)
+        if {"decode", "hash", "match", "thumbnail", "render"} & set(args.stages):
+            results, hashes = best_of(args.repeat, stage_decode_hash, files, settings)
+            stages.update(results)
+            results, pairs = best_of(args.repeat, stage_match, files, hashes, settings)
+            stages.update(results)
+        if {"thumbnail", "render"} & set(args.stages):
+            results, _ = best_of(args.repeat, stage_thumbnail, pairs, thumbnail_cache_path, settings)
+            stages.update(results)
+        if "render" in args.stages:
+            results, _ = best_of(args.repeat, stage_render, pairs, thumbnail_cache_path, settings)
+            stages.update(results)
+        if "scan" in args.stages:
+            results, pairs = best_of(args.repeat, stage_scan, folder, settings)
+            stages.update(results)
+    # Stages that only ran because a later one needed their output
+    stages = {name: result for name, result in stages.items() if name in args.stages}
+    return {
+        "version": RESULTS_VERSION,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "machine": {"platform": platform.platform(), "python": platform.python_version(), "cpus": os.cpu_count()},
+        "corpus": {"folder": folder, "files": len(files), **(manifest["settings"] if manifest else {})},
+        "settings": settings,
+        "stages": stages,
+        "accuracy": accuracy(pairs, folder, manifest) if manifest and pairs is not None else None,
+    }
+
+def print_results(results):
+    print(f"{results['corpus']['files']} files, {results['settings']['algorithm']} {results['settings']['hash_size']}, threshold {results['settings']['threshold']}")
+    for name, result in results["stages"].items():
+        if "skipped" in result:
+            print(f"{name:>10}: skipped ({result['skipped']})")
+            continue
+        rate = f"{result['per_second']:.1f}/s" if result["per_second"] is not None else "-"
+        rss = f"{result['peak_rss_mb']:.0f} MB" if result["peak_rss_mb"] is not None else "-"
+        print(f"{name:>10}: {result['seconds']:8.3f}s  {result['items']:>7} items  {rate:>12}  peak RSS {rss}")
+    if results["accuracy"]:
+        print(f"recall {results['accuracy']['recall']}, precision {results['accuracy']['precision']} ({results['accuracy']['true_positives']} of {results['accuracy']['true_pairs']} pairs found, {results['accuracy']['found_pairs']} reported)")
+
+# Prints how results differ from a baseline run; returns True if anything regressed beyond tolerance
+def compare(results, baseline, tolerance):
+    regressed = False
+    if baseline.get("settings") != results["settings"] or baseline.get("corpus", {}).get("files") != results["corpus"]["files"]:
+        print("note: the baseline was run with other settings or another corpus")
+    for name, result in results["stages"].items():
+        old = baseline.get("stages", {}).get(name)
+        if not old or "seconds" not in old or "seconds" not in result or not old["seconds"]:
+            continue
+        change = result["seconds"] / old["seconds"] - 1
+        # Stages taking a few milliseconds vary by more than any sensible tolerance from run to run
+        slower = change > tolerance and result["seconds"] - old["seconds"] > MIN_REGRESSION_SECONDS
+        regressed |= slower
+        print(f"{name:>10}: {old['seconds']:8.3f}s -> {result['seconds']:8.3f}s  {change:+7.1%}{'  SLOWER' if slower else ''}")
+    for key in ("recall", "precision"):
+        old = (baseline.get("accuracy") or {}).get(key)
+        new = (results["accuracy"] or {}).get(key)
+        if old is not None and new is not None:
+            worse = new < old
+            regressed |= worse
+            print(f"{key:>10}: {old} -> {new}{'  WORSE' if worse else ''}")
+    return regressed
+
+
+def stage_list(value):
+    stages = [stage.strip() for stage in value.split(",") if stage.strip()]
+    for stage in stages:
+        if stage not in STAGES:
+            raise argparse.ArgumentTypeError(f"{stage} is not one of {', '.join(STAGES)}")
+    return stages
+
+def worker_count(value):
+    return value if value == "auto" else int(value)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time each stage of a scan on a synthetic corpus and check its results")
+    parser.add_argument("folder", help="corpus folder, generated if it doesn't exist")
+    parser.add_argument("--output", metavar="FILE", help="write the results to FILE as JSON (default: benchmark-<date>-<time>.json)")
+    parser.add_argument("--compare", metavar="FILE", help="compare with the results of an earlier run")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="slowdown of a stage against --compare counted as a regression (default: 0.1)")
+    parser.add_argument("--stages", type=stage_list, default=list(STAGES), help=f"comma separated stages to run (default: {','.join(STAGES)})")
+    parser.add_argument("--repeat", type=int, default=1, help="run each stage this many times and keep the fastest (default: 1)")
+    parser.add_argument("--render-rows", type=int, default=500, help="result rows the render stage scrolls through (default: 500)")
+    parser.add_argument("--hash-size", type=int, default=8)
+    parser.add_argument("--algorithm", choices=("ahash", "dhash", "phash", "whash", "colorhash"), default="phash")
+    parser.add_argument("--threshold", type=int, default=5)
+    parser.add_argument("--engine", choices=("auto", "index", "bruteforce"), default="auto")
+    parser.add_argument("--full-decode", action="store_true")
+    parser.add_argument("--workers", type=worker_count, default=1)
+    parser.add_argument("--backend", choices=("thread", "process"), default="thread")
+    parser.add_argument("--cascade", action="store_true")
+    parser.add_argument("--exact-first", action="store_true")
+    corpus = parser.add_argument_group("corpus", "used when the folder has to be generated")
+    add_corpus_arguments(corpus)
+    args = parser.parse_args()
+
+    results = run(args)
+    print_results(results)
+    output = args.output or time.strftime("benchmark-%Y%m%d-%H%M%S.json")
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=1)
+    print(f"results written to {output}")
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+# Duplinator's scanning core, usable without PyQt6.
+#
+#   from duplinator import find_duplicate_images
+#   pairs = find_duplicate_images("/photos", 8, 5, None, [".jpg", ".png"], False, 1)
+#
+# Names are resolved lazily so that importing the package does not pull in NumPy, PIL or imagehash
+# until something that needs them is actually used.
+import importlib
+
+_EXPORTS = {
+    "list_files": "walker",
+    "walk_files": "walker",
+    "WalkOptions": "walker",
+    "HammingIndex": "matching",
+    "StreamingMatcher": "matching",
+    "find_hash_pairs": "matching",
+    "MatchOptions": "matching",
+    "HASH_ALGORITHMS": "hashing",
+    "hash_image": "hashing",
+    "compute_hash": "hashing",
+    "hash_files_parallel": "hashing",
+    "hash_to_bytes": "hashing",
+    "hash_from_bytes": "hashing",
+    "default_worker_count": "hashing",
+    "DecodeBudget": "hashing",
+    "DecodeOptions": "hashing",
+    "FileProblem": "hashing",
+    "default_memory_limit": "hashing",
+    "HashCache": "cache",
+    "default_cache_path": "cache",
+    "CacheOptions": "cache",
+    "ThumbnailCache": "thumbnails",
+    "default_thumbnail_cache_path": "thumbnails",
+    "find_exact_duplicates": "exact",
+    "HashIndex": "index",
+    "PathTable": "store",
+    "FileStats": "store",
+    "ReferenceIndex": "reference",
+    "merge_indexes": "shards",
+    "shard_of": "shards",
+    "Shard": "shards",
+    "hash_frames": "frames",
+    "SequenceMatcher": "frames",
+    "FrameOptions": "frames",
+    "VIDEO_EXTENSIONS": "frames",
+    "DuplicateGrouper": "grouping",
+    "ScanStats": "stats",
+    "DiagnosticOptions": "stats",
+    "DuplicateScanner": "scanner",
+    "find_duplicate_images": "scanner",
+    "find_duplicate_groups": "scanner",
+}
+
+SUPPORTED_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.gif', '.bmp', '.tiff', '.webp')
+
+__all__ = sorted(_EXPORTS) + ["SUPPORTED_EXTENSIONS"]
+
+
+def __getattr__(name):
+    if name in _EXPORTS:
+        value = getattr(importlib.import_module(f".{_EXPORTS[name]}", __name__), name)
+        globals()[name] = value
+        return value
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__():
+    return __all__
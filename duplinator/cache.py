@@ -0,0 +1,76 @@
+import os
+import sqlite3
+import sys
+from collections import namedtuple
+
+
+# Per-user cache directory that Duplinator keeps its hash and thumbnail caches in
+def default_cache_dir():
+    if sys.platform == "win32":
+        base_path = os.environ.get("LOCALAPPDATA") or os.path.expanduser("~")
+    elif sys.platform == "darwin":
+        base_path = os.path.expanduser("~/Library/Caches")
+    else:
+        base_path = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+    return os.path.join(base_path, "Duplinator")
+
+# Default location of the persistent hash cache
+def default_cache_path():
+    return os.path.join(default_cache_dir(), "hashes.sqlite")
+
+# The caches a scan reads and fills: path is a HashCache and thumbnail_path a thumbnails.ThumbnailCache, either
+# None for none. With a thumbnail cache the hashing workers also thumbnail each file from the image they decoded
+# for its hash, so showing the results doesn't decode the files again. extra_hashes is a list of
+# (algorithm, hash_size) to compute from the same decode and store in the hash cache, so later scans with any of
+# them are cache hits; files whose extra hashes aren't all cached are decoded again to fill them in.
+CacheOptions = namedtuple("CacheOptions", ("path", "thumbnail_path", "extra_hashes"), defaults=(None, None, ()))
+
+# Persistent SQLite store of computed hashes so unchanged files are not decoded again on rescans.
+# An entry is only reused when the file's size, mtime_ns and inode all still match, and entries are
+# kept separately per hash algorithm and hash size. WAL mode plus a busy timeout lets several
+# Duplinator instances share the same cache file; each connection must stay on the thread that opened it.
+class HashCache:
+    def __init__(self, cache_path):
+        cache_dir = os.path.dirname(cache_path)
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+        self.connection = sqlite3.connect(cache_path, timeout=30)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS hashes ("
+            "path TEXT NOT NULL, algorithm TEXT NOT NULL, hash_size INTEGER NOT NULL, "
+            "size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL, inode INTEGER NOT NULL, hash BLOB NOT NULL, "
+            "PRIMARY KEY (path, algorithm, hash_size))"
+        )
+        self.connection.commit()
+
+    # Returns {path: (size, mtime_ns, inode, hash_bytes)} for every entry stored under folder_path
+    def load(self, folder_path, algorithm, hash_size):
+        prefix = os.path.join(os.path.abspath(folder_path), "")
+        rows = self.connection.execute(
+            "SELECT path, size, mtime_ns, inode, hash FROM hashes "
+            "WHERE algorithm = ? AND hash_size = ? AND path >= ? AND path < ?",
+            (algorithm, hash_size, prefix, prefix + "\U0010ffff")
+        )
+        return {path: (size, mtime_ns, inode, hash_bytes) for path, size, mtime_ns, inode, hash_bytes in rows}
+
+    # entries is an iterable of (path, algorithm, hash_size, size, mtime_ns, inode, hash_bytes)
+    def store(self, entries):
+        with self.connection:
+            self.connection.executemany("INSERT OR REPLACE INTO hashes VALUES (?, ?, ?, ?, ?, ?, ?)", entries)
+
+    def evict(self, paths):
+        with self.connection:
+            self.connection.executemany("DELETE FROM hashes WHERE path = ?", ((path,) for path in paths))
+
+    # Drops cached entries that were not seen during a scan and no longer exist on disk.
+    # Files that were merely outside this scan's depth or extensions are kept.
+    def evict_missing(self, cached_paths, seen_paths):
+        missing = [path for path in cached_paths if path not in seen_paths and not os.path.exists(path)]
+        if missing:
+            self.evict(missing)
+        return len(missing)
+
+    def close(self):
+        self.connection.close()
@@ -0,0 +1,475 @@
+# Command line interface: python -m duplinator <folder> [options]
+#                     or: python -m duplinator --merge <index> ... [options]
+#
+# Pairs are written as soon as they are found, one per line for ndjson and csv, so downstream tools can
+# start consuming them before the scan ends. With --group, groups can still merge until the scan finishes,
+# so they are written at the end. The scanner and the image libraries are only imported once the scan starts.
+import argparse
+import csv
+import json
+import sys
+
+from . import SUPPORTED_EXTENSIONS
+from .grouping import KEEP_POLICIES
+from .hashing import HASH_ALGORITHMS, hash_bits
+from .stats import STAGES, WORKER_STAGES
+
+
+def worker_count(value):
+    if value == "auto":
+        return value
+    count = int(value)
+    if count < 1:
+        raise argparse.ArgumentTypeError("must be 'auto' or at least 1")
+    return count
+
+
+def positive_int(value):
+    count = int(value)
+    if count < 1:
+        raise argparse.ArgumentTypeError("must be at least 1")
+    return count
+
+
+# Hash distances are counted in 16 bits, which holds the distance between two 255 x 255 bit hashes
+MAX_HASH_SIZE = 255
+
+
+def hash_size(value):
+    size = int(value)
+    if not 2 <= size <= MAX_HASH_SIZE:
+        raise argparse.ArgumentTypeError(f"must be from 2 to {MAX_HASH_SIZE}")
+    return size
+
+
+def non_negative_int(value):
+    count = int(value)
+    if count < 0:
+        raise argparse.ArgumentTypeError("must be at least 0")
+    return count
+
+
+def shard_spec(value):
+    number, slash, count = value.partition("/")
+    try:
+        number, count = int(number), int(count)
+    except ValueError:
+        raise argparse.ArgumentTypeError("must be I/N, e.g. 0/4") from None
+    if not 0 <= number < count:
+        raise argparse.ArgumentTypeError("I must be from 0 to N - 1")
+    return number, count
+
+
+def memory_size(value):
+    if value.lower() in ("auto", "none"):
+        return value.lower()
+    number, unit = value[:-1], value[-1:].upper()
+    if unit.isdigit():
+        number, unit = value, ""
+    try:
+        size = int(float(number) * {"": 1, "K": 1 << 10, "M": 1 << 20, "G": 1 << 30}[unit])
+    except (KeyError, ValueError):
+        raise argparse.ArgumentTypeError("must be 'auto', 'none' or a size in bytes, e.g. 512M or 4G") from None
+    if size < 1:
+        raise argparse.ArgumentTypeError("must be at least 1 byte")
+    return size
+
+
+def extension_list(value):
+    extensions = []
+    for ext in value.split(","):
+        ext = ext.strip().lower()
+        if ext:
+            extensions.append(ext if ext.startswith(".") else "." + ext)
+    return extensions
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="duplinator", description="Find duplicate and near-duplicate images in a folder.")
+    parser.add_argument("folder", nargs="?", help="folder to scan")
+    parser.add_argument("--hash-size", type=hash_size, default=8, help="size of the perceptual hash; larger is more accurate but slower (default: 8)")
+    parser.add_argument("--algorithm", choices=HASH_ALGORITHMS, default="phash", help="perceptual hash to compare images with (default: phash)")
+    parser.add_argument("--threshold", type=non_negative_int, default=5, help="maximum hash difference for two images to count as duplicates (default: 5)")
+    parser.add_argument("--extensions", type=extension_list, default=list(SUPPORTED_EXTENSIONS), help="comma separated file types to include (default: %(default)s)")
+    parser.add_argument("--subfolders", action="store_true", help="include subfolders")
+    parser.add_argument("--levels", type=non_negative_int, default=1, help="subfolder levels to include with --subfolders, 0 for all (default: 1)")
+    parser.add_argument("--skip-hidden", action="store_true", help="don't look inside hidden subfolders")
+    parser.add_argument("--follow-symlinks", action="store_true", help="look inside symlinked subfolders, each only once")
+
+    performance = parser.add_argument_group("performance")
+    performance.add_argument("--workers", type=worker_count, default=1, help="number of hashing workers, or 'auto' for one per CPU (default: 1)")
+    performance.add_argument("--backend", choices=("thread", "process"), default="thread", help="worker type; processes use every core, threads suit network drives (default: thread)")
+    performance.add_argument("--cache", metavar="PATH", help="hash cache database (default: hashes.sqlite in the per-user cache folder)")
+    performance.add_argument("--also-hash", metavar="SPECS", default="", help="comma separated extra hashes to compute from the same decode and cache for later scans, each a hash size, an algorithm or ALGORITHM:SIZE (e.g. 12,16,dhash)")
+    performance.add_argument("--no-cache", action="store_true", help="don't read or write the hash cache")
+    performance.add_argument("--walk-workers", type=positive_int, default=8, help="number of folders listed at once (default: 8)")
+    performance.add_argument("--exact-first", action="store_true", help="match byte-identical files by content before hashing")
+    performance.add_argument("--cascade", action="store_true", help="find candidates with a cheap hash of each image's EXIF thumbnail first and only fully hash those; much faster, may miss a few pairs")
+    performance.add_argument("--full-decode", action="store_true", help="always decode images at full resolution before hashing")
+    performance.add_argument("--memory-limit", type=memory_size, default="auto", metavar="SIZE", help="memory the images being decoded at once may take, e.g. 512M or 4G; larger images wait their turn, are decoded reduced or are skipped, 'auto' for half the RAM, 'none' for no limit (default: auto)")
+    performance.add_argument("--engine", choices=("auto", "index", "bruteforce"), default="auto", help="hash matching engine (default: auto)")
+    performance.add_argument("--block-size", type=positive_int, default=1024, help="block size for the brute-force matcher (default: 1024)")
+
+    animations = parser.add_argument_group("animations and videos", "videos are scanned when their extensions are added to --extensions (e.g. gif,webp,png,mp4,mov,mkv,webm) and need PyAV (pip install av); each is hashed from its first sampled frame")
+    animations.add_argument("--frames", type=positive_int, metavar="N", help="also hash up to N frames of each animated image and video and match the frame sequences, so re-encoded, resized or trimmed copies are found (16 is a good start)")
+    animations.add_argument("--frame-sampling", choices=("even", "scene"), default="even", help="sample frames evenly spaced, or where the scene changes (only keyframes are decoded for videos) (default: even)")
+
+    sharding = parser.add_argument_group("sharding", "split a scan over several processes or machines sharing the file system: run each shard with --shard I/N --save-index FILE, then combine them with --merge")
+    sharding.add_argument("--shard", type=shard_spec, metavar="I/N", help="only hash the files in shard I (counting from 0) of N")
+    sharding.add_argument("--shard-by", choices=("path", "folder"), default="path", help="split files between shards by their path, or keep each folder in one shard (default: path)")
+    sharding.add_argument("--merge", nargs="+", metavar="INDEX", help="instead of scanning, merge saved shard indexes and report their pairs or groups")
+    sharding.add_argument("--partial", action="store_true", help="merge even if some shards are missing")
+
+    reference = parser.add_argument_group("reference", "match a folder against a saved index of a reference collection (e.g. an archive) without hashing the collection again")
+    reference.add_argument("--reference", metavar="INDEX", help="report pairs of a file in the folder and a file in INDEX, saved with --save-reference or --save-index")
+    reference.add_argument("--folder-pairs", action="store_true", help="with --reference, also report pairs within the folder")
+
+    output = parser.add_argument_group("output")
+    output.add_argument("--group", action="store_true", help="report groups of duplicates, each with the file to keep, instead of pairs")
+    output.add_argument("--keep", choices=KEEP_POLICIES, default="resolution", help="which file of a group to keep: highest resolution, largest file or oldest (default: resolution)")
+    output.add_argument("--format", choices=("ndjson", "csv", "json"), default="ndjson", help="output format (default: ndjson)")
+    output.add_argument("-o", "--output", metavar="FILE", help="write results to FILE instead of standard output")
+    output.add_argument("--save-index", metavar="FILE", help="save the finished scan's hashes and matches to FILE, which can be opened memory-mapped with HashIndex.open()")
+    output.add_argument("--save-reference", metavar="FILE", help="like --save-index, with a lookup table that lets --reference match against FILE quickly at up to --threshold")
+    output.add_argument("--problems", metavar="FILE", help="write the files that couldn't be hashed or were skipped to FILE as ndjson instead of standard error")
+    output.add_argument("--progress", action="store_true", help="show progress on standard error")
+
+    diagnostics = parser.add_argument_group("diagnostics", "measure where a scan spends its time")
+    diagnostics.add_argument("--stats", metavar="FILE", help="write the scan's time per stage, throughput, queue depths, cache hit rate and slowest files to FILE as JSON")
+    diagnostics.add_argument("--slowest", type=positive_int, default=10, metavar="N", help="number of slowest files to list in --stats (default: 10)")
+    diagnostics.add_argument("--profile", choices=STAGES, metavar="STAGE", help=f"profile one stage of the scan, one of {', '.join(STAGES)}")
+    diagnostics.add_argument("--profile-mode", choices=("cprofile", "sample"), default="cprofile", help="profile with cProfile, or by sampling stacks, which slows the stage down far less (default: cprofile)")
+    diagnostics.add_argument("--profile-output", metavar="FILE", help="write the profile to FILE, in pstats format if it ends in .prof and as text otherwise (default: text on standard error)")
+    return parser
+
+
+# Writes pairs in the chosen format, flushing after every batch so consumers see them straight away
+class PairWriter:
+    FIELDS = ("file1", "file2", "distance")
+
+    def __init__(self, stream, output_format):
+        self.stream = stream
+        self.output_format = output_format
+        self.count = 0
+        if output_format == "csv":
+            self.csv_writer = csv.writer(stream)
+            self.csv_writer.writerow(self.FIELDS)
+        elif output_format == "json":
+            stream.write("[")
+
+    def write(self, pairs):
+        for filepath1, filepath2, distance in pairs:
+            if self.output_format == "csv":
+                self.csv_writer.writerow((filepath1, filepath2, distance))
+            else:
+                record = json.dumps(dict(zip(self.FIELDS, (filepath1, filepath2, distance))))
+                if self.output_format == "json":
+                    self.stream.write(("," if self.count else "") + "\n  " + record)
+                else:
+                    self.stream.write(record + "\n")
+            self.count += 1
+        self.stream.flush()
+
+    def close(self):
+        if self.output_format == "json":
+            self.stream.write("\n]\n" if self.count else "]\n")
+        self.stream.flush()
+
+
+# Writes groups from DuplicateGrouper.group(). Each ndjson line or json element is
+# {"keep": file, "files": [{"file": ..., "distance": ...}, ...]}, the kept file listed first with distance 0;
+# csv has one row per file, numbering the groups from 1.
+class GroupWriter:
+    FIELDS = ("group", "file", "distance", "keep")
+
+    def __init__(self, stream, output_format):
+        self.stream = stream
+        self.output_format = output_format
+        self.count = 0
+        if output_format == "csv":
+            self.csv_writer = csv.writer(stream)
+            self.csv_writer.writerow(self.FIELDS)
+        elif output_format == "json":
+            stream.write("[")
+
+    def write(self, groups):
+        for group in groups:
+            self.count += 1
+            if self.output_format == "csv":
+                for filepath, distance in group["files"]:
+                    self.csv_writer.writerow((self.count, filepath, distance, int(filepath == group["keep"])))
+            else:
+                files = [{"file": filepath, "distance": distance} for filepath, distance in group["files"]]
+                record = json.dumps({"keep": group["keep"], "files": files})
+                if self.output_format == "json":
+                    self.stream.write(("," if self.count > 1 else "") + "\n  " + record)
+                else:
+                    self.stream.write(record + "\n")
+        self.stream.flush()
+
+    def close(self):
+        if self.output_format == "json":
+            self.stream.write("\n]\n" if self.count else "]\n")
+        self.stream.flush()
+
+
+def format_progress(progress, grouper=None):
+    done = progress["hashed"] + progress["cached"] + progress["failed"] + progress["skipped"]
+    text = f"found {progress['discovered']}, processed {done} ({progress['hash_rate']:.1f}/s), "
+    if progress["other_shards"]:
+        text += f"{progress['other_shards']} in other shards, "
+    if progress["refined"]:
+        text += f"{progress['refined']} refined, "
+    if progress["failed"] or progress["skipped"]:
+        text += f"{progress['failed']} failed, {progress['skipped']} skipped, "
+    if progress["sequences"]:
+        text += f"{progress['frames']} frames of {progress['sequences']} animations, "
+    text += f"{progress['pairs']} pairs"
+    if progress["reference_pairs"]:
+        text += f" ({progress['reference_pairs']} with the reference)"
+    if grouper is not None:
+        text += f" in {len(grouper)} groups"
+    return text
+
+
+# Reports files a scan couldn't hash, as ndjson to problem_stream or else as lines on standard error (clearing
+# the progress line first)
+def write_problems(problems, problem_stream, progress=False):
+    if problem_stream is not None:
+        for problem in problems:
+            problem_stream.write(json.dumps({"file": problem.filepath, "status": problem.status, "message": problem.message}) + "\n")
+        problem_stream.flush()
+        return
+    for problem in problems:
+        line = f"duplinator: {problem.status}: {problem.filepath}: {problem.message}"
+        print(f"\r{line:<79}" if progress else line, file=sys.stderr)
+
+
+# --stats: the scan's settings and final progress counters, with its ScanStats.snapshot()
+def write_stats(scanner, args):
+    report = {
+        "folder": args.folder,
+        "settings": {"algorithm": args.algorithm, "hash_size": args.hash_size, "threshold": args.threshold, "workers": scanner.num_workers, "backend": args.backend, "cache": not args.no_cache, "cascade": args.cascade, "exact_first": args.exact_first, "full_decode": args.full_decode, "memory_limit": scanner.memory_limit, "frames": args.frames, "frame_sampling": args.frame_sampling},
+        "progress": {key: value for key, value in scanner.progress.items() if key != "stage"},
+        "cancelled": scanner.cancelled,
+        **scanner.scan_stats.snapshot(scanner.progress),
+    }
+    with open(args.stats, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=1)
+        f.write("\n")
+
+
+# --profile: the profiled stage's report, to --profile-output or standard error
+def write_profile(scanner, args):
+    if args.profile_output:
+        scanner.scan_stats.write_profile(args.profile_output)
+    else:
+        sys.stderr.write(scanner.scan_stats.profile_report())
+
+
+# Sort key putting groups in the order their first scanned file was found in; reference files aren't in files
+def walk_position(files, group):
+    return min(file_id for file_id in (files.id_of(filepath) for filepath, distance in group["files"]) if file_id is not None)
+
+
+# Writes every pair or group of a finished HashIndex
+def write_index_results(index, args, stream):
+    from .grouping import DuplicateGrouper
+
+    writer = GroupWriter(stream, args.format) if args.group else PairWriter(stream, args.format)
+    try:
+        pairs = index.pairs(args.threshold, args.extensions, expand_copies=not args.group)
+        if args.group:
+            grouper = DuplicateGrouper(args.keep, index.hash_distance)
+            grouper.add_pairs(pairs)
+            groups = grouper.groups()
+            groups.sort(key=lambda group: walk_position(index.files, group))
+            writer.write(groups)
+        else:
+            writer.write(pairs)
+    finally:
+        writer.close()
+
+
+def save_index(index, args):
+    from .reference import ReferenceIndex
+
+    if args.save_index:
+        index.save(args.save_index)
+    if args.save_reference:
+        ReferenceIndex(index, args.threshold).save(args.save_reference)
+
+
+# Why threshold can't be used with hashes of algorithm and hash_size, or None if it can: a distance can't be
+# more than the number of bits in a hash
+def check_threshold(threshold, algorithm, hash_size):
+    num_bits = hash_bits(algorithm, hash_size)
+    if threshold > num_bits:
+        return f"--threshold must be at most {num_bits}, the number of bits in a {algorithm} hash of size {hash_size}"
+    return None
+
+
+# --merge: combines saved shard indexes and reports on them as a scan of all their files would
+def merge_main(args):
+    import os
+    from .shards import merge_indexes
+    from .store import read_store
+
+    if args.folder is not None:
+        print("duplinator: error: give either a folder or --merge, not both", file=sys.stderr)
+        return 2
+    if args.reference:
+        print("duplinator: error: --reference needs a folder to scan", file=sys.stderr)
+        return 2
+    for path in args.merge:
+        if not os.path.isfile(path):
+            print(f"duplinator: error: no such index: {path}", file=sys.stderr)
+            return 2
+    try:
+        info = read_store(args.merge[0])[0]
+    except ValueError as e:
+        print(f"duplinator: error: {e}", file=sys.stderr)
+        return 2
+    error = check_threshold(args.threshold, info["algorithm"], info["hash_size"]) if "algorithm" in info else None
+    if error:
+        print(f"duplinator: error: {error}", file=sys.stderr)
+        return 2
+    if args.progress:
+        print(f"merging {len(args.merge)} indexes", file=sys.stderr)
+    try:
+        index = merge_indexes(args.merge, args.threshold, args.partial, block_size=args.block_size)
+    except ValueError as e:
+        print(f"duplinator: error: {e}", file=sys.stderr)
+        return 2
+    stream = open(args.output, "w", newline="", encoding="utf-8") if args.output else sys.stdout
+    try:
+        write_index_results(index, args, stream)
+        save_index(index, args)
+    except KeyboardInterrupt:
+        return 130
+    except BrokenPipeError:
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        return 1
+    finally:
+        if args.output:
+            stream.close()
+    return 0
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.merge:
+        return merge_main(args)
+
+    import os
+    from .cache import CacheOptions, default_cache_path
+    from .frames import FrameOptions
+    from .grouping import DuplicateGrouper
+    from .hashing import DecodeOptions, parse_hash_specs
+    from .matching import MatchOptions
+    from .scanner import DuplicateScanner
+    from .shards import Shard
+    from .stats import DiagnosticOptions
+    from .walker import WalkOptions
+
+    if args.folder is None:
+        print("duplinator: error: give a folder to scan, or --merge to merge saved indexes", file=sys.stderr)
+        return 2
+    if not os.path.isdir(args.folder):
+        print(f"duplinator: error: not a folder: {args.folder}", file=sys.stderr)
+        return 2
+    if args.profile in WORKER_STAGES and args.backend == "process" and args.workers != 1:
+        print(f"duplinator: error: --profile {args.profile} runs in the worker processes; use --backend thread", file=sys.stderr)
+        return 2
+    if args.algorithm == "whash" and args.hash_size & (args.hash_size - 1):
+        print("duplinator: error: whash needs a --hash-size that is a power of 2", file=sys.stderr)
+        return 2
+    error = check_threshold(args.threshold, args.algorithm, args.hash_size)
+    if error:
+        print(f"duplinator: error: {error}", file=sys.stderr)
+        return 2
+    try:
+        extra_hashes = parse_hash_specs(args.also_hash, args.algorithm, args.hash_size)
+    except ValueError as e:
+        print(f"duplinator: error: --also-hash: {e}", file=sys.stderr)
+        return 2
+    reference = None
+    if args.reference:
+        from .reference import ReferenceIndex, TableThresholdTooLow
+        try:
+            try:
+                reference = ReferenceIndex.open(args.reference, args.threshold)
+            except TableThresholdTooLow as e:
+                print(f"duplinator: {e}; building one for threshold {args.threshold}", file=sys.stderr)
+                reference = ReferenceIndex.open(args.reference, args.threshold, rebuild=True)
+        except (OSError, ValueError) as e:
+            print(f"duplinator: error: --reference: {e}", file=sys.stderr)
+            return 2
+    if args.subfolders:
+        max_depth = None if args.levels == 0 else args.levels
+    else:
+        max_depth = 0
+    cache_path = None if args.no_cache else (args.cache or default_cache_path())
+    multi_thread = args.workers != 1
+    try:
+        scanner = DuplicateScanner(
+            args.folder, args.hash_size, args.threshold, max_depth, args.extensions, multi_thread, args.workers,
+            algorithm=args.algorithm, cascade=args.cascade, matching=MatchOptions(args.engine, args.block_size), caching=CacheOptions(cache_path, extra_hashes=extra_hashes), backend=args.backend,
+            decode=DecodeOptions(not args.full_decode, None if args.memory_limit == "none" else args.memory_limit), exact_first=args.exact_first, expand_copies=not args.group,
+            walk=WalkOptions(args.skip_hidden, args.follow_symlinks, args.walk_workers),
+            shard=Shard(*args.shard, args.shard_by) if args.shard else None, reference=reference, folder_pairs=args.folder_pairs,
+            diagnostics=DiagnosticOptions(args.slowest, args.profile, args.profile_mode),
+            frames=FrameOptions(args.frames, args.frame_sampling) if args.frames else None
+        )
+    except ValueError as e:
+        print(f"duplinator: error: {e}", file=sys.stderr)
+        return 2
+    grouper = DuplicateGrouper(args.keep, scanner.hash_distance) if args.group else None
+
+    stream = open(args.output, "w", newline="", encoding="utf-8") if args.output else sys.stdout
+    problem_stream = open(args.problems, "w", encoding="utf-8") if args.problems else None
+    try:
+        writer = GroupWriter(stream, args.format) if grouper is not None else PairWriter(stream, args.format)
+        try:
+            for event, data in scanner.scan():
+                if event == "progress":
+                    if args.progress:
+                        print(f"\r{format_progress(data, grouper):<79}", end="", file=sys.stderr, flush=True)
+                elif event == "problems":
+                    write_problems(data, problem_stream, args.progress)
+                elif grouper is not None:
+                    with scanner.scan_stats.stage("grouping", len(data)):
+                        grouper.add_pairs(data)
+                else:
+                    writer.write(data)
+            if grouper is not None and not scanner.cancelled:
+                with scanner.scan_stats.stage("grouping", 0):
+                    groups = grouper.groups()
+                    groups.sort(key=lambda group: walk_position(scanner.files, group))
+                writer.write(groups)
+            if not scanner.cancelled:
+                save_index(scanner.index, args)
+        finally:
+            writer.close()
+    except KeyboardInterrupt:
+        scanner.cancel()
+        return 130
+    except BrokenPipeError:
+        # Whatever was reading the output has gone away (e.g. piped into head), so stop scanning quietly
+        scanner.cancel()
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        return 1
+    finally:
+        if args.output:
+            stream.close()
+        if problem_stream is not None:
+            problem_stream.close()
+        if args.progress:
+            print(file=sys.stderr)
+        scanner.scan_stats.stop_profiling()
+        if args.stats:
+            write_stats(scanner, args)
+        if args.profile:
+            write_profile(scanner, args)
+    return 0
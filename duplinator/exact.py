@@ -0,0 +1,63 @@
+import hashlib
+import itertools
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+
+# Bytes read from each end of a file for the cheap partial digest
+PARTIAL_DIGEST_BYTES = 4096
+
+# Digests the first and last PARTIAL_DIGEST_BYTES of a file, or the whole file when it is small
+def partial_file_digest(filepath, size):
+    with open(filepath, "rb") as f:
+        if size <= 2 * PARTIAL_DIGEST_BYTES:
+            return hashlib.blake2b(f.read()).digest()
+        digest = hashlib.blake2b(f.read(PARTIAL_DIGEST_BYTES))
+        f.seek(-PARTIAL_DIGEST_BYTES, os.SEEK_END)
+        digest.update(f.read(PARTIAL_DIGEST_BYTES))
+        return digest.digest()
+
+# Streams a whole file through blake2b
+def full_file_digest(filepath):
+    digest = hashlib.blake2b()
+    with open(filepath, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.digest()
+
+# Runs a digest function, returning None if the file can't be read (hashing it reports why) or the scan was cancelled
+def safe_digest(filepath, digest_function, cancel_event=None):
+    if cancel_event is not None and cancel_event.is_set():
+        return None
+    try:
+        return digest_function(filepath)
+    except OSError:
+        return None
+
+# Splits each group of filepaths into sub-groups sharing the same digest, dropping files that can't be read
+def split_by_digest(groups, digest_function, num_workers, cancel_event=None):
+    candidates = [filepath for group in groups for filepath in group]
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        digests = dict(zip(candidates, executor.map(safe_digest, candidates, itertools.repeat(digest_function), itertools.repeat(cancel_event))))
+    split_groups = []
+    for group in groups:
+        by_digest = {}
+        for filepath in group:
+            if digests[filepath] is not None:
+                by_digest.setdefault(digests[filepath], []).append(filepath)
+        split_groups.extend(members for members in by_digest.values() if len(members) > 1)
+    return split_groups
+
+# Finds byte-identical files without decoding anything. Files are bucketed by size, then by a digest of
+# their first and last few KB, and only files that still collide are read in full to confirm.
+# Returns a list of groups, each a list of identical filepaths in input order.
+def find_exact_duplicates(filepaths, sizes, num_workers=1, cancel_event=None):
+    by_size = {}
+    for filepath in filepaths:
+        by_size.setdefault(sizes[filepath], []).append(filepath)
+    groups = [group for group in by_size.values() if len(group) > 1]
+    groups = split_by_digest(groups, lambda filepath: partial_file_digest(filepath, sizes[filepath]), num_workers, cancel_event)
+    # Small files were digested in full by the partial pass already
+    confirmed = [group for group in groups if sizes[group[0]] <= 2 * PARTIAL_DIGEST_BYTES]
+    confirmed += split_by_digest([group for group in groups if sizes[group[0]] > 2 * PARTIAL_DIGEST_BYTES], full_file_digest, num_workers, cancel_event)
+    return confirmed
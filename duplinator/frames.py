@@ -0,0 +1,278 @@
+import math
+from collections import namedtuple
+from contextlib import ExitStack, closing, contextmanager
+
+from .hashing import ImageTooLarge, _hash_decoded, decode_cost, hash_decode_target, hash_image, hash_input_size, hash_to_bytes, open_image, reduce_for_hashing
+from .matching import StreamingMatcher, pack_hashes, popcount64
+from .stats import FileTimer
+from .thumbnails import encode_thumbnail, make_thumbnail
+
+# Multi-frame hashing of animated images and videos. Up to max_frames frames of a file are sampled, evenly
+# spaced over its length or where the scene changes, each is hashed, and the hashes are kept together as the
+# file's frame sequence: max_frames hashes of a few bytes, however long the file. Frames are decoded and hashed
+# one at a time, so memory doesn't grow with the length of the file.
+# Sequences are matched in two steps (see SequenceMatcher): every frame goes into a streaming Hamming matcher
+# like the one still images use, and each pair of files with any frames in common is then aligned frame by
+# frame to see whether enough of them match in the same order.
+# Videos are read with PyAV (pip install av), imported only when a video is hashed. Animated GIF, WebP and PNG
+# files need nothing beyond PIL.
+
+VIDEO_EXTENSIONS = ('.mp4', '.m4v', '.mov', '.mkv', '.webm', '.avi', '.wmv', '.mpg', '.mpeg')
+# Image formats that may hold more than one frame
+ANIMATED_EXTENSIONS = ('.gif', '.webp', '.png')
+FRAME_SAMPLING = ("even", "scene")
+# Frames sampled per file by default
+DEFAULT_MAX_FRAMES = 16
+# How a scan hashes animated images and videos into frame sequences: up to count frames each, spaced as sampling
+# (one of FRAME_SAMPLING) says
+FrameOptions = namedtuple("FrameOptions", ("count", "sampling"), defaults=(DEFAULT_MAX_FRAMES, "even"))
+# With scene sampling, a frame starts a new scene when its 64 bit dhash differs from the last sampled frame's
+# in more than this many bits
+SCENE_CHANGE_BITS = 12
+# Share of the shorter sequence's frames that have to align with frames of the other, in order, for two
+# sequences to match. Evenly sampled re-encodes or resizes align almost frame for frame; a copy trimmed by a
+# third still aligns over half its frames.
+MIN_ALIGNED = 0.5
+
+
+def is_video(filepath):
+    return filepath.lower().endswith(VIDEO_EXTENSIONS)
+
+# Whether a file may have more than one frame, going by its extension
+def may_have_frames(filepath):
+    return filepath.lower().endswith(ANIMATED_EXTENSIONS + VIDEO_EXTENSIONS)
+
+# Indices of up to max_frames frames evenly spaced over count frames, each from the middle of its share
+def even_positions(count, max_frames):
+    if count <= max_frames:
+        return list(range(count))
+    return sorted({min(count - 1, int((k + 0.5) * count / max_frames)) for k in range(max_frames)})
+
+
+# Hashes the sampled frames of an animated image or video with (algorithm, hash_size), sampling up to max_frames
+# frames evenly or at scene changes (see FRAME_SAMPLING). With hash_specs, the file also gets the hashes a still
+# image would have with each (algorithm, hash_size) of them, and with thumbnail_size a thumbnail: an animated
+# image's come from its first frame, decoded as hashing.hash_image_file_multi() would with reduced_decode, so
+# the file is decoded only once for both; a video's come from its first sampled frame. Decoding waits for its
+# share of budget (a hashing.DecodeBudget), and a timer (a stats.FileTimer) times the sample and framehash
+# stages.
+# Returns (frame sequence, [ImageHash, ...] for hash_specs, thumbnail or None). The sequence is the frames'
+# hash bytes joined together, or b"" for an image with a single frame (whose hashes are then None, as nothing
+# past its header was read) or whose sampled frames are all one scene. Raises ImageTooLarge if a frame can't be
+# decoded within the budget, and whatever PIL or PyAV raise for a file they can't read.
+def hash_frames(filepath, hash_size, algorithm="phash", max_frames=DEFAULT_MAX_FRAMES, sampling="even", hash_specs=(), thumbnail_size=None, budget=None, timer=None, reduced_decode=True):
+    if sampling not in FRAME_SAMPLING:
+        raise ValueError(f"Unknown frame sampling: {sampling}")
+    timer = timer if timer is not None else FileTimer()
+    # Frames are reduced for the largest of the hashes, as still images are
+    largest = max([(algorithm, hash_size), *hash_specs], key=lambda spec: hash_input_size(*spec))
+    sequence = []
+    hashes = thumbnail = None
+    with ExitStack() as stack:
+        if is_video(filepath):
+            frames = stack.enter_context(closing(_video_frames(filepath, max_frames, sampling, hash_decode_target(largest[1], largest[0]), budget, timer)))
+        else:
+            with timer.stage("open"):
+                img = stack.enter_context(open_image(filepath, budget))
+            count = getattr(img, "n_frames", 1)
+            if count < 2:
+                return b"", None, None
+            # Every frame is decoded at full size, and composited over the previous one for GIFs
+            stack.enter_context(_reserve(budget, 2 * decode_cost(img), img.size, timer))
+            if hash_specs:
+                hashes, thumbnail = _hash_decoded(img, hash_specs, reduced_decode, thumbnail_size, timer=timer)
+            frames = _image_frames(img, count, max_frames, sampling, largest, timer)
+        for frame, size in frames:
+            with timer.stage("framehash"):
+                if hashes is None:
+                    hashes = [hash_image(frame if name == "colorhash" else frame.convert("L"), spec_size, name) for name, spec_size in hash_specs]
+                    if thumbnail_size and max(frame.size) >= thumbnail_size:
+                        thumbnail = (*size, encode_thumbnail(make_thumbnail(frame, thumbnail_size)))
+                sequence.append(hash_to_bytes(hash_image(frame if algorithm == "colorhash" else frame.convert("L"), hash_size, algorithm)))
+    if len(sequence) < 2 and not is_video(filepath):
+        return b"", hashes, thumbnail
+    if not sequence:
+        raise ValueError("no frames could be decoded")
+    return b"".join(sequence), hashes, thumbnail
+
+# Yields (frame, (width, height)) for the sampled frames of img, an animated image of count frames opened with
+# hashing.open_image(), each reduced for hashing
+def _image_frames(img, count, max_frames, sampling, largest, timer):
+    positions = even_positions(count, max_frames) if sampling == "even" else range(count)
+    frames = (_image_frame(img, position, largest, timer) for position in positions)
+    if sampling == "scene":
+        frames = _scene_changes(frames, max_frames, timer)
+    for frame in frames:
+        yield frame, img.size
+
+def _image_frame(img, position, largest, timer):
+    with timer.stage("sample"):
+        img.seek(position)
+        return reduce_for_hashing(img.convert("RGB"), largest[1], largest[0])
+
+# Yields (frame, (width, height)) for the sampled frames of a video, scaled down while converting to RGB so the
+# short side is target pixels. Even sampling seeks to each position and decodes forward to the frame shown
+# there; scene sampling only decodes keyframes, which encoders place at cuts, and keeps those that start a new
+# scene.
+def _video_frames(filepath, max_frames, sampling, target, budget, timer):
+    try:
+        import av
+    except ImportError:
+        raise ImportError("hashing videos needs PyAV (pip install av)") from None
+    with timer.stage("open"):
+        container = av.open(filepath)
+    with container:
+        if not container.streams.video:
+            raise ValueError("no video stream")
+        stream = container.streams.video[0]
+        stream.thread_type = "AUTO"
+        width, height = stream.codec_context.width, stream.codec_context.height
+        scale = min(1.0, target / max(1, min(width, height)))
+        size = (max(1, round(width * scale)), max(1, round(height * scale)))
+        # A decoder keeps several reference frames besides the one being converted
+        with _reserve(budget, 16 * width * height, (width, height), timer):
+            start = float(stream.start_time * stream.time_base) if stream.start_time is not None else 0.0
+            if stream.duration is not None:
+                duration = float(stream.duration * stream.time_base)
+            elif container.duration is not None:
+                duration = container.duration / av.time_base
+            else:
+                duration = None
+            if sampling == "scene" or not duration:
+                stream.codec_context.skip_frame = "NONKEY"
+                frames = (_video_frame(frame, size, timer) for frame in _timed(container.decode(stream), timer))
+                frames = _scene_changes(frames, max_frames, timer) if sampling == "scene" else _first(frames, max_frames)
+                for frame in frames:
+                    yield frame, (width, height)
+                return
+            for k in range(max_frames):
+                position = start + (k + 0.5) * duration / max_frames
+                with timer.stage("sample"):
+                    container.seek(int(position / stream.time_base), stream=stream)
+                    frame = None
+                    for frame in container.decode(stream):
+                        if frame.time is None or frame.time >= position - 1e-3:
+                            break
+                    if frame is None:
+                        return
+                    image = frame.to_image(width=size[0], height=size[1])
+                yield image, (width, height)
+
+# Decoded video frames, with the time spent decoding each one counted as sampling
+def _timed(frames, timer):
+    frames = iter(frames)
+    while True:
+        with timer.stage("sample", 0):
+            frame = next(frames, None)
+        if frame is None:
+            return
+        yield frame
+
+def _video_frame(frame, size, timer):
+    with timer.stage("sample"):
+        return frame.to_image(width=size[0], height=size[1])
+
+def _first(frames, count):
+    for frame, _ in zip(frames, range(count)):
+        yield frame
+
+# Keeps the first frame and each one after it that differs enough from the last one kept, up to max_frames
+def _scene_changes(frames, max_frames, timer):
+    import imagehash
+    last = None
+    kept = 0
+    for frame in frames:
+        with timer.stage("sample", 0):
+            frame_hash = imagehash.dhash(frame)
+            if last is not None and frame_hash - last <= SCENE_CHANGE_BITS:
+                continue
+            last = frame_hash
+        yield frame
+        kept += 1
+        if kept >= max_frames:
+            return
+
+# Holds cost bytes of budget while the frames of a file are decoded
+@contextmanager
+def _reserve(budget, cost, size, timer):
+    with ExitStack() as reservation:
+        if budget is not None:
+            if cost > budget.limit:
+                raise ImageTooLarge(f"{size[0]}x{size[1]} frames need about {cost >> 20} MB to decode, over the {budget.limit >> 20} MB memory limit")
+            with timer.stage("wait"):
+                reservation.enter_context(budget.reserve(cost))
+        yield
+
+
+# Splits a frame sequence (see hash_frames) into a packed (frames, words) uint64 matrix (see
+# matching.pack_hashes)
+def unpack_sequence(sequence, num_bits):
+    frame_bytes = (num_bits + 7) // 8
+    return pack_hashes([sequence[start:start + frame_bytes] for start in range(0, len(sequence), frame_bytes)], num_bits)
+
+# Aligns two packed frame sequences: finds the largest set of frame pairs within threshold that keeps both
+# sequences in order (and among those, the one with the smallest total distance), as for a longest common
+# subsequence. Returns (number of aligned frames, total distance of the aligned frames).
+def align_sequences(frames_a, frames_b, threshold):
+    distances = popcount64(frames_a[:, None, :] ^ frames_b[None, :, :]).sum(axis=2).tolist()
+    rows, cols = len(frames_a), len(frames_b)
+    # best[i][j] = (aligned, -distance) for the first i frames of a and the first j of b
+    best = [[(0, 0)] * (cols + 1) for _ in range(rows + 1)]
+    for i in range(1, rows + 1):
+        row, previous, frame_distances = best[i], best[i - 1], distances[i - 1]
+        for j in range(1, cols + 1):
+            value = max(previous[j], row[j - 1])
+            distance = frame_distances[j - 1]
+            if distance <= threshold:
+                aligned, total = previous[j - 1]
+                value = max(value, (aligned + 1, total - distance))
+            row[j] = value
+    aligned, total = best[rows][cols]
+    return aligned, -total
+
+# Whether two sequences of the given lengths with aligned frames in common count as the same clip
+def sequences_match(aligned, length_a, length_b):
+    shorter = min(length_a, length_b)
+    return aligned >= min(2, shorter) and aligned >= math.ceil(MIN_ALIGNED * shorter)
+
+
+# Streaming matcher for frame sequences, the counterpart of matching.StreamingMatcher for files with several
+# frames. add() takes a batch of (key, sequence) and returns (key1, key2, distance) for every pair of a new
+# sequence and one added before it (or earlier in the batch) that align (see align_sequences() and
+# MIN_ALIGNED), key1 being the earlier one. The distance is the mean distance of the aligned frames, rounded,
+# so it is within threshold like any other pair's. Every frame is indexed on its own, so only files sharing
+# at least one frame within threshold are ever aligned.
+class SequenceMatcher:
+    def __init__(self, num_bits, threshold, engine="auto", block_size=1024):
+        self.num_bits = num_bits
+        self.threshold = threshold
+        self.frames = StreamingMatcher(num_bits, threshold, engine, block_size)
+        # The position, in the order they were added, of the sequence each indexed frame belongs to
+        self.frame_owners = []
+        self.keys = []
+        self.sequences = []
+
+    def __len__(self):
+        return len(self.keys)
+
+    def add(self, batch):
+        frame_bytes = (self.num_bits + 7) // 8
+        frame_hashes = []
+        for key, sequence in batch:
+            self.keys.append(key)
+            self.sequences.append(unpack_sequence(sequence, self.num_bits))
+            for start in range(0, len(sequence), frame_bytes):
+                frame_hashes.append(sequence[start:start + frame_bytes])
+                self.frame_owners.append(len(self.keys) - 1)
+        candidates = set()
+        for i, j, distance in self.frames.add(frame_hashes):
+            owner_i, owner_j = self.frame_owners[i], self.frame_owners[j]
+            if owner_i != owner_j:
+                candidates.add((owner_i, owner_j))
+        found = []
+        for owner_i, owner_j in sorted(candidates):
+            frames_i, frames_j = self.sequences[owner_i], self.sequences[owner_j]
+            aligned, total = align_sequences(frames_i, frames_j, self.threshold)
+            if sequences_match(aligned, len(frames_i), len(frames_j)):
+                found.append((self.keys[owner_i], self.keys[owner_j], round(total / aligned)))
+        return found
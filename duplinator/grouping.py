@@ -0,0 +1,143 @@
+import os
+
+# Ways of choosing which file of a group to keep:
+#   resolution - the most pixels, then the largest file, then the oldest
+#   size       - the largest file, then the most pixels, then the oldest
+#   oldest     - the earliest modification time, then the most pixels, then the largest file
+KEEP_POLICIES = ("resolution", "size", "oldest")
+
+
+# Disjoint-set forest with union by size and path halving, so merging the match graph one pair at a time
+# stays close to constant time per pair however large the groups grow
+class UnionFind:
+    def __init__(self):
+        self.parent = {}
+        self.size = {}
+
+    def __contains__(self, item):
+        return item in self.parent
+
+    def add(self, item):
+        if item not in self.parent:
+            self.parent[item] = item
+            self.size[item] = 1
+
+    def find(self, item):
+        parent = self.parent
+        while parent[item] != item:
+            parent[item] = parent[parent[item]]
+            item = parent[item]
+        return item
+
+    # Merges the sets holding item1 and item2 and returns the root of the merged set
+    def union(self, item1, item2):
+        self.add(item1)
+        self.add(item2)
+        root1, root2 = self.find(item1), self.find(item2)
+        if root1 == root2:
+            return root1
+        if self.size[root1] < self.size[root2]:
+            root1, root2 = root2, root1
+        self.parent[root2] = root1
+        self.size[root1] += self.size.pop(root2)
+        return root1
+
+# Reads what the keep policies compare. Only the image header is read, not the pixel data.
+# Returns None if the file can't be read any more.
+def read_file_attributes(filepath):
+    from PIL import Image
+    try:
+        stat = os.stat(filepath)
+        with Image.open(filepath) as img:
+            width, height = img.size
+    except Exception:
+        return None
+    return {"width": width, "height": height, "size": stat.st_size, "mtime": stat.st_mtime}
+
+# Sort key that puts the file to keep first under a keep policy; unreadable files sort last
+def keep_key(attributes, policy):
+    if attributes is None:
+        return (1,)
+    pixels = attributes["width"] * attributes["height"]
+    if policy == "resolution":
+        return (0, -pixels, -attributes["size"], attributes["mtime"])
+    if policy == "size":
+        return (0, -attributes["size"], -pixels, attributes["mtime"])
+    if policy == "oldest":
+        return (0, attributes["mtime"], -pixels, -attributes["size"])
+    raise ValueError(f"Unknown keep policy: {policy}")
+
+# Merges duplicate pairs into groups as they are found, so k mutual near-duplicates become one group of k
+# files instead of k*(k-1)/2 pairs. Matching is transitive within a group: every file is within the
+# threshold of at least one other member, not necessarily of all of them.
+# Each group's representative is the file its keep policy would keep, and each member's distance is measured
+# to that representative with hash_distance(filepath1, filepath2) (e.g. DuplicateScanner.hash_distance);
+# without it only distances of directly matched pairs are known and the others are None.
+# attributes can share the file attributes read by an earlier grouper of the same files, so regrouping them
+# doesn't read every image header again.
+class DuplicateGrouper:
+    def __init__(self, keep="resolution", hash_distance=None, attributes=None):
+        if keep not in KEEP_POLICIES:
+            raise ValueError(f"Unknown keep policy: {keep}")
+        self.keep = keep
+        self.hash_distance = hash_distance
+        self.union_find = UnionFind()
+        # Members of each group by root, and the order files were first seen in
+        self.members = {}
+        self.order = {}
+        self.pair_distances = {}
+        self.attributes = {} if attributes is None else attributes
+
+    # Adds a batch of (filepath1, filepath2, distance) pairs.
+    # Returns (changed, removed): roots of the groups that are new or gained members, and roots of groups
+    # that were merged into another one and no longer exist.
+    def add_pairs(self, pairs):
+        changed, removed = set(), set()
+        for filepath1, filepath2, distance in pairs:
+            for filepath in (filepath1, filepath2):
+                if filepath not in self.union_find:
+                    self.union_find.add(filepath)
+                    self.order[filepath] = len(self.order)
+                    self.members[filepath] = [filepath]
+            if self.hash_distance is None:
+                self.pair_distances[(filepath1, filepath2)] = self.pair_distances[(filepath2, filepath1)] = distance
+            root1, root2 = self.union_find.find(filepath1), self.union_find.find(filepath2)
+            if root1 == root2:
+                continue
+            root = self.union_find.union(root1, root2)
+            merged = root2 if root == root1 else root1
+            self.members[root].extend(self.members.pop(merged))
+            changed.discard(merged)
+            removed.add(merged)
+            changed.add(root)
+        removed -= changed
+        return changed, removed
+
+    def root(self, filepath):
+        return self.union_find.find(filepath)
+
+    # Returns {"id": root, "keep": representative, "files": [(filepath, distance to the representative), ...]}
+    # with the representative first and the others in the order they were found
+    def group(self, root):
+        files = sorted(self.members[root], key=self.order.__getitem__)
+        for filepath in files:
+            if filepath not in self.attributes:
+                self.attributes[filepath] = read_file_attributes(filepath)
+        keep = min(files, key=lambda filepath: keep_key(self.attributes[filepath], self.keep))
+        entries = [(keep, 0)]
+        for filepath in files:
+            if filepath != keep:
+                if self.hash_distance is not None:
+                    distance = self.hash_distance(keep, filepath)
+                else:
+                    distance = self.pair_distances.get((keep, filepath))
+                entries.append((filepath, distance))
+        return {"id": root, "keep": keep, "files": entries}
+
+    # Every group, ordered by when its first file was found
+    def groups(self):
+        roots = sorted(self.members, key=lambda root: min(self.order[filepath] for filepath in self.members[root]))
+        return [self.group(root) for root in roots]
+
+    def __len__(self):
+        return len(self.members)
@@ -0,0 +1,523 @@
+import os
+import sys
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from contextlib import ExitStack, contextmanager, nullcontext
+from functools import partial
+from types import SimpleNamespace
+
+import numpy as np
+
+from .stats import FileTimer
+from .thumbnails import encode_thumbnail, make_thumbnail
+
+# PIL and imagehash are imported inside the functions that use them so that importing the package,
+# or running the command line with --help, stays fast.
+
+
+# Hash algorithms from imagehash that a scan can use. They all work on the image shrunk to a small square
+# (see hash_input_size), so their cost is small next to decoding the file; dhash and ahash are the cheapest,
+# colorhash the most expensive as it converts the whole decoded image to HSV.
+HASH_ALGORITHMS = ("ahash", "dhash", "phash", "whash", "colorhash")
+
+# Number of bits in a hash. For colorhash, hash_size is the number of bits per colour bin (14 bins).
+def hash_bits(algorithm, hash_size):
+    return 14 * hash_size if algorithm == "colorhash" else hash_size * hash_size
+
+def hash_shape(algorithm, hash_size):
+    return (14, hash_size) if algorithm == "colorhash" else (hash_size, hash_size)
+
+# Side of the square an algorithm shrinks the image to before hashing it
+def hash_input_size(algorithm, hash_size):
+    return hash_size + 1 if algorithm in ("ahash", "dhash") else hash_size * 4
+
+# Raises ValueError for an algorithm or hash size imagehash can't use
+def check_hash_algorithm(algorithm, hash_size):
+    if algorithm not in HASH_ALGORITHMS:
+        raise ValueError(f"Unknown hash algorithm: {algorithm}")
+    if algorithm == "whash" and hash_size & (hash_size - 1):
+        raise ValueError("whash needs a hash size that is a power of 2")
+
+# Parses a comma separated list of extra hashes to compute, e.g. "12, 16, dhash, whash:16", into
+# (algorithm, hash_size) specs. A bare size uses algorithm and a bare algorithm uses hash_size.
+# Raises ValueError for anything that isn't a valid spec.
+def parse_hash_specs(text, algorithm, hash_size):
+    specs = []
+    for item in text.split(","):
+        item = item.strip().lower()
+        if not item:
+            continue
+        if ":" in item:
+            name, size = item.split(":", 1)
+        elif item.isdigit():
+            name, size = algorithm, item
+        else:
+            name, size = item, hash_size
+        try:
+            spec = (name.strip() or algorithm, int(size))
+        except ValueError:
+            raise ValueError(f"Invalid hash size in {item!r}") from None
+        if spec[1] < 2:
+            raise ValueError(f"Hash size must be at least 2 in {item!r}")
+        check_hash_algorithm(*spec)
+        if spec not in specs:
+            specs.append(spec)
+    return specs
+
+# Computes an ImageHash of an opened image with one of HASH_ALGORITHMS.
+# whash is given a fixed image_scale rather than one derived from the image size, so a resized copy of an
+# image is hashed at the same scale as the original.
+def hash_image(img, hash_size, algorithm="phash"):
+    import imagehash
+    if algorithm == "phash":
+        return imagehash.phash(img, hash_size=hash_size)
+    if algorithm == "dhash":
+        return imagehash.dhash(img, hash_size=hash_size)
+    if algorithm == "ahash":
+        return imagehash.average_hash(img, hash_size=hash_size)
+    if algorithm == "whash":
+        return imagehash.whash(img, hash_size=hash_size, image_scale=hash_size * 4)
+    if algorithm == "colorhash":
+        return imagehash.colorhash(img, binbits=hash_size)
+    raise ValueError(f"Unknown hash algorithm: {algorithm}")
+
+# Serialises an ImageHash to its raw packed bits, the compact form kept in the hash cache
+def hash_to_bytes(image_hash):
+    return np.packbits(image_hash.hash.flatten()).tobytes()
+
+# Rebuilds an ImageHash from the raw bytes produced by hash_to_bytes
+def hash_from_bytes(data, hash_size, algorithm="phash"):
+    import imagehash
+    shape = hash_shape(algorithm, hash_size)
+    bits = np.unpackbits(np.frombuffer(data, dtype=np.uint8))[:shape[0] * shape[1]]
+    return imagehash.ImageHash(bits.astype(bool).reshape(shape))
+
+# Decoding at 8x the side of the square an algorithm hashes (hash_input_size) keeps the hash close to a
+# full-resolution decode while still letting large photos be decoded at a fraction of their size.
+# dhash and ahash hash such a small square that 8x is still coarse, so nothing is decoded smaller than
+# HASH_DECODE_MIN_TARGET (what phash at the default size uses). That also means hashes of every default-sized
+# algorithm come from the same reduced image, whether computed alone or together (see hash_image_file_multi).
+HASH_DECODE_OVERSAMPLE = 8
+HASH_DECODE_MIN_TARGET = 256
+
+# A file a scan couldn't hash: status is "failed" if it couldn't be read or decoded and "skipped" if it was left
+# out on purpose (too large to decode within the memory limit, see DecodeBudget), with message saying why
+FileProblem = namedtuple("FileProblem", ("filepath", "status", "message"))
+
+# How a scan decodes its images. With reduced, images are decoded at the smallest size still large enough to hash
+# (see reduce_for_hashing()); hashes made either way are cached apart. memory_limit caps the memory, in bytes,
+# that the images being decoded at once may take ("auto" for default_memory_limit(), None for no cap, see
+# DecodeBudget); images too large to decode in full within it are decoded reduced, and ones too large even then
+# are skipped.
+DecodeOptions = namedtuple("DecodeOptions", ("reduced", "memory_limit"), defaults=(True, "auto"))
+
+# Raised for an image that can't be decoded within the memory limit however far it is reduced
+class ImageTooLarge(Exception):
+    pass
+
+
+# Caps the memory that images being decoded at once may take at limit bytes, across every hashing worker.
+# Each decode reserves its estimated cost (see decode_cost()) and waits while the decodes already running would
+# take the total over the limit, so a few huge TIFFs or PNGs are decoded one or two at a time while ordinary
+# photos still go through as many at once as there are workers. A decode is let through whenever nothing else
+# is running, and images needing more than the whole limit even when reduced are skipped (see _hash_decoded()),
+# so every reservation is eventually granted. With shared the budget can be handed to worker processes as they
+# start (see create_hash_executor()).
+class DecodeBudget:
+    def __init__(self, limit, shared=False):
+        self.limit = limit
+        if shared:
+            import multiprocessing
+            self.condition = multiprocessing.Condition()
+            self.used = multiprocessing.RawValue("q", 0)
+        else:
+            self.condition = threading.Condition()
+            self.used = SimpleNamespace(value=0)
+
+    @contextmanager
+    def reserve(self, cost):
+        with self.condition:
+            while self.used.value and self.used.value + cost > self.limit:
+                self.condition.wait()
+            self.used.value += cost
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.used.value -= cost
+                self.condition.notify_all()
+
+# Memory limit for decoding used when it is "auto": half the physical memory, or 2 GiB if that can't be found
+def default_memory_limit():
+    try:
+        return os.sysconf("SC_PHYS_PAGES") * os.sysconf("SC_PAGE_SIZE") // 2
+    except (AttributeError, ValueError, OSError):
+        pass
+    if sys.platform == "win32":
+        import ctypes
+
+        class MemoryStatus(ctypes.Structure):
+            _fields_ = [("dwLength", ctypes.c_ulong), ("dwMemoryLoad", ctypes.c_ulong)] + [(name, ctypes.c_ulonglong) for name in (
+                "ullTotalPhys", "ullAvailPhys", "ullTotalPageFile", "ullAvailPageFile", "ullTotalVirtual", "ullAvailVirtual", "ullAvailExtendedVirtual")]
+
+        status = MemoryStatus(dwLength=ctypes.sizeof(MemoryStatus))
+        if ctypes.windll.kernel32.GlobalMemoryStatusEx(ctypes.byref(status)):
+            return status.ullTotalPhys // 2
+    return 2 << 30
+
+# Estimated peak memory, in bytes, of decoding an opened (not yet loaded) image at its current size and hashing
+# it, worked out from the header alone. PIL keeps 1-bit, greyscale and palette images at a byte a pixel, 16-bit
+# ones at two and everything else, RGB included, at four; the greyscale copy the hashes are taken from adds a
+# byte a pixel, and converting any other mode to RGB first another four.
+def decode_cost(img):
+    if img.mode in ("1", "L", "P"):
+        bytes_per_pixel = 1
+    elif img.mode.startswith("I;16"):
+        bytes_per_pixel = 2
+    else:
+        bytes_per_pixel = 4
+    return img.width * img.height * (bytes_per_pixel + (1 if img.mode in ("RGB", "L") else 5))
+
+# Held while open_image() has PIL's pixel limit lifted, so one thread can't restore it under another
+_pixel_limit_lock = threading.Lock()
+
+# Opens an image to hash. PIL refuses to open an image of more than twice Image.MAX_IMAGE_PIXELS pixels as a
+# likely decompression bomb; with a budget, which knows how small the image can be decoded and what that costs,
+# the budget is the guard instead, so such an image is opened again with the limit lifted for just that call.
+# Only the header is read by then. Another thread opening an image at the same moment skips the check as well,
+# which is harmless for the scan's own decodes as they all reserve their memory from a budget.
+def open_image(filepath, budget=None):
+    from PIL import Image
+    try:
+        return Image.open(filepath)
+    except Image.DecompressionBombError:
+        if budget is None:
+            raise
+    with _pixel_limit_lock:
+        max_pixels = Image.MAX_IMAGE_PIXELS
+        Image.MAX_IMAGE_PIXELS = None
+        try:
+            return Image.open(filepath)
+        finally:
+            Image.MAX_IMAGE_PIXELS = max_pixels
+
+# Selects the smallest reduced-resolution level of a pyramid TIFF that is still at least target pixels
+# on its short side. Levels are recognised by the reduced-image bit of the NewSubfileType tag (254).
+def select_tiff_level(img, target):
+    best_frame, best_width = 0, img.width
+    for frame in range(1, img.n_frames):
+        img.seek(frame)
+        if img.tag_v2.get(254, 0) & 1 and min(img.size) >= target and img.width < best_width:
+            best_frame, best_width = frame, img.width
+    img.seek(best_frame)
+
+# Short side an image is decoded down to for hashing it with algorithm at hash_size
+def hash_decode_target(hash_size, algorithm="phash"):
+    return max(hash_input_size(algorithm, hash_size) * HASH_DECODE_OVERSAMPLE, HASH_DECODE_MIN_TARGET)
+
+# Sets an opened image up to be decoded at the smallest size still at least target pixels on its short side,
+# where the format allows it (see reduce_for_hashing()). Nothing is decoded yet, but img.size and img.mode
+# already give the size and mode the decode will have.
+def prepare_reduced_decode(img, target):
+    if img.format == "JPEG":
+        img.draft("RGB", (target, target))
+    elif img.format == "TIFF" and getattr(img, "n_frames", 1) > 1:
+        select_tiff_level(img, target)
+
+# Asks the decoder for the smallest version of the image that is still large enough to hash.
+# JPEGs are DCT-scaled while decoding (draft mode) and pyramid TIFFs use their smallest usable level;
+# other formats have to be decoded in full but are box-reduced before the hash's own LANCZOS resize.
+# Compared with a full-resolution decode this changes on average 0.1 bits (max 2) of a hash_size 8
+# phash and under 1 bit (max 4) of a hash_size 16 one, comfortably inside the default threshold.
+# Embedded EXIF thumbnails are not used as they are often letterboxed or stale after edits (the cascade's
+# first pass does use them, see hash_for_cascade()).
+# Colour is kept so the same reduced image can also be used for the result thumbnail and colorhash; the other
+# algorithms convert to greyscale themselves, which gives the same hash as decoding in greyscale.
+def reduce_for_hashing(img, hash_size, algorithm="phash"):
+    target = hash_decode_target(hash_size, algorithm)
+    prepare_reduced_decode(img, target)
+    factor = min(img.size) // target
+    if factor >= 2:
+        if img.mode not in ("RGB", "L"):
+            img = img.convert("RGB")
+        return img.reduce(factor)
+    return img
+
+# How an opened image is laid out in its file if it is stored as plain rows of pixels (uncompressed TIFFs, BMPs,
+# PPMs and the like), as (offset of the first row, PIL raw mode, bytes a row, 1 if rows run top down or -1 if
+# bottom up), or None for anything else. Such an image can be decoded a band of rows at a time (see
+# reduce_in_bands()); compressed ones, PNG included, can only be decoded whole.
+def raw_layout(img):
+    from PIL import Image
+    if len(img.tile) != 1 or img.mode in ("P", "PA"):
+        return None
+    codec, extents, offset, args = img.tile[0][:4]
+    if codec != "raw" or tuple(extents) != (0, 0, img.width, img.height):
+        return None
+    if isinstance(args, str):
+        args = (args,)
+    rawmode, stride, orientation = (*args, 0, 1)[:3]
+    if not stride:
+        stride = len(Image.new(img.mode, (img.width, 1)).tobytes("raw", rawmode))
+    return offset, rawmode, stride, orientation
+
+# Decodes an image laid out as layout (see raw_layout()) and box-reduces it by factor, band_rows rows at a time,
+# so only one band is ever in memory at full size. band_rows is a multiple of factor, which gives the same image
+# as reduce_for_hashing() does from a full decode.
+def reduce_in_bands(img, layout, factor, band_rows):
+    from PIL import Image
+    offset, rawmode, stride, orientation = layout
+    mode = img.mode if img.mode in ("RGB", "L") else "RGB"
+    reduced = Image.new(mode, (-(-img.width // factor), -(-img.height // factor)))
+    for top in range(0, img.height, band_rows):
+        rows = min(band_rows, img.height - top)
+        img.fp.seek(offset + (top if orientation > 0 else img.height - top - rows) * stride)
+        data = img.fp.read(rows * stride)
+        if len(data) < rows * stride:
+            raise OSError("image file is truncated")
+        band = Image.frombytes(img.mode, (img.width, rows), data, "raw", rawmode, stride, orientation)
+        if band.mode != mode:
+            band = band.convert(mode)
+        reduced.paste(band.reduce(factor), (0, top // factor))
+    return reduced
+
+# Plans decoding an opened image that is too large to decode whole within limit bytes a band at a time instead
+# (see reduce_in_bands()), taking bands of about a quarter of the limit so other decodes can still run. Returns
+# (layout, factor, band_rows, estimated cost), or None if the image can't be decoded that way within the limit.
+def plan_band_decode(img, target, limit):
+    layout = raw_layout(img)
+    factor = min(img.size) // target
+    if layout is None or factor < 2:
+        return None
+    row_cost = -(-decode_cost(img) // img.height)
+    band_rows = max(factor, limit // 4 // row_cost // factor * factor)
+    cost = band_rows * row_cost + -(-img.width // factor) * -(-img.height // factor) * 5
+    return (layout, factor, band_rows, cost) if cost <= limit else None
+
+# Hashes a single image and, when thumbnail_size is given, thumbnails it from the same decode.
+# Returns (ImageHash, (width, height, jpeg_bytes) or None); the hash is None if the file cannot be read.
+# Thumbnails are only made from images that were decoded at reduced size: small images are cheap to decode
+# again when shown, and most scanned files never appear in the results.
+def hash_image_file(filepath, hash_size, reduced_decode=True, thumbnail_size=None, algorithm="phash", budget=None):
+    hashes, thumbnail, problem = hash_image_file_multi(filepath, [(algorithm, hash_size)], reduced_decode, thumbnail_size, budget)
+    return (None if hashes is None else hashes[0]), thumbnail
+
+# Like hash_image_file, but computes a hash for every (algorithm, hash_size) in hash_specs from one decode.
+# The image is reduced for the largest of them, so a smaller spec's hash can differ from hashing it alone as
+# much as a reduced decode differs from a full one (on average 0.1 bits, at most 2, for phash at size 8).
+# With a budget (a DecodeBudget) the decode waits for its share of the memory limit. With a timer (a
+# stats.FileTimer) each stage of the work is timed.
+# Returns ([ImageHash, ...] in the order of hash_specs, thumbnail or None, None), or (None, None, FileProblem)
+# if the file can't be hashed.
+def hash_image_file_multi(filepath, hash_specs, reduced_decode=True, thumbnail_size=None, budget=None, timer=None):
+    try:
+        with _stage(timer, "open"):
+            img = open_image(filepath, budget)
+        with img:
+            return (*_hash_decoded(img, hash_specs, reduced_decode, thumbnail_size, budget, timer), None)
+    except ImageTooLarge as e:
+        return None, None, FileProblem(filepath, "skipped", str(e))
+    except Exception as e:
+        return None, None, FileProblem(filepath, "failed", str(e) or type(e).__name__)
+
+# Decodes an opened image once, reduced only as far as the largest of hash_specs allows, and hashes it with each
+# (algorithm, hash_size). Every algorithm but colorhash starts by converting to greyscale, so that is done once
+# here and shared; it gives the same hashes as converting for each. Returns ([ImageHash, ...], thumbnail or None).
+# With a budget, an image too large to decode in full within its limit is decoded reduced even without
+# reduced_decode, a band of rows at a time if it has to be and can be (see plan_band_decode()), and ImageTooLarge
+# is raised for one that is too large even then.
+def _hash_decoded(img, hash_specs, reduced_decode, thumbnail_size, budget=None, timer=None):
+    width, height = img.size
+    algorithm, hash_size = max(hash_specs, key=lambda spec: hash_input_size(*spec))
+    target = hash_decode_target(hash_size, algorithm)
+    if reduced_decode:
+        prepare_reduced_decode(img, target)
+    bands = None
+    with ExitStack() as reservation:
+        if budget is not None:
+            cost = decode_cost(img)
+            if cost > budget.limit and not reduced_decode:
+                reduced_decode = True
+                prepare_reduced_decode(img, target)
+                cost = decode_cost(img)
+            if cost > budget.limit:
+                bands = plan_band_decode(img, target, budget.limit)
+                if bands is None:
+                    raise ImageTooLarge(f"{width}x{height} image needs about {cost >> 20} MB to decode, over the {budget.limit >> 20} MB memory limit")
+                cost = bands[3]
+            with _stage(timer, "wait"):
+                reservation.enter_context(budget.reserve(cost))
+        with _stage(timer, "decode"):
+            if bands is not None:
+                img = reduce_in_bands(img, *bands[:3])
+            elif reduced_decode:
+                img = reduce_for_hashing(img, hash_size, algorithm)
+            img.load()
+        with _stage(timer, "hash"):
+            grey = None
+            hashes = []
+            for algorithm, hash_size in hash_specs:
+                if algorithm == "colorhash":
+                    hashes.append(hash_image(img, hash_size, algorithm))
+                else:
+                    if grey is None:
+                        grey = img.convert("L")
+                    hashes.append(hash_image(grey, hash_size, algorithm))
+        thumbnail = None
+        if thumbnail_size and img.size != (width, height) and max(img.size) >= thumbnail_size:
+            with _stage(timer, "thumbnail"):
+                thumbnail = (width, height, encode_thumbnail(make_thumbnail(img, thumbnail_size)))
+    return hashes, thumbnail
+
+def _stage(timer, name):
+    return timer.stage(name) if timer is not None else nullcontext()
+
+# Returns the preview a camera embeds in a JPEG's EXIF data, or None if there is none (or it is too small to
+# hash). Cameras often letterbox it to 4:3 or 16:9, so it is cropped back to the main image's aspect ratio.
+def embedded_thumbnail(img, min_size):
+    import io
+    from PIL import ExifTags, Image
+    if img.format != "JPEG" or not img.info.get("exif"):
+        return None
+    try:
+        ifd1 = img.getexif().get_ifd(ExifTags.IFD.IFD1)
+        offset, length = ifd1.get(0x0201), ifd1.get(0x0202)
+        if not offset or not length:
+            return None
+        # Offsets count from the TIFF header, which follows the 6 byte "Exif\0\0" marker
+        thumbnail = Image.open(io.BytesIO(img.info["exif"][6 + offset:6 + offset + length]))
+        thumbnail.load()
+    except Exception:
+        return None
+    thumb_width, thumb_height = thumbnail.size
+    aspect = img.width / img.height
+    if thumb_width / thumb_height > aspect * 1.02:
+        width = round(thumb_height * aspect)
+        thumbnail = thumbnail.crop(((thumb_width - width) // 2, 0, (thumb_width + width) // 2, thumb_height))
+    elif thumb_width / thumb_height < aspect / 1.02:
+        height = round(thumb_width / aspect)
+        thumbnail = thumbnail.crop((0, (thumb_height - height) // 2, thumb_width, (thumb_height + height) // 2))
+    return thumbnail if min(thumbnail.size) >= min_size else None
+
+# First pass of a cascaded scan (see scanner.DuplicateScanner) for one file. The cheap prefilter hash is taken
+# from the embedded EXIF thumbnail when there is one, which needs no decoding of the image itself, and the
+# algorithm hash is left for later. Otherwise the image has to be decoded anyway and both hashes come from
+# that one decode, the algorithm hash being cheap next to the decode, along with any extra_specs.
+# Returns (prefilter ImageHash, [ImageHash, ...] for (algorithm, hash_size) then extra_specs or None, thumbnail or
+# None, None), or (None, None, None, FileProblem) if the file can't be hashed.
+def hash_for_cascade(filepath, hash_size, reduced_decode=True, thumbnail_size=None, algorithm="phash", prefilter="dhash", extra_specs=(), budget=None, timer=None):
+    try:
+        with _stage(timer, "open"):
+            img = open_image(filepath, budget)
+        with img:
+            with _stage(timer, "decode"):
+                thumbnail = embedded_thumbnail(img, hash_input_size(prefilter, hash_size))
+            if thumbnail is not None:
+                with _stage(timer, "hash"):
+                    return hash_image(thumbnail, hash_size, prefilter), None, None, None
+            hashes, thumbnail = _hash_decoded(img, [(prefilter, hash_size), (algorithm, hash_size), *extra_specs], reduced_decode, thumbnail_size, budget, timer)
+            return hashes[0], hashes[1:], thumbnail, None
+    except ImageTooLarge as e:
+        return None, None, None, FileProblem(filepath, "skipped", str(e))
+    except Exception as e:
+        return None, None, None, FileProblem(filepath, "failed", str(e) or type(e).__name__)
+
+# Hashes a single image, returning None if it cannot be read
+def compute_hash(filepath, hash_size, reduced_decode=True, algorithm="phash"):
+    return hash_image_file(filepath, hash_size, reduced_decode, algorithm=algorithm)[0]
+
+# Process pool worker: returns the raw hash bytes rather than an ImageHash so results stay small to pickle
+def compute_hash_bytes(filepath, hash_size, reduced_decode=True, algorithm="phash"):
+    hash_value = compute_hash(filepath, hash_size, reduced_decode, algorithm)
+    return None if hash_value is None else hash_to_bytes(hash_value)
+
+# The DecodeBudget of a worker process, handed to it as it starts (see create_hash_executor())
+_worker_budget = None
+
+def _set_worker_budget(budget):
+    global _worker_budget
+    _worker_budget = budget
+
+# Worker entry point for the scan pipeline: hashes a chunk of files, returning (hash_bytes or None, thumbnail or
+# None, prefilter hash_bytes or None, [hash_bytes for each of extra_specs] or None, FileProblem or None,
+# {stage: (wall seconds, CPU seconds, count)}, frame sequence or None) for each. Thumbnails are only made when
+# thumbnail_size is given. The extra (algorithm, hash_size) specs come from the same decode as the main hash.
+# With a prefilter algorithm this is a cascade's first pass (see hash_for_cascade), in which files hashed from
+# their EXIF thumbnail only get a prefilter hash. Decodes share budget, or in a worker process the budget the
+# process was started with. profile_hook is passed on to each file's stats.FileTimer; it only works on thread
+# workers.
+# Videos (see frames.VIDEO_EXTENSIONS) are hashed from their first sampled frame. With frame_spec, a
+# (max_frames, sampling) pair, files that may have several frames also get a frame sequence (see
+# frames.hash_frames), b"" for an image that turns out to have only one. An animated image is decoded once for
+# both, its still image hashes coming from its first frame; one whose frames can't be sampled still gets those,
+# and its frames are tried again by the next scan.
+def compute_hash_chunk(filepaths, hash_size, reduced_decode=True, thumbnail_size=None, algorithm="phash", prefilter=None, extra_specs=(), budget=None, profile_hook=None, frame_spec=None):
+    from .frames import hash_frames, is_video, may_have_frames
+    budget = _worker_budget if budget is None else budget
+    results = []
+    for filepath in filepaths:
+        timer = FileTimer(profile_hook)
+        sequence = hashes = prefilter_hash = None
+        if is_video(filepath) or (frame_spec is not None and may_have_frames(filepath)):
+            max_frames, sampling = frame_spec or (1, "even")
+            specs = [(prefilter, hash_size)] if prefilter else []
+            thumbnail = problem = None
+            try:
+                sequence, hashes, thumbnail = hash_frames(filepath, hash_size, algorithm, max_frames, sampling, [*specs, (algorithm, hash_size), *extra_specs], thumbnail_size, budget, timer, reduced_decode)
+            except ImageTooLarge as e:
+                problem = FileProblem(filepath, "skipped", str(e))
+            except Exception as e:
+                problem = FileProblem(filepath, "failed", str(e) or type(e).__name__)
+            if prefilter and hashes is not None:
+                prefilter_hash, hashes = hashes[0], hashes[1:]
+            if frame_spec is None:
+                sequence = None
+        # Still images, and animated ones that turn out to have a single frame or whose frames failed
+        if hashes is None and not is_video(filepath):
+            if prefilter:
+                prefilter_hash, hashes, thumbnail, problem = hash_for_cascade(filepath, hash_size, reduced_decode, thumbnail_size, algorithm, prefilter, extra_specs, budget, timer)
+            else:
+                hashes, thumbnail, problem = hash_image_file_multi(filepath, [(algorithm, hash_size), *extra_specs], reduced_decode, thumbnail_size, budget, timer)
+        prefilter_bytes = None if prefilter_hash is None else hash_to_bytes(prefilter_hash)
+        if hashes is None:
+            results.append((None, thumbnail, prefilter_bytes, None, problem, timer.times, None))
+        else:
+            hash_bytes = [hash_to_bytes(image_hash) for image_hash in hashes]
+            results.append((hash_bytes[0], thumbnail, prefilter_bytes, hash_bytes[1:], problem, timer.times, sequence))
+    return results
+
+# Number of workers used when the worker count is "auto"
+def default_worker_count():
+    if hasattr(os, "sched_getaffinity"):
+        return max(1, len(os.sched_getaffinity(0)))
+    return os.cpu_count() or 1
+
+# Worker processes are handed budget (a DecodeBudget made with shared) as they start; threads share the
+# caller's memory, so they are given it with each chunk instead (see compute_hash_chunk())
+def create_hash_executor(backend, num_workers, budget=None):
+    if backend == "thread":
+        return ThreadPoolExecutor(max_workers=num_workers)
+    if backend == "process":
+        if budget is None:
+            return ProcessPoolExecutor(max_workers=num_workers)
+        return ProcessPoolExecutor(max_workers=num_workers, initializer=_set_worker_budget, initargs=(budget,))
+    raise ValueError(f"Unknown hashing backend: {backend}")
+
+# Hashes files in parallel, yielding (filepath, ImageHash or None) in input order.
+# The "thread" backend suits I/O-bound network mounts; the "process" backend sidesteps the GIL for
+# CPU-bound decoding and sends files to workers in chunks so one round-trip covers many files.
+def hash_files_parallel(filepaths, hash_size, backend="thread", num_workers="auto", chunk_size=None, reduced_decode=True, algorithm="phash"):
+    if num_workers == "auto" or not num_workers:
+        num_workers = default_worker_count()
+    if backend == "thread":
+        with create_hash_executor(backend, num_workers) as executor:
+            yield from zip(filepaths, executor.map(partial(compute_hash, hash_size=hash_size, reduced_decode=reduced_decode, algorithm=algorithm), filepaths))
+    else:
+        if chunk_size is None:
+            # Aim for a few chunks per worker so slow files still balance out between processes
+            chunk_size = max(1, min(256, len(filepaths) // (num_workers * 4)))
+        with create_hash_executor(backend, num_workers) as executor:
+            results = executor.map(partial(compute_hash_bytes, hash_size=hash_size, reduced_decode=reduced_decode, algorithm=algorithm), filepaths, chunksize=chunk_size)
+            for filepath, hash_bytes in zip(filepaths, results):
+                yield filepath, None if hash_bytes is None else hash_from_bytes(hash_bytes, hash_size, algorithm)
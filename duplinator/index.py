@@ -0,0 +1,320 @@
+import functools
+import itertools
+import threading
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from .hashing import default_worker_count, hash_bits
+from .matching import OFFSET_LOOKUP_COST, OFFSET_WIDTH, BandTable, block_distances, lookup_bands, popcount64
+from .store import FileStats, PathTable, read_store, write_store
+
+
+# In-memory index of a finished scan: the packed hash of every hashed file and every pair matched so far,
+# sorted by distance. Asking for pairs at a threshold that has already been matched, or for fewer file types,
+# only slices and filters that table, so it takes milliseconds whatever the folder size. A higher threshold
+# needs the pairs between it and the highest one matched so far to be found (see extend()), after which it is
+# just as quick.
+# Files are identified by their position in the scan's walk order; rows are positions in the packed matrix.
+# Everything is kept in flat arrays indexed by those numbers (paths in a store.PathTable, stats in a
+# store.FileStats), a few dozen bytes a file plus its path. save() writes the index to a single file and
+# HashIndex.open() memory-maps it back, so a large index opens instantly and only pages in what is used.
+# Deleted files are dropped with remove(). Their hashes stay in the packed matrix, since an identical copy
+# found by exact matching may still be using them, but they no longer appear in any pair.
+# Methods can be called from any thread. Only one extend() runs at a time, but pairs() for a threshold that
+# has already been matched doesn't wait for it.
+class HashIndex:
+    BLOCK_SIZE = 2048
+
+    # files is a PathTable (or a list of paths), row_file_ids the file id of each row of packed, members the
+    # exact copies found before hashing (first copy's id -> the ids of every copy, first one included) and
+    # pair_rows (rows i, rows j, distances) every pair of rows within threshold. info is saved with the index,
+    # e.g. the algorithm and hash size the hashes were made with. sequence_rows, a boolean array, marks the rows
+    # of files that were matched on their frame sequences (see frames.py); pairs of two such files are only ever
+    # the ones in pair_rows, never matched again on their single hashes.
+    def __init__(self, files, row_file_ids, packed, members, threshold, pair_rows, stats=None, info=None, sequence_rows=None):
+        if not isinstance(files, PathTable):
+            table = PathTable()
+            for filepath in files:
+                table.append(filepath)
+            files = table
+        rows_i, rows_j, distances = (np.asarray(column, dtype=np.int64) for column in pair_rows)
+        order = np.argsort(distances, kind="stable")
+        self._setup(files, np.asarray(row_file_ids, dtype=np.int64), packed, members, threshold, rows_i[order], rows_j[order], distances[order],
+                    np.ones(len(files), dtype=bool), stats if stats is not None else FileStats(), info, sequence_rows=sequence_rows)
+
+    def _setup(self, files, row_file_ids, packed, members, max_distance, pair_i, pair_j, pair_distances, alive, stats, info, file_rows=None, sequence_rows=None):
+        self.files = files
+        self.row_file_ids = row_file_ids
+        if file_rows is None:
+            file_rows = np.full(len(files), -1, dtype=np.int64)
+            file_rows[row_file_ids] = np.arange(len(row_file_ids))
+        self.file_rows = file_rows
+        self.packed = packed
+        self.members = members
+        self.copy_of = {copy_id: member_ids[0] for member_ids in members.values() for copy_id in member_ids[1:]}
+        # Every pair of rows within max_distance of each other, sorted by distance
+        self.max_distance = max_distance
+        self.pair_i, self.pair_j, self.pair_distances = pair_i, pair_j, pair_distances
+        self.alive = alive
+        self.sequence_rows = sequence_rows
+        self.stats = stats
+        self.info = dict(info or {})
+        self.lock = threading.Lock()
+        self.extend_lock = threading.Lock()
+        self.allowed_cache = {}
+
+    # Writes the index to path (see store.write_store), replacing any file already there
+    def save(self, path):
+        write_store(path, *self.to_store())
+
+    # The info and arrays save() writes
+    def to_store(self):
+        with self.lock:
+            pair_i, pair_j, pair_distances, alive, max_distance = self.pair_i, self.pair_j, self.pair_distances, self.alive, self.max_distance
+        member_ids = [member_id for file_id in sorted(self.members) for member_id in self.members[file_id]]
+        member_counts = [len(self.members[file_id]) for file_id in sorted(self.members)]
+        arrays = {
+            **self.files.to_arrays(),
+            **self.stats.to_arrays(),
+            "row_file_ids": self.row_file_ids,
+            "file_rows": self.file_rows,
+            "packed": self.packed,
+            "pair_i": pair_i,
+            "pair_j": pair_j,
+            "pair_distances": pair_distances,
+            "alive": alive,
+            "member_ids": np.array(member_ids, dtype=np.int64),
+            "member_counts": np.array(member_counts, dtype=np.int64),
+        }
+        if self.sequence_rows is not None:
+            arrays["sequence_rows"] = self.sequence_rows
+        return {**self.info, "max_distance": int(max_distance)}, arrays
+
+    # Opens an index written by save(). With mmap (the default) its arrays are memory-mapped read-only rather
+    # than read into memory; the index can still be extended and have files removed, which only copies the
+    # small arrays those change. Raises ValueError if path isn't a saved index.
+    @classmethod
+    def open(cls, path, mmap=True):
+        return cls.from_store(*read_store(path, mmap))
+
+    # The index held by info and arrays as read from a store; arrays the index doesn't use are ignored
+    @classmethod
+    def from_store(cls, info, arrays):
+        info = dict(info)
+        members = {}
+        member_ids = arrays["member_ids"].tolist()
+        position = 0
+        for count in arrays["member_counts"].tolist():
+            members[member_ids[position]] = member_ids[position:position + count]
+            position += count
+        index = cls.__new__(cls)
+        max_distance = info.pop("max_distance")
+        index._setup(PathTable.from_arrays(arrays), arrays["row_file_ids"], arrays["packed"], members, max_distance, arrays["pair_i"], arrays["pair_j"], arrays["pair_distances"],
+                     np.array(arrays["alive"]), FileStats.from_arrays(arrays), info, arrays["file_rows"], arrays.get("sequence_rows"))
+        return index
+
+    def __len__(self):
+        return len(self.files)
+
+    # The packed hash of an indexed file (a row of packed), or None if it wasn't hashed
+    def hash_of(self, filepath):
+        file_id = self.files.id_of(filepath)
+        if file_id is None:
+            return None
+        row = self.file_rows[self.copy_of.get(file_id, file_id)]
+        return None if row < 0 else self.packed[row]
+
+    # Number of bits each hash takes up in a row: those of the algorithm and hash size in info rounded up to whole
+    # bytes, or else every bit of a row
+    def num_bits(self):
+        if "algorithm" in self.info:
+            return (hash_bits(self.info["algorithm"], self.info["hash_size"]) + 7) // 8 * 8
+        return self.packed.shape[1] * 64
+
+    # Hash distance between two indexed files, or None if either of them wasn't hashed
+    def hash_distance(self, filepath1, filepath2):
+        hash1, hash2 = self.hash_of(filepath1), self.hash_of(filepath2)
+        if hash1 is None or hash2 is None:
+            return None
+        return int(popcount64(hash1 ^ hash2).sum())
+
+    # Drops files (e.g. after deleting them) from every later query; paths that aren't indexed are ignored
+    def remove(self, filepaths):
+        file_ids = [file_id for file_id in map(self.files.id_of, filepaths) if file_id is not None]
+        with self.lock:
+            alive = self.alive.copy()
+            alive[file_ids] = False
+            self.alive = alive
+
+    # Finds every pair of rows at distances above max_distance up to threshold, a block of rows per task so
+    # NumPy can spread the work over every core. Each row is looked up in a multi-index table of every row (see
+    # matching.BandTable), which only compares it with the few rows that can be that close, unless the threshold
+    # is so high that comparing it with every row is quicker. With max_pairs, the highest distance kept is
+    # lowered as needed to keep the table within that many pairs. Returns the new max_distance, which is
+    # unchanged if cancel_event is set before the pass finishes.
+    def extend(self, threshold, max_pairs=None, cancel_event=None):
+        with self.extend_lock:
+            low = self.max_distance
+            if threshold <= low:
+                return low
+            bands = self.lookup_bands(threshold)
+            if bands is not None:
+                match_block = functools.partial(self._lookup_block, BandTable.build(self.packed, bands))
+            else:
+                match_block = self._match_block
+            cap = threshold
+            found_i, found_j, found_distances = [], [], []
+            count = 0
+            starts = range(0, len(self.packed), self.BLOCK_SIZE)
+            num_workers = default_worker_count()
+            with ThreadPoolExecutor(max_workers=num_workers) as executor:
+                # Keeps only a few blocks in flight so memory doesn't grow with the folder size
+                pending = [executor.submit(match_block, start, low, threshold, cancel_event) for start in starts[:2 * num_workers]]
+                next_start = 2 * num_workers
+                while pending:
+                    if cancel_event is not None and cancel_event.is_set():
+                        for future in pending:
+                            future.cancel()
+                        return self.max_distance
+                    block_i, block_j, distances = pending.pop(0).result()
+                    if next_start < len(starts):
+                        pending.append(executor.submit(match_block, starts[next_start], low, threshold, cancel_event))
+                        next_start += 1
+                    keep = distances <= cap
+                    found_i.append(block_i[keep])
+                    found_j.append(block_j[keep])
+                    found_distances.append(distances[keep])
+                    count += int(keep.sum())
+                    if max_pairs is not None and len(self.pair_i) + count > max_pairs:
+                        cap, count = self._lower_cap(found_distances, low, cap, max_pairs - len(self.pair_i))
+                        kept = [distances <= cap for distances in found_distances]
+                        found_i = [rows[mask] for rows, mask in zip(found_i, kept)]
+                        found_j = [rows[mask] for rows, mask in zip(found_j, kept)]
+                        found_distances = [distances[mask] for distances, mask in zip(found_distances, kept)]
+            if cancel_event is not None and cancel_event.is_set():
+                return self.max_distance
+            if found_i:
+                rows_i, rows_j, distances = np.concatenate(found_i), np.concatenate(found_j), np.concatenate(found_distances)
+                order = np.argsort(distances, kind="stable")
+                pair_i = np.concatenate((self.pair_i, rows_i[order]))
+                pair_j = np.concatenate((self.pair_j, rows_j[order]))
+                pair_distances = np.concatenate((self.pair_distances, distances[order]))
+            else:
+                pair_i, pair_j, pair_distances = self.pair_i, self.pair_j, self.pair_distances
+            with self.lock:
+                self.pair_i, self.pair_j, self.pair_distances = pair_i, pair_j, pair_distances
+                self.max_distance = cap
+            return cap
+
+    # Bands of the lookup table extend() would match up to threshold with (see matching.lookup_bands), or None
+    # if it would compare every row with every other, which takes much longer on a large index
+    def lookup_bands(self, threshold):
+        return lookup_bands(self.num_bits(), threshold, len(self.packed), OFFSET_LOOKUP_COST, OFFSET_WIDTH)
+
+    # The pairs at distances above low up to high that the block of rows at row_start finds in table (see
+    # BandTable.pairs()); a pair close in several bands is found once for each, so the few matches are deduplicated
+    def _lookup_block(self, table, row_start, low, high, cancel_event=None):
+        rows_i, rows_j = table.pairs(row_start, self.packed[row_start:row_start + self.BLOCK_SIZE], high)
+        distances = popcount64(self.packed[rows_i] ^ self.packed[rows_j]).sum(axis=1, dtype=np.int64)
+        keep = (distances > low) & (distances <= high)
+        if self.sequence_rows is not None:
+            keep &= ~(self.sequence_rows[rows_i] & self.sequence_rows[rows_j])
+        rows_i, rows_j, distances = rows_i[keep], rows_j[keep], distances[keep]
+        unique = np.unique(rows_i * len(self.packed) + rows_j, return_index=True)[1]
+        return rows_i[unique], rows_j[unique], distances[unique]
+
+    def _match_block(self, row_start, low, high, cancel_event=None):
+        rows = self.packed[row_start:row_start + self.BLOCK_SIZE]
+        found_i, found_j, found_distances = [np.zeros(0, dtype=np.int64)], [np.zeros(0, dtype=np.int64)], [np.zeros(0, dtype=np.int64)]
+        for col_start in range(row_start, len(self.packed), self.BLOCK_SIZE):
+            if cancel_event is not None and cancel_event.is_set():
+                break
+            distances = block_distances(rows, self.packed[col_start:col_start + self.BLOCK_SIZE])
+            mask = (distances > low) & (distances <= high)
+            if self.sequence_rows is not None:
+                mask &= ~(self.sequence_rows[row_start:row_start + len(rows), None] & self.sequence_rows[None, col_start:col_start + self.BLOCK_SIZE])
+            if col_start == row_start:
+                mask &= np.triu(np.ones(mask.shape, dtype=bool), k=1)
+            block_i, block_j = np.nonzero(mask)
+            found_i.append(block_i + row_start)
+            found_j.append(block_j + col_start)
+            found_distances.append(distances[block_i, block_j].astype(np.int64))
+        return np.concatenate(found_i), np.concatenate(found_j), np.concatenate(found_distances)
+
+    # Largest cap (at least low) whose pairs found so far fit in budget, and how many pairs that keeps
+    @staticmethod
+    def _lower_cap(found_distances, low, cap, budget):
+        counts = np.bincount(np.concatenate(found_distances), minlength=cap + 1)
+        kept = int(counts[:cap + 1].sum())
+        while cap > low and kept > budget:
+            kept -= int(counts[cap])
+            cap -= 1
+        return cap, kept
+
+    # Boolean array saying which files haven't been removed and have one of the given extensions (any for None)
+    def _allowed(self, included_extensions):
+        if included_extensions is None:
+            return self.alive
+        key = tuple(sorted(ext.lower() for ext in included_extensions))
+        if key not in self.allowed_cache:
+            self.allowed_cache[key] = self.files.endswith(key)
+        return self.allowed_cache[key] & self.alive
+
+    # The copies of a file that are allowed, the file itself first
+    def _members(self, file_id, allowed):
+        member_ids = self.members.get(file_id, (file_id,))
+        return [member_id for member_id in member_ids if allowed[member_id]]
+
+    # Returns (filepath1, filepath2, distance) for every pair within threshold whose files both have one of
+    # included_extensions, ordered by walk position as find_duplicate_images returns them. Copies found by
+    # exact matching are expanded as DuplicateScanner does, see its expand_copies. A pair is only reported once,
+    # at its lowest distance, even if it was matched both on its files' frame sequences and on their single hashes.
+    # If cancel_event is set while a higher threshold is being matched, only pairs already matched are returned.
+    def pairs(self, threshold, included_extensions=None, expand_copies=True, cancel_event=None):
+        if threshold > self.max_distance:
+            self.extend(threshold, cancel_event=cancel_event)
+        with self.lock:
+            end = np.searchsorted(self.pair_distances, threshold, side="right")
+            file_i = self.row_file_ids[self.pair_i[:end]]
+            file_j = self.row_file_ids[self.pair_j[:end]]
+            distances = self.pair_distances[:end]
+            allowed = self._allowed(included_extensions)
+            firsts, seconds, found_distances = array("q"), array("q"), array("q")
+            # Pairs between files without copies are filtered in bulk; the few involving copies are expanded one by one
+            if self.members:
+                has_copies = np.zeros(len(self.files), dtype=bool)
+                has_copies[list(self.members)] = True
+                plain = ~(has_copies[file_i] | has_copies[file_j])
+            else:
+                plain = np.ones(len(distances), dtype=bool)
+            plain_keep = plain & allowed[file_i] & allowed[file_j]
+            first_ids = np.minimum(file_i[plain_keep], file_j[plain_keep])
+            second_ids = np.maximum(file_i[plain_keep], file_j[plain_keep])
+            plain_distances = distances[plain_keep]
+            for id1, id2, distance in zip(file_i[~plain].tolist(), file_j[~plain].tolist(), distances[~plain].tolist()):
+                members1, members2 = self._members(id1, allowed), self._members(id2, allowed)
+                expanded = itertools.product(members1, members2) if expand_copies else zip(members1[:1], members2[:1])
+                for member1, member2 in expanded:
+                    firsts.append(min(member1, member2))
+                    seconds.append(max(member1, member2))
+                    found_distances.append(distance)
+            for file_id in self.members:
+                member_ids = self._members(file_id, allowed)
+                copy_pairs = itertools.combinations(member_ids, 2) if expand_copies else ((member_ids[0], copy_id) for copy_id in member_ids[1:])
+                for id1, id2 in copy_pairs:
+                    firsts.append(id1)
+                    seconds.append(id2)
+                    found_distances.append(0)
+            first_ids = np.concatenate((first_ids, np.frombuffer(firsts, dtype=np.int64)))
+            second_ids = np.concatenate((second_ids, np.frombuffer(seconds, dtype=np.int64)))
+            all_distances = np.concatenate((plain_distances, np.frombuffer(found_distances, dtype=np.int64)))
+        order = np.lexsort((all_distances, second_ids, first_ids))
+        first_ids, second_ids, all_distances = first_ids[order], second_ids[order], all_distances[order]
+        # A merge of shard indexes (see shards.merge_indexes()) can match files again on their single hashes
+        # that a shard matched on their frame sequences; only the closer of the two is kept
+        keep = np.ones(len(first_ids), dtype=bool)
+        keep[1:] = (first_ids[1:] != first_ids[:-1]) | (second_ids[1:] != second_ids[:-1])
+        files = self.files
+        return [(files[id1], files[id2], distance) for id1, id2, distance in zip(first_ids[keep].tolist(), second_ids[keep].tolist(), all_distances[keep].tolist())]
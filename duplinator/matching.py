@@ -0,0 +1,364 @@
+import itertools
+import math
+from collections import namedtuple
+
+import numpy as np
+
+
+# Converts packed hash bytes into a plain int so two hashes can be compared with a single XOR and popcount
+def hash_bytes_to_int(hash_bytes, num_bits):
+    return int.from_bytes(hash_bytes, "big") >> (len(hash_bytes) * 8 - num_bits)
+
+# Near-neighbour index for Hamming distance using multi-index hashing.
+# By the pigeonhole principle, two hashes that differ in at most `threshold` bits must agree exactly
+# on at least one of `threshold + 1` disjoint bands, so each band gets its own lookup table and only
+# hashes sharing a band value are ever compared. Results are identical to comparing every pair.
+class HammingIndex:
+    def __init__(self, num_bits, threshold):
+        self.num_bits = num_bits
+        self.threshold = threshold
+        self.hashes = []
+        self.bands = []
+        self.tables = []
+        # With a threshold of num_bits or more every pair matches, so there is nothing to index
+        if threshold < num_bits:
+            num_bands = threshold + 1
+            base, extra = divmod(num_bits, num_bands)
+            shift = 0
+            for band in range(num_bands):
+                width = base + (1 if band < extra else 0)
+                self.bands.append((shift, (1 << width) - 1))
+                self.tables.append({})
+                shift += width
+
+    def add(self, hash_value):
+        hash_id = len(self.hashes)
+        self.hashes.append(hash_value)
+        for (shift, mask), table in zip(self.bands, self.tables):
+            table.setdefault((hash_value >> shift) & mask, []).append(hash_id)
+        return hash_id
+
+    # Returns the ids of every indexed hash that differs from hash_value in at most `threshold` bits
+    def candidates(self, hash_value):
+        if not self.bands:
+            return range(len(self.hashes))
+        found = set()
+        for (shift, mask), table in zip(self.bands, self.tables):
+            found.update(table.get((hash_value >> shift) & mask, ()))
+        return found
+
+    def query(self, hash_value):
+        matches = []
+        for hash_id in self.candidates(hash_value):
+            distance = (hash_value ^ self.hashes[hash_id]).bit_count()
+            if distance <= self.threshold:
+                matches.append((hash_id, distance))
+        matches.sort()
+        return matches
+
+    # Yields (i, j, distance) with i < j for every pair within the threshold, in the same order as a nested i/j loop
+    def find_pairs(self):
+        for i, hash_value in enumerate(self.hashes):
+            for j, distance in self.query(hash_value):
+                if j > i:
+                    yield i, j, distance
+
+# Packs hash bytes (see hash_to_bytes) into a contiguous (n, words) uint64 matrix, one row per image
+def pack_hashes(hash_bytes_list, num_bits):
+    num_words = max(1, (num_bits + 63) // 64)
+    row_length = num_words * 8
+    packed = b"".join(hash_bytes.ljust(row_length, b"\0") for hash_bytes in hash_bytes_list)
+    return np.frombuffer(packed, dtype=np.uint64).reshape(len(hash_bytes_list), num_words).copy()
+
+# Counts the set bits of every element of a uint64 array (np.bitwise_count needs NumPy 2.0)
+if hasattr(np, "bitwise_count"):
+    def popcount64(array):
+        return np.bitwise_count(array)
+else:
+    _POPCOUNT_TABLE = np.array([bin(value).count("1") for value in range(256)], dtype=np.uint8)
+
+    def popcount64(array):
+        byte_counts = _POPCOUNT_TABLE[array.view(np.uint8)]
+        return byte_counts.reshape(array.shape + (8,)).sum(axis=-1, dtype=np.uint8)
+
+# Hamming distances between every row of `rows` and every row of `cols`, as a (len(rows), len(cols)) matrix
+def block_distances(rows, cols):
+    distances = np.zeros((len(rows), len(cols)), dtype=np.uint16)
+    for word in range(rows.shape[1]):
+        distances += popcount64(rows[:, word, None] ^ cols[None, :, word])
+    return distances
+
+# Brute-force Hamming matcher over a packed hash matrix using XOR and popcount.
+# Works through block_size x block_size tiles of the upper triangle so peak memory stays at roughly
+# block_size * block_size * 10 bytes however many images there are.
+# Yields (i, j, distance) with i < j in the same order as a nested i/j loop.
+def packed_hamming_pairs(packed, threshold, block_size=1024):
+    num_hashes = len(packed)
+    for row_start in range(0, num_hashes, block_size):
+        rows = packed[row_start:row_start + block_size]
+        found_i, found_j, found_distance = [], [], []
+        for col_start in range(row_start, num_hashes, block_size):
+            cols = packed[col_start:col_start + block_size]
+            distances = block_distances(rows, cols)
+            mask = distances <= threshold
+            if col_start == row_start:
+                mask &= np.triu(np.ones(mask.shape, dtype=bool), k=1)
+            block_i, block_j = np.nonzero(mask)
+            found_i.append(block_i + row_start)
+            found_j.append(block_j + col_start)
+            found_distance.append(distances[block_i, block_j])
+        found_i = np.concatenate(found_i)
+        found_j = np.concatenate(found_j)
+        found_distance = np.concatenate(found_distance)
+        order = np.lexsort((found_j, found_i))
+        for k in order:
+            yield int(found_i[k]), int(found_j[k]), int(found_distance[k])
+
+# Picks a matcher for the compare phase. The multi-index table only pays off while its bands are wide
+# enough to keep buckets sparse; once the threshold leaves just a few bits per band nearly every hash
+# becomes a candidate and the vectorised brute-force pass is much faster.
+def choose_match_engine(num_bits, threshold):
+    if threshold >= num_bits:
+        return "bruteforce"
+    band_width = num_bits // (threshold + 1)
+    num_words = max(1, (num_bits + 63) // 64)
+    # Fraction of hashes expected to share at least one band with any given hash, for evenly spread bits
+    candidate_fraction = (threshold + 1) / (2 ** band_width)
+    # Checking a candidate in Python costs roughly as much as ~50 vectorised word comparisons
+    return "bruteforce" if candidate_fraction * 50 > num_words else "index"
+
+# How a scan matches its hashes: engine and block_size are passed on to StreamingMatcher
+MatchOptions = namedtuple("MatchOptions", ("engine", "block_size"), defaults=("auto", 1024))
+
+# Yields (i, j, distance) for every pair of hashes within the threshold, using the requested engine
+def find_hash_pairs(hash_bytes_list, num_bits, threshold, engine="auto", block_size=1024):
+    if engine == "auto":
+        engine = choose_match_engine(num_bits, threshold)
+    if engine == "bruteforce":
+        yield from packed_hamming_pairs(pack_hashes(hash_bytes_list, num_bits), threshold, block_size)
+    elif engine == "index":
+        index = HammingIndex(num_bits, threshold)
+        for hash_bytes in hash_bytes_list:
+            index.add(hash_bytes_to_int(hash_bytes, num_bits))
+        yield from index.find_pairs()
+    else:
+        raise ValueError(f"Unknown match engine: {engine}")
+
+# Incremental version of find_hash_pairs for hashes that arrive a batch at a time while a scan is running.
+# add() returns (i, j, distance) for every new pair, where j is one of the hashes just added and i < j.
+class StreamingMatcher:
+    def __init__(self, num_bits, threshold, engine="auto", block_size=1024):
+        if engine == "auto":
+            engine = choose_match_engine(num_bits, threshold)
+        if engine not in ("index", "bruteforce"):
+            raise ValueError(f"Unknown match engine: {engine}")
+        self.engine = engine
+        self.num_bits = num_bits
+        self.threshold = threshold
+        self.block_size = block_size
+        self.count = 0
+        if engine == "index":
+            self.index = HammingIndex(num_bits, threshold)
+        else:
+            self.packed = np.zeros((block_size, max(1, (num_bits + 63) // 64)), dtype=np.uint64)
+
+    def add(self, hash_bytes_list):
+        if self.engine == "index":
+            return self._add_to_index(hash_bytes_list)
+        return self._add_to_packed(pack_hashes(hash_bytes_list, self.num_bits))
+
+    def _add_to_index(self, hash_bytes_list):
+        found = []
+        for hash_bytes in hash_bytes_list:
+            hash_value = hash_bytes_to_int(hash_bytes, self.num_bits)
+            for hash_id, distance in self.index.query(hash_value):
+                found.append((hash_id, self.count, distance))
+            self.index.add(hash_value)
+            self.count += 1
+        return found
+
+    def _add_to_packed(self, new_rows):
+        found = []
+        for new_start in range(0, len(new_rows), self.block_size):
+            chunk = new_rows[new_start:new_start + self.block_size]
+            base = self.count
+            if base + len(chunk) > len(self.packed):
+                grown = np.zeros((max(2 * len(self.packed), base + len(chunk)), self.packed.shape[1]), dtype=np.uint64)
+                grown[:base] = self.packed[:base]
+                self.packed = grown
+            self.packed[base:base + len(chunk)] = chunk
+            self.count += len(chunk)
+            # Compare the chunk against everything before it and against itself
+            for col_start in range(0, self.count, self.block_size):
+                cols = self.packed[col_start:min(col_start + self.block_size, self.count)]
+                distances = block_distances(chunk, cols)
+                new_index, old_index = np.nonzero(distances <= self.threshold)
+                old_ids = old_index + col_start
+                new_ids = new_index + base
+                keep = old_ids < new_ids
+                found.extend(zip(old_ids[keep].tolist(), new_ids[keep].tolist(), distances[new_index[keep], old_index[keep]].tolist()))
+        return found
+
+    # Hamming distance between two hashes already added, by the ids add() reports them under
+    def distance(self, i, j):
+        if self.engine == "index":
+            return (self.index.hashes[i] ^ self.index.hashes[j]).bit_count()
+        return int(popcount64(self.packed[i] ^ self.packed[j]).sum())
+
+    # Hash i as a packed row (see pack_hashes)
+    def packed_row(self, i):
+        if self.engine == "bruteforce":
+            return self.packed[i]
+        num_bytes = (self.num_bits + 7) // 8
+        shift = num_bytes * 8 - self.num_bits
+        return pack_hashes([(self.index.hashes[i] << shift).to_bytes(num_bytes, "big")], self.num_bits)[0]
+
+    # Every hash added so far as a packed (count, words) uint64 matrix (see pack_hashes), row i being id i
+    def packed_hashes(self):
+        if self.engine == "bruteforce":
+            return self.packed[:self.count].copy()
+        num_bytes = (self.num_bits + 7) // 8
+        shift = num_bytes * 8 - self.num_bits
+        return pack_hashes([(hash_value << shift).to_bytes(num_bytes, "big") for hash_value in self.index.hashes], self.num_bits)
+
+# Multi-index lookup tables for finding the rows of a packed hash matrix within threshold of other hashes
+# without comparing every row. The hash bits are split into a few disjoint bands and, for each band, every row
+# is listed sorted by its band value. Two hashes within threshold of each other differ by at most
+# threshold // bands bits in at least one band (by the pigeonhole principle), so the candidates for a hash are
+# the rows whose value in some band is within that many bits of the hash's. Results are identical to comparing
+# every row. Unlike HammingIndex's, the bands are made wider the more rows there are, so they stay sparse and
+# the candidates stay few however many rows there are.
+
+# Relative costs of finding a band value's run of rows by binary search and of checking a candidate row,
+# per row per word of comparing a hash against every row in blocks
+LOOKUP_COST = 200
+CANDIDATE_COST = 16
+# Bands up to this many bits wide also get a table of where each value's run starts, which makes finding a run
+# a few times as costly as checking a candidate rather than a dozen
+OFFSET_WIDTH = 20
+OFFSET_LOOKUP_COST = 48
+
+
+# Bit ranges (start, width) of the bands a lookup table for threshold splits num_rows hashes of num_bits into,
+# picking the number of bands the lookup is expected to be quickest with, or None if comparing every row would
+# be quicker. Bands are at most max_width bits wide (32 at most, so their values fit in a uint32); bits count
+# from the first byte of the packed row, lowest bit first.
+def lookup_bands(num_bits, threshold, num_rows, lookup_cost=LOOKUP_COST, max_width=32):
+    best, best_cost = None, num_rows * -(-num_bits // 64)
+    fewest = -(-num_bits // max_width)
+    for num_bands in range(fewest, max(threshold + 1, fewest) + 1):
+        width = num_bits // num_bands
+        # Band values within this many bits are looked up
+        values = sum(math.comb(width + 1, bits) for bits in range(threshold // num_bands + 1))
+        cost = num_bands * values * (lookup_cost + CANDIDATE_COST * num_rows / 2 ** width)
+        if cost < best_cost:
+            best, best_cost = num_bands, cost
+    if best is None:
+        return None
+    base, extra = divmod(num_bits, best)
+    bands = []
+    start = 0
+    for band in range(best):
+        width = base + (1 if band < extra else 0)
+        bands.append((start, width))
+        start += width
+    return bands
+
+# The value of a band in every row of a packed (n, words) hash matrix, as uint32s
+def band_values(packed, start, width):
+    word, offset = divmod(start, 64)
+    values = packed[:, word] >> np.uint64(offset)
+    if offset + width > 64:
+        values = values | (packed[:, word + 1] << np.uint64(64 - offset))
+    return (values & np.uint64((1 << width) - 1)).astype(np.uint32)
+
+# Every value within radius bits of 0 in a band of width bits, which XORed with a band value gives the values
+# within radius bits of it
+def flip_masks(width, radius):
+    masks = [0]
+    for bits in range(1, radius + 1):
+        masks.extend(sum(1 << bit for bit in flipped) for flipped in itertools.combinations(range(width), bits))
+    return np.array(masks, dtype=np.uint32)
+
+# A lookup table over the rows of a packed hash matrix for the given bands (see lookup_bands). keys holds each
+# band's values in sorted order and rows the rows in that order, one line per band; they can be memory-mapped.
+# offsets, for each band, is None or where each value's run starts in keys, and is only built in memory.
+class BandTable:
+    def __init__(self, bands, keys, rows, offsets=None):
+        self.bands = bands
+        self.keys = keys
+        self.rows = rows
+        self.offsets = offsets if offsets is not None else [None] * len(bands)
+
+    @classmethod
+    def build(cls, packed, bands):
+        row_dtype = np.uint32 if len(packed) < 2 ** 32 else np.int64
+        keys = np.zeros((len(bands), len(packed)), dtype=np.uint32)
+        rows = np.zeros((len(bands), len(packed)), dtype=row_dtype)
+        offsets = []
+        for band, (start, width) in enumerate(bands):
+            values = band_values(packed, start, width)
+            order = np.argsort(values, kind="stable")
+            keys[band] = values[order]
+            rows[band] = order
+            if width <= OFFSET_WIDTH:
+                band_offsets = np.zeros(2 ** width + 1, dtype=np.int64)
+                np.cumsum(np.bincount(values, minlength=2 ** width), out=band_offsets[1:])
+                offsets.append(band_offsets)
+            else:
+                offsets.append(None)
+        return cls(bands, keys, rows, offsets)
+
+    # (positions in batch, rows) of the rows whose values in some band are within threshold // bands bits of
+    # those of the rows of batch, a packed hash matrix; a pair close in several bands is listed for each
+    def candidates(self, batch, threshold):
+        found_positions, found_rows = [np.zeros(0, dtype=np.int64)], [np.zeros(0, dtype=np.int64)]
+        radius = threshold // len(self.bands)
+        for band, (start, width) in enumerate(self.bands):
+            masks = flip_masks(width, radius)
+            values = (band_values(batch, start, width)[:, None] ^ masks[None, :]).ravel()
+            found, rows = self._lookup(band, values)
+            found_positions.append(found // len(masks))
+            found_rows.append(rows)
+        return np.concatenate(found_positions), np.concatenate(found_rows)
+
+    # (rows i, rows j) with i < j of the pairs of rows close in some band, as for candidates(), between the rows
+    # of the table's own hash matrix from batch_start on, batch, and every row. Two rows close in a band are
+    # only listed once there, where candidates() would find each from the other; a pair close in several bands
+    # is still listed for each.
+    def pairs(self, batch_start, batch, threshold):
+        found_i, found_j = [np.zeros(0, dtype=np.int64)], [np.zeros(0, dtype=np.int64)]
+        radius = threshold // len(self.bands)
+        for band, (start, width) in enumerate(self.bands):
+            own = band_values(batch, start, width)
+            # Rows with the same value are listed by the first of them
+            found, rows = self._lookup(band, own)
+            rows_i = found + batch_start
+            later = rows > rows_i
+            found_i.append(rows_i[later])
+            found_j.append(rows[later])
+            # Rows whose values differ are listed by the one with the lower value
+            if radius:
+                values = own[:, None] ^ flip_masks(width, radius)[None, 1:]
+                higher = values > own[:, None]
+                found, rows = self._lookup(band, values[higher])
+                rows_i = np.nonzero(higher)[0][found] + batch_start
+                found_i.append(np.minimum(rows_i, rows))
+                found_j.append(np.maximum(rows_i, rows))
+        return np.concatenate(found_i), np.concatenate(found_j)
+
+    # (positions in values, rows) of every row whose value in band is one of values
+    def _lookup(self, band, values):
+        offsets = self.offsets[band]
+        if offsets is not None:
+            lows = offsets[values]
+            counts = offsets[values + 1] - lows
+        else:
+            sorted_keys = self.keys[band]
+            lows = np.searchsorted(sorted_keys, values, side="left")
+            counts = np.searchsorted(sorted_keys, values, side="right") - lows
+        total = int(counts.sum())
+        # Each value's run of rows in the band's sorted order, laid end to end
+        run_starts = np.repeat(lows - (np.cumsum(counts) - counts), counts)
+        rows = np.asarray(self.rows[band])[run_starts + np.arange(total)].astype(np.int64)
+        return np.repeat(np.arange(len(values)), counts), rows
@@ -0,0 +1,125 @@
+import numpy as np
+
+from .index import HashIndex
+from .matching import BandTable, block_distances, lookup_bands, popcount64
+from .store import read_store, write_store
+
+# Raised by ReferenceIndex.open() for a saved lookup table made for a lower threshold than the one asked for;
+# building a new one reads every hash of the reference, so it is only done when asked for
+class TableThresholdTooLow(ValueError):
+    pass
+
+
+# Matching a folder against a saved index of a reference collection (an archive, say) without hashing or
+# loading the collection: only the folder is hashed, and each of its hashes is looked up in the reference.
+# The reference's hashes get a multi-index lookup table (see matching.BandTable) whose bands are made wider
+# the more rows there are, which keeps the candidates for a hash to a handful however large the reference
+# grows; with the index memory-mapped a lookup reads just the pages it searches and the candidates' hashes,
+# so a query's cost follows the size of the folder rather than of the reference.
+
+# A read-only HashIndex of a reference collection with a lookup table for matching other hashes against it at
+# thresholds up to threshold. save() writes the table into the index file, which stays an ordinary saved
+# HashIndex as well; open() memory-maps it, building the table in memory if the file has none. Files removed
+# from the index are never matched.
+class ReferenceIndex:
+    # Candidate rows are gathered for this many hashes at a time, which bounds the memory a batch of very
+    # common hashes can take
+    QUERY_BATCH_SIZE = 256
+
+    # index is the reference's HashIndex. tables are the (bands, band keys, band rows) a saved lookup table
+    # was read back as; without them the table is built. table is the lookup table, a matching.BandTable, or
+    # None where comparing every row is quicker.
+    def __init__(self, index, threshold, tables=None):
+        self.index = index
+        self.threshold = threshold
+        if tables is None:
+            bands = lookup_bands(index.num_bits(), threshold, len(index.packed))
+            self.table = BandTable.build(index.packed, bands) if bands is not None else None
+        else:
+            bands, keys, rows = tables
+            self.table = BandTable(bands, keys, rows) if bands is not None else None
+
+    def __len__(self):
+        return len(self.index)
+
+    # Writes the index and its lookup table to path, replacing any file already there
+    def save(self, path):
+        info, arrays = self.index.to_store()
+        info["reference_threshold"] = self.threshold
+        info["reference_bands"] = self.table.bands if self.table is not None else None
+        if self.table is not None:
+            arrays.update(band_keys=self.table.keys, band_rows=self.table.rows)
+        write_store(path, info, arrays)
+
+    # Opens a saved HashIndex as a reference for matching at thresholds up to threshold (by default the one
+    # its lookup table was saved for, or else the threshold it was scanned with). The table is memory-mapped
+    # with the index if the file has one for a threshold at least that high, and built if it has none. A table
+    # for a lower threshold raises TableThresholdTooLow unless rebuild is set, in which case it is built anew.
+    # Raises ValueError if path isn't a saved index.
+    @classmethod
+    def open(cls, path, threshold=None, mmap=True, rebuild=False):
+        info, arrays = read_store(path, mmap)
+        index = HashIndex.from_store(info, arrays)
+        saved_threshold = index.info.pop("reference_threshold", None)
+        bands = index.info.pop("reference_bands", None)
+        if threshold is None:
+            threshold = saved_threshold if saved_threshold is not None else index.max_distance
+        # A table for a higher threshold finds every match at a lower one too
+        if saved_threshold is not None and saved_threshold >= threshold:
+            bands = [tuple(band) for band in bands] if bands is not None else None
+            return cls(index, saved_threshold, (bands, arrays.get("band_keys"), arrays.get("band_rows")))
+        if saved_threshold is not None and not rebuild:
+            raise TableThresholdTooLow(f"The lookup table saved with {path} only goes up to threshold {saved_threshold}")
+        return cls(index, threshold)
+
+    # Every match of the rows of a packed (n, words) hash matrix within threshold (at most self.threshold),
+    # as (positions in packed, reference rows, distances) arrays
+    def match(self, packed, threshold=None):
+        threshold = self.threshold if threshold is None else threshold
+        if threshold > self.threshold:
+            raise ValueError(f"Reference lookup only goes up to threshold {self.threshold}")
+        found = [(np.zeros(0, dtype=np.int64),) * 3]
+        for batch_start in range(0, len(packed), self.QUERY_BATCH_SIZE):
+            batch = packed[batch_start:batch_start + self.QUERY_BATCH_SIZE]
+            if self.table is None:
+                positions, rows, distances = self._match_all(batch, threshold)
+            else:
+                positions, rows = self.table.candidates(batch, threshold)
+                distances = popcount64(batch[positions] ^ self.index.packed[rows]).sum(axis=1, dtype=np.int64)
+                keep = distances <= threshold
+                # A pair close in several bands is found once for each; only the few matches need sorting out
+                positions, rows, distances = positions[keep], rows[keep], distances[keep]
+                unique = np.unique(positions * len(self.index.packed) + rows, return_index=True)[1]
+                positions, rows, distances = positions[unique], rows[unique], distances[unique]
+            found.append((positions + batch_start, rows, distances))
+        return tuple(np.concatenate(column) for column in zip(*found))
+
+    def _match_all(self, batch, threshold):
+        found_positions, found_rows, found_distances = [np.zeros(0, dtype=np.int64)], [np.zeros(0, dtype=np.int64)], [np.zeros(0, dtype=np.int64)]
+        for col_start in range(0, len(self.index.packed), HashIndex.BLOCK_SIZE):
+            distances = block_distances(batch, self.index.packed[col_start:col_start + HashIndex.BLOCK_SIZE])
+            positions, rows = np.nonzero(distances <= threshold)
+            found_positions.append(positions)
+            found_rows.append(rows + col_start)
+            found_distances.append(distances[positions, rows].astype(np.int64))
+        return np.concatenate(found_positions), np.concatenate(found_rows), np.concatenate(found_distances)
+
+    # The reference files a reference row stands for that can be reported: not removed and with one of
+    # included_extensions (any for None). With expand_copies every identical copy found by exact matching,
+    # otherwise just the first of them.
+    def row_files(self, row, included_extensions=None, expand_copies=True):
+        file_id = int(self.index.row_file_ids[row])
+        filepaths = []
+        for member_id in self.index.members.get(file_id, (file_id,)):
+            if not self.index.alive[member_id]:
+                continue
+            filepath = self.index.files[member_id]
+            if included_extensions is None or filepath.lower().endswith(included_extensions):
+                filepaths.append(filepath)
+                if not expand_copies:
+                    break
+        return filepaths
+
+    # The packed hash of a reference file, or None if it isn't in the reference
+    def hash_of(self, filepath):
+        return self.index.hash_of(filepath)
@@ -0,0 +1,670 @@
+import itertools
+import math
+import os
+import queue
+import threading
+import time
+from array import array
+from contextlib import nullcontext
+from concurrent.futures import wait, FIRST_COMPLETED
+from functools import partial
+
+import numpy as np
+
+from .cache import CacheOptions, HashCache
+from .exact import find_exact_duplicates
+from .frames import FRAME_SAMPLING, SequenceMatcher, may_have_frames
+from .grouping import DuplicateGrouper
+from .hashing import DecodeBudget, DecodeOptions, FileProblem, check_hash_algorithm, compute_hash_chunk, create_hash_executor, default_memory_limit, default_worker_count, hash_bits
+from .index import HashIndex
+from .matching import MatchOptions, StreamingMatcher, pack_hashes, popcount64
+from .shards import SHARD_BY, shard_of
+from .stats import WORKER_STAGES, DiagnosticOptions, ScanStats
+from .store import FileStats, PathTable
+from .thumbnails import THUMBNAIL_SIZE, ThumbnailCache
+from .walker import WalkOptions, walk_files
+
+# Cheap hash a cascaded scan finds its candidate pairs with
+CASCADE_PREFILTER = "dhash"
+# How much looser than the scan's threshold the prefilter's is, per 64 bits of hash. The recall target for
+# cascaded scans is 99.5% of the pairs a full scan with the same algorithm finds. On 4,500 near-duplicate
+# pairs (crops, 2 degree rotations, heavy recompression, resizing, brightness, contrast and colour changes,
+# text overlays) of 375 test images, dhash within threshold + 6 kept 99.8% of the pairs phash finds at
+# thresholds up to 12, including the difference between hashing an EXIF thumbnail and the image itself.
+CASCADE_MARGIN = 6
+
+
+# Streaming duplicate scan. The directory walk runs in its own thread and feeds a bounded queue, files are
+# hashed (or served from the hash cache) as they arrive with only a few chunks in flight per worker, and
+# each batch of new hashes is matched straight away against everything hashed so far.
+# scan() is a generator of events:
+#   ("progress", dict) - counters for the GUI/CLI, emitted a few times a second
+#   ("pairs", list)    - newly found (filepath1, filepath2, distance) tuples, filepath1 being found first by the walk
+#   ("problems", list) - hashing.FileProblem for each file that couldn't be hashed ("failed") or was left out ("skipped")
+# cancel() can be called from any thread and makes scan() return within a fraction of a second.
+# With expand_copies=False identical copies found by exact_first are only paired with the file they are a copy
+# of, rather than with every other copy and every match of that file, which is all grouping needs.
+# The walk (see walk, a walker.WalkOptions) stats the files as it goes when the caches or exact_first need them;
+# the stats are kept in self.stats (see file_stat()) so nothing has to stat them again.
+# Files are numbered in walk order and kept compactly: self.files is a store.PathTable, self.stats a
+# store.FileStats, so a scan of millions of files doesn't hold a Python object per file.
+# algorithm is one of hashing.HASH_ALGORITHMS. With cascade, every file first gets a cheap CASCADE_PREFILTER
+# hash, from its EXIF thumbnail where possible so the image isn't decoded at all, and candidate pairs are found
+# with a threshold CASCADE_MARGIN looser than the scan's. Only files in a candidate pair that still lack an
+# algorithm hash are decoded for one, so on folders of mostly unique photos most decoding is skipped. Pairs
+# are then matched on the algorithm hash as usual, so every pair reported is within the threshold; the
+# trade-off is recall (see CASCADE_MARGIN). Files without an algorithm hash are left out of self.index.
+# Tuning the hash size or algorithm with caching.extra_hashes takes one decode of the folder rather than one per
+# setting (in a cascade only files it decodes anyway get them).
+# With shard (a shards.Shard) only the files in that shard are scanned, so several workers sharing the file
+# system can each scan part of a folder and shards.merge_indexes() can combine their saved indexes.
+# With a reference (a reference.ReferenceIndex of an archive, say), every hash is also matched against the
+# reference as it is found, and pairs of a scanned file and a reference file (in that order) are reported too;
+# pairs within the folder only if folder_pairs is set. The reference is only read, never hashed or changed.
+# decode (a hashing.DecodeOptions) says how images are decoded; images skipped as too large for its memory limit
+# are reported as problems.
+# self.scan_stats is a stats.ScanStats of the scan so far, kept as diagnostics (a stats.DiagnosticOptions) says;
+# stages on the hashing workers can't be profiled with the process backend.
+# Videos among included_extensions (see frames.VIDEO_EXTENSIONS, which need PyAV) are hashed from their first
+# sampled frame. With frames (a frames.FrameOptions), animated images and videos also have frames sampled and
+# hashed into a frame sequence in the same workers; pairs of files whose sequences align (see
+# frames.SequenceMatcher) are reported, and two files with sequences are only paired that way, never on their
+# single hashes. Reference indexes only hold single hashes, so sequences are only matched within the folder.
+# caching (a cache.CacheOptions) names the caches hashes are read from and stored in.
+# matching (a matching.MatchOptions) says how new hashes are matched against the ones found before.
+# Once a scan finishes, self.index holds a HashIndex of it, so pairs() can answer for another threshold or
+# fewer file types without walking or hashing anything again.
+class DuplicateScanner:
+    PROGRESS_INTERVAL = 0.2
+    MATCH_BATCH_SIZE = 256
+    CACHE_BATCH_SIZE = 500
+
+    def __init__(self, folder_path, hash_size, threshold, max_depth, included_extensions, multi_thread=False, num_threads=1, matching=MatchOptions(), caching=CacheOptions(), backend="thread", decode=DecodeOptions(), exact_first=False, queue_size=4096, chunk_size=None, expand_copies=True, walk=WalkOptions(), algorithm="phash", cascade=False, shard=None, reference=None, folder_pairs=True, diagnostics=DiagnosticOptions(), frames=None):
+        check_hash_algorithm(algorithm, hash_size)
+        if frames is not None and frames.sampling not in FRAME_SAMPLING:
+            raise ValueError(f"Unknown frame sampling: {frames.sampling}")
+        if diagnostics.profile_stage in WORKER_STAGES and multi_thread and backend == "process":
+            raise ValueError(f"The {diagnostics.profile_stage} stage runs in worker processes and can't be profiled there; use thread workers")
+        if shard is not None and not 0 <= shard.number < shard.count:
+            raise ValueError(f"Invalid shard {shard.number} of {shard.count}")
+        if shard is not None and shard.by not in SHARD_BY:
+            raise ValueError(f"Unknown shard method: {shard.by}")
+        for extra_algorithm, extra_hash_size in caching.extra_hashes:
+            check_hash_algorithm(extra_algorithm, extra_hash_size)
+        if reference is not None:
+            for key, value in (("algorithm", algorithm), ("hash_size", hash_size), ("reduced_decode", decode.reduced)):
+                if reference.index.info.get(key) != value:
+                    raise ValueError(f"The reference index was made with {key} {reference.index.info.get(key)!r}, not {value!r}")
+            if threshold > reference.threshold:
+                raise ValueError(f"The reference index can only be matched up to threshold {reference.threshold}")
+        self.folder_path = folder_path
+        self.hash_size = hash_size
+        self.threshold = threshold
+        self.max_depth = max_depth
+        self.included_extensions = tuple(included_extensions)
+        self.multi_thread = multi_thread
+        self.num_workers = (default_worker_count() if num_threads == "auto" else num_threads) if multi_thread else 1
+        self.matching = matching
+        self.caching = caching
+        self.backend = backend
+        self.decode = decode
+        self.exact_first = exact_first
+        self.queue_size = queue_size
+        self.thumbnail_size = THUMBNAIL_SIZE if caching.thumbnail_path else None
+        self.expand_copies = expand_copies
+        self.walk = walk
+        self.shard = shard
+        self.reference = reference
+        self.folder_pairs = folder_pairs or reference is None
+        self.memory_limit = default_memory_limit() if decode.memory_limit == "auto" else decode.memory_limit
+        # Threads have no IPC cost, so hand them one file at a time; processes get small chunks
+        self.chunk_size = chunk_size or (16 if backend == "process" else 1)
+        self.algorithm = algorithm
+        self.prefilter = CASCADE_PREFILTER if cascade else None
+        self.prefilter_threshold = threshold + math.ceil(CASCADE_MARGIN * hash_bits(CASCADE_PREFILTER, hash_size) / 64)
+        # Hashes are cached per algorithm and decode mode; prefilter hashes may come from an EXIF thumbnail, so
+        # they are kept apart from the same algorithm's ordinary hashes
+        self.cache_algorithm = algorithm if decode.reduced else algorithm + "-full"
+        self.prefilter_cache_algorithm = CASCADE_PREFILTER + "-cascade"
+        # Extra hashes only end up in the cache, so without one there is no point computing them
+        self.extra_specs = tuple(spec for spec in dict.fromkeys(caching.extra_hashes) if spec != (algorithm, hash_size)) if caching.path else ()
+        self.extra_cache_keys = [(extra_algorithm if decode.reduced else extra_algorithm + "-full", extra_hash_size) for extra_algorithm, extra_hash_size in self.extra_specs]
+        self.frames = frames
+        # Frame sequences depend on how the frames were sampled as well; an empty one marks a single frame image
+        self.frame_cache_algorithm = f"{self.cache_algorithm}-frames{frames.count}-{frames.sampling}" if frames else None
+        self.cancel_event = threading.Event()
+        # Every image found by the walk, in walk order. A file's id is its index in this table.
+        self.files = PathTable()
+        self.index = None
+        self.file_queue = None
+        self.stats = FileStats()
+        self.diagnostics = diagnostics
+        self.scan_stats = ScanStats(*diagnostics)
+        self.progress = {"stage": "walking", "discovered": 0, "walk_done": False, "queued": 0, "hashed": 0, "cached": 0, "failed": 0, "skipped": 0, "exact_copies": 0, "other_shards": 0, "refined": 0, "pairs": 0, "reference_pairs": 0, "frames": 0, "sequences": 0, "sequence_pairs": 0, "hash_rate": 0.0, "elapsed": 0.0}
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    @property
+    def cancelled(self):
+        return self.cancel_event.is_set()
+
+    def _put(self, out_queue, item):
+        while not self.cancel_event.is_set():
+            try:
+                out_queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    # Time spent waiting for room in the queue isn't counted as walking
+    def _walk(self, out_queue, with_stat):
+        files = walk_files(self.folder_path, self.max_depth, self.included_extensions, with_stat, *self.walk)
+        wall, cpu, count = time.perf_counter(), time.thread_time(), 0
+        try:
+            with self.scan_stats.profiling("walk"):
+                for entry in files:
+                    blocked = time.perf_counter()
+                    if not self._put(out_queue, entry):
+                        return
+                    wall += time.perf_counter() - blocked
+                    # Only this thread writes the counter, so it runs ahead of the hashing stage
+                    self.progress["discovered"] += 1
+                    count += 1
+                    if count == 1000:
+                        now, now_cpu = time.perf_counter(), time.thread_time()
+                        self.scan_stats.add("walk", now - wall, now_cpu - cpu, count)
+                        wall, cpu, count = now, now_cpu, 0
+        finally:
+            self.scan_stats.add("walk", time.perf_counter() - wall, time.thread_time() - cpu, count)
+        self._put(out_queue, None)
+
+    def scan(self):
+        self.started = time.monotonic()
+        self.scan_stats = ScanStats(*self.diagnostics)
+        # Hashing workers only take the profiling hook when the profiled stage is theirs, and never in worker processes
+        self.profile_hook = self.scan_stats.profiling if self.diagnostics.profile_stage in WORKER_STAGES else None
+        self.last_progress = 0.0
+        self.last_flush = self.started
+        self.files = PathTable()
+        self.stats = FileStats()
+        self.members = {}
+        self.copy_of = {}
+        self.row_file_ids = array("q")
+        # Each file's row in the matcher, or -1 until it has been hashed
+        self.file_rows = array("q")
+        self.match_batch = []
+        self.cache_writes = []
+        self.thumbnail_writes = []
+        self.pending_pairs = []
+        self.pending_problems = []
+        self.pending_chunk = []
+        self.in_flight = {}
+        self.prefilter_batch = []
+        self.prefilter_row_ids = []
+        # Files with only a prefilter hash so far, and files queued to be hashed properly
+        self.deferred = set()
+        self.refine_chunk = []
+        self.index = None
+        # Every match as (row i, row j, distance) columns, kept to build the index from
+        self.pair_rows = (array("q"), array("q"), array("q"))
+        self.matcher = StreamingMatcher(hash_bits(self.algorithm, self.hash_size), self.threshold, *self.matching)
+        if self.prefilter:
+            self.prefilter_matcher = StreamingMatcher(hash_bits(self.prefilter, self.hash_size), self.prefilter_threshold, *self.matching)
+        self.sequence_matcher = SequenceMatcher(hash_bits(self.algorithm, self.hash_size), self.threshold, *self.matching) if self.frames else None
+        self.sequence_batch = []
+        # Files with a frame sequence
+        self.sequence_files = set()
+        file_queue = self.file_queue = queue.Queue(maxsize=self.queue_size)
+        need_stats = bool(self.caching.path or self.caching.thumbnail_path or self.exact_first)
+        walker = threading.Thread(target=self._walk, args=(file_queue, need_stats), daemon=True)
+        walker.start()
+        cache = HashCache(self.caching.path) if self.caching.path else None
+        thumbnail_cache = ThumbnailCache(self.caching.thumbnail_path) if self.caching.thumbnail_path else None
+        # Worker processes get the budget as they start; threads (and the scan's own thread) are given it with each chunk
+        shared_budget = self.multi_thread and self.backend == "process"
+        budget = DecodeBudget(self.memory_limit, shared=shared_budget) if self.memory_limit is not None else None
+        # Hashes a list of paths with the scan's settings, on the scan's thread or a worker; only the prefilter
+        # differs between a cascade's two passes
+        self.hash_chunk = partial(compute_hash_chunk, hash_size=self.hash_size, reduced_decode=self.decode.reduced, thumbnail_size=self.thumbnail_size, algorithm=self.algorithm, extra_specs=self.extra_specs, budget=None if shared_budget else budget, profile_hook=self.profile_hook, frame_spec=self.frames)
+        self.executor = create_hash_executor(self.backend, self.num_workers, budget if shared_budget else None) if self.multi_thread else None
+        try:
+            with self.scan_stats.stage("cache", 0) if cache else nullcontext():
+                cached = cache.load(self.folder_path, self.cache_algorithm, self.hash_size) if cache else {}
+                prefilter_cached = cache.load(self.folder_path, self.prefilter_cache_algorithm, self.hash_size) if cache and self.prefilter else {}
+                extra_cached = [cache.load(self.folder_path, *key) for key in self.extra_cache_keys] if cache else []
+                frame_cached = cache.load(self.folder_path, self.frame_cache_algorithm, self.hash_size) if cache and self.frames else {}
+            self.progress["stage"] = "walking" if self.exact_first else "hashing"
+            for file_id in self._file_ids(file_queue, need_stats):
+                if self.cancelled:
+                    return
+                if file_id is None:
+                    # Nothing new from the walk right now, so don't hold back a partly filled chunk
+                    self._submit_chunk()
+                else:
+                    self._queue_file(file_id, cached, prefilter_cached, extra_cached, frame_cached)
+                    while len(self.in_flight) >= 2 * self.num_workers and not self.cancelled:
+                        yield from self._collect(timeout=0.1)
+                yield from self._collect(timeout=0)
+                if cache and len(self.cache_writes) >= self.CACHE_BATCH_SIZE:
+                    with self.scan_stats.stage("cache", len(self.cache_writes)):
+                        cache.store(self.cache_writes)
+                    self.cache_writes = []
+                if thumbnail_cache and len(self.thumbnail_writes) >= self.CACHE_BATCH_SIZE:
+                    with self.scan_stats.stage("cache", len(self.thumbnail_writes)):
+                        thumbnail_cache.store(self.thumbnail_writes)
+                    self.thumbnail_writes = []
+            if self.prefilter:
+                self.progress["stage"] = "refining"
+            # Matching the last files can still find candidates that need hashing, so repeat until nothing is left
+            self._submit_chunk()
+            while not self.cancelled:
+                yield from self._collect(timeout=0.1)
+                if not self.in_flight:
+                    self._flush_matches(force=True)
+                    self._submit_chunk()
+                    # Without workers the candidates were just hashed, and their hashes still need matching
+                    if not self.in_flight and not self.match_batch:
+                        break
+            if self.cancelled:
+                return
+            with self.scan_stats.stage("cache", len(self.cache_writes) + len(self.thumbnail_writes)) if cache or thumbnail_cache else nullcontext():
+                if cache:
+                    cache.store(self.cache_writes)
+                    cache.evict_missing(cached.keys() | prefilter_cached.keys() | frame_cached.keys() | {path for entries in extra_cached for path in entries}, {os.path.abspath(filepath) for filepath in self.files})
+                if thumbnail_cache:
+                    thumbnail_cache.store(self.thumbnail_writes)
+            info = {"algorithm": self.algorithm, "hash_size": self.hash_size, "reduced_decode": self.decode.reduced, "folder": os.path.abspath(self.folder_path)}
+            if self.shard is not None:
+                info.update(shard=[self.shard.number, self.shard.count], shard_by=self.shard.by)
+            with self.scan_stats.stage("index", len(self.row_file_ids)):
+                sequence_rows = None
+                if self.sequence_files:
+                    sequence_rows = np.zeros(len(self.row_file_ids), dtype=bool)
+                    sequence_rows[np.asarray(self.file_rows)[list(self.sequence_files)]] = True
+                self.index = HashIndex(self.files, self.row_file_ids, self.matcher.packed_hashes(), self.members, self.threshold, self.pair_rows, self.stats, info, sequence_rows)
+            self.matcher = None
+            self.progress["stage"] = "done"
+            yield from self._events(force=True)
+        finally:
+            # Stops the walker and drops queued work; hashes still being computed are discarded
+            if self.progress["stage"] != "done":
+                self.cancel_event.set()
+            if self.executor is not None:
+                self.executor.shutdown(wait=False, cancel_futures=True)
+                self.executor = None
+            if cache:
+                cache.close()
+            if thumbnail_cache:
+                thumbnail_cache.close()
+            self.scan_stats.stop_profiling()
+            self.file_queue = None
+            self.in_flight = {}
+            self.pending_chunk = []
+            self.pending_problems = []
+            self.refine_chunk = []
+            self.match_batch = []
+            self.prefilter_batch = []
+            self.prefilter_matcher = None
+            self.sequence_matcher = None
+            self.sequence_batch = []
+            self.sequence_files = set()
+            self.cache_writes = []
+            self.thumbnail_writes = []
+            self.pair_rows = None
+
+    # Yields the id of each file that needs a hash as the walk finds it, or None while the walk is busy.
+    # With exact_first the whole walk has to finish before files can be grouped by size, and only one
+    # file from each group of identical copies is passed on.
+    def _file_ids(self, file_queue, need_stats):
+        walk_ids = []
+        while not self.cancelled:
+            try:
+                entry = file_queue.get(timeout=0.05)
+            except queue.Empty:
+                yield None
+                continue
+            if entry is None:
+                break
+            filepath, stat = entry
+            if self.shard is not None and shard_of(filepath, self.folder_path, self.shard.count, self.shard.by) != self.shard.number:
+                self.progress["other_shards"] += 1
+                continue
+            if need_stats:
+                if stat is None:
+                    # The walk couldn't stat it; stat it again here to report why
+                    try:
+                        stat = os.stat(filepath)
+                    except OSError as e:
+                        self.pending_problems.append(FileProblem(filepath, "failed", str(e)))
+                        continue
+                self.stats.append(stat)
+            self.files.append(filepath)
+            self.file_rows.append(-1)
+            if self.exact_first:
+                walk_ids.append(len(self.files) - 1)
+                if len(walk_ids) % 1000 == 0:
+                    yield None
+            else:
+                self.progress["queued"] += 1
+                yield len(self.files) - 1
+        self.progress["walk_done"] = True
+        if not self.exact_first or self.cancelled:
+            return
+
+        self.progress["stage"] = "comparing file contents"
+        yield None
+        sizes = {self.files[file_id]: self.stats.get(file_id).st_size for file_id in walk_ids}
+        with self.scan_stats.stage("exact", len(walk_ids)):
+            groups = find_exact_duplicates([self.files[file_id] for file_id in walk_ids], sizes, self.num_workers, self.cancel_event)
+        copies = set()
+        for group in groups:
+            member_ids = [self.files.id_of(filepath) for filepath in group]
+            self.members[member_ids[0]] = member_ids
+            copies.update(member_ids[1:])
+            self.copy_of.update((copy_id, member_ids[0]) for copy_id in member_ids[1:])
+            if not self.folder_pairs:
+                continue
+            if self.expand_copies:
+                self.pending_pairs.extend((self.files[id1], self.files[id2], 0) for id1, id2 in itertools.combinations(member_ids, 2))
+            else:
+                self.pending_pairs.extend((self.files[member_ids[0]], self.files[copy_id], 0) for copy_id in member_ids[1:])
+        self.progress["exact_copies"] = len(copies)
+        self.progress["stage"] = "hashing"
+        for file_id in walk_ids:
+            if file_id not in copies:
+                self.progress["queued"] += 1
+                yield file_id
+
+    def _queue_file(self, file_id, cached, prefilter_cached, extra_cached, frame_cached):
+        stat = self.stats.get(file_id)
+        if stat is not None:
+            filepath = os.path.abspath(self.files[file_id])
+            key = (stat.st_size, stat.st_mtime_ns, stat.st_ino)
+
+            def fresh(entries):
+                entry = entries.get(filepath)
+                return entry if entry is not None and entry[:3] == key else None
+
+            entry = fresh(cached)
+            # A cascade needs every file's prefilter hash, even if the algorithm hash is cached
+            prefilter_entry = fresh(prefilter_cached)
+            # Files missing an extra hash are decoded again to fill it in, except in a cascade, which only
+            # computes extra hashes for files it decodes anyway
+            extras_cached = self.prefilter is not None or all(fresh(entries) is not None for entries in extra_cached)
+            frame_entry = fresh(frame_cached) if self.frames and may_have_frames(filepath) else None
+            frames_cached = frame_entry is not None or not self.frames or not may_have_frames(filepath)
+            if entry is not None and extras_cached and frames_cached and (self.prefilter is None or prefilter_entry is not None):
+                self.progress["cached"] += 1
+                self.match_batch.append((file_id, entry[3]))
+                if prefilter_entry is not None:
+                    self.prefilter_batch.append((file_id, prefilter_entry[3]))
+                if frame_entry is not None and frame_entry[3]:
+                    self._add_sequence(file_id, frame_entry[3])
+                return
+            if prefilter_entry is not None:
+                self.progress["cached"] += 1
+                self.prefilter_batch.append((file_id, prefilter_entry[3]))
+                self.deferred.add(file_id)
+                return
+        if self.executor is None:
+            self._record_hash(file_id, *self.hash_chunk([self.files[file_id]], prefilter=self.prefilter)[0])
+            return
+        self.pending_chunk.append(file_id)
+        if len(self.pending_chunk) >= self.chunk_size:
+            self._submit_chunk()
+
+    # Queues a file that only has a prefilter hash to be hashed with the scan's algorithm. This happens while
+    # matching, so without workers the file is only hashed once matching is done (see _submit_chunk()), which
+    # keeps the hashing out of the match stage's time.
+    def _queue_refine(self, file_id):
+        self.deferred.discard(file_id)
+        self.refine_chunk.append(file_id)
+        if self.executor is not None and len(self.refine_chunk) >= self.chunk_size:
+            self._submit_chunk()
+
+    def _submit_chunk(self):
+        if self.executor is None:
+            chunk = self.refine_chunk
+            self.refine_chunk = []
+            for file_id in chunk:
+                if self.cancelled:
+                    return
+                self._record_hash(file_id, *self.hash_chunk([self.files[file_id]])[0], refined=True)
+            return
+        if self.pending_chunk:
+            chunk = self.pending_chunk
+            self.pending_chunk = []
+            future = self.executor.submit(self.hash_chunk, [self.files[file_id] for file_id in chunk], prefilter=self.prefilter)
+            self.in_flight[future] = (chunk, False)
+        if self.refine_chunk:
+            chunk = self.refine_chunk
+            self.refine_chunk = []
+            future = self.executor.submit(self.hash_chunk, [self.files[file_id] for file_id in chunk])
+            self.in_flight[future] = (chunk, True)
+
+    # Records a worker's result for a file (see compute_hash_chunk). In a cascade's first pass hash_bytes may be None
+    # with only a prefilter hash; refined is set for the second pass, which hashes the candidates among those files.
+    def _record_hash(self, file_id, hash_bytes, thumbnail=None, prefilter_bytes=None, extra_bytes=None, problem=None, timings=None, sequence=None, refined=False):
+        if timings:
+            self.scan_stats.add_file(self.files[file_id], timings)
+        if hash_bytes is None and (refined or prefilter_bytes is None):
+            self.progress["skipped" if problem is not None and problem.status == "skipped" else "failed"] += 1
+            if problem is not None:
+                self.pending_problems.append(problem)
+            return
+        self.progress["refined" if refined else "hashed"] += 1
+        stat = self.stats.get(file_id)
+        filepath = os.path.abspath(self.files[file_id])
+        if prefilter_bytes is not None:
+            self.prefilter_batch.append((file_id, prefilter_bytes))
+            if stat is not None:
+                self.cache_writes.append((filepath, self.prefilter_cache_algorithm, self.hash_size, stat.st_size, stat.st_mtime_ns, stat.st_ino, prefilter_bytes))
+        if hash_bytes is None:
+            self.deferred.add(file_id)
+            return
+        self.match_batch.append((file_id, hash_bytes))
+        if stat is not None:
+            self.cache_writes.append((filepath, self.cache_algorithm, self.hash_size, stat.st_size, stat.st_mtime_ns, stat.st_ino, hash_bytes))
+            for (cache_algorithm, extra_hash_size), extra in zip(self.extra_cache_keys, extra_bytes or ()):
+                self.cache_writes.append((filepath, cache_algorithm, extra_hash_size, stat.st_size, stat.st_mtime_ns, stat.st_ino, extra))
+            if thumbnail is not None:
+                self.thumbnail_writes.append((filepath, stat.st_size, stat.st_mtime_ns, *thumbnail))
+            if sequence is not None:
+                self.cache_writes.append((filepath, self.frame_cache_algorithm, self.hash_size, stat.st_size, stat.st_mtime_ns, stat.st_ino, sequence))
+        if sequence:
+            self._add_sequence(file_id, sequence)
+
+    def _add_sequence(self, file_id, sequence):
+        self.sequence_batch.append((file_id, sequence))
+        self.sequence_files.add(file_id)
+        self.progress["sequences"] += 1
+        self.progress["frames"] += len(sequence) // ((hash_bits(self.algorithm, self.hash_size) + 7) // 8)
+
+    # Collects finished chunks (waiting up to `timeout` seconds for one), then matches and reports
+    def _collect(self, timeout):
+        if self.in_flight:
+            done, _ = wait(self.in_flight, timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                chunk, refined = self.in_flight.pop(future)
+                for file_id, result in zip(chunk, future.result()):
+                    self._record_hash(file_id, *result, refined=refined)
+        self._flush_matches()
+        if self.executor is None:
+            self._submit_chunk()
+        yield from self._events()
+
+    def _flush_matches(self, force=False):
+        if not self.match_batch and not self.prefilter_batch:
+            return
+        if not force and max(len(self.match_batch), len(self.prefilter_batch)) < self.MATCH_BATCH_SIZE and time.monotonic() - self.last_flush < self.PROGRESS_INTERVAL:
+            return
+        self.last_flush = time.monotonic()
+        with self.scan_stats.stage("match", len(self.match_batch) + len(self.prefilter_batch)):
+            self._match_batches()
+        # A file's sequence arrives with its single hash, so both files of a sequence pair already have a row
+        if self.sequence_batch:
+            with self.scan_stats.stage("align", len(self.sequence_batch)):
+                self._match_sequences()
+
+    def _match_batches(self):
+        if self.prefilter_batch:
+            batch = self.prefilter_batch
+            self.prefilter_batch = []
+            self.prefilter_row_ids.extend(file_id for file_id, hash_bytes in batch)
+            # Both files of a candidate pair need an algorithm hash; files that already have one are matched as they are
+            for i, j, distance in self.prefilter_matcher.add([hash_bytes for file_id, hash_bytes in batch]):
+                for file_id in (self.prefilter_row_ids[i], self.prefilter_row_ids[j]):
+                    if file_id in self.deferred:
+                        self._queue_refine(file_id)
+        if not self.match_batch:
+            return
+        batch = self.match_batch
+        self.match_batch = []
+        for file_id, hash_bytes in batch:
+            self.file_rows[file_id] = len(self.row_file_ids)
+            self.row_file_ids.append(file_id)
+        rows_i, rows_j, distances = self.pair_rows
+        for i, j, distance in self.matcher.add([hash_bytes for file_id, hash_bytes in batch]):
+            file_id1, file_id2 = self.row_file_ids[i], self.row_file_ids[j]
+            # Two clips can share an opening frame and nothing else, so files with frame sequences are matched on
+            # those instead (see _match_sequences())
+            if file_id1 in self.sequence_files and file_id2 in self.sequence_files:
+                continue
+            rows_i.append(i)
+            rows_j.append(j)
+            distances.append(distance)
+            if self.folder_pairs:
+                self._add_pair(file_id1, file_id2, distance)
+        if self.reference is not None:
+            self._match_reference(batch)
+
+    # Matches a batch of frame sequences against every sequence found so far
+    def _match_sequences(self):
+        batch = self.sequence_batch
+        self.sequence_batch = []
+        rows_i, rows_j, distances = self.pair_rows
+        for file_id1, file_id2, distance in self.sequence_matcher.add(batch):
+            row1, row2 = self.file_rows[file_id1], self.file_rows[file_id2]
+            rows_i.append(min(row1, row2))
+            rows_j.append(max(row1, row2))
+            distances.append(distance)
+            self.progress["sequence_pairs"] += 1
+            if self.folder_pairs:
+                self._add_pair(file_id1, file_id2, distance)
+
+    # Matches a batch of (file id, hash bytes) against the reference. Without folder pairs nothing else
+    # reports a file's identical copies, so the matches are always expanded to them.
+    def _match_reference(self, batch):
+        packed = pack_hashes([hash_bytes for file_id, hash_bytes in batch], hash_bits(self.algorithm, self.hash_size))
+        positions, rows, distances = self.reference.match(packed, self.threshold)
+        expand_members = self.expand_copies or not self.folder_pairs
+        for position, row, distance in zip(positions.tolist(), rows.tolist(), distances.tolist()):
+            file_id = batch[position][0]
+            file_ids = self.members.get(file_id, (file_id,)) if expand_members else (file_id,)
+            for reference_path in self.reference.row_files(row, self.included_extensions, self.expand_copies):
+                for member_id in file_ids:
+                    filepath = self.files[member_id]
+                    # A scanned folder inside the reference would otherwise match itself
+                    if os.path.abspath(filepath) != os.path.abspath(reference_path):
+                        self.pending_pairs.append((filepath, reference_path, distance))
+                        self.progress["reference_pairs"] += 1
+
+    # Records a match between two files, expanding it to every identical copy of either file
+    def _add_pair(self, file_id1, file_id2, distance):
+        if not self.expand_copies:
+            self.pending_pairs.append((self.files[min(file_id1, file_id2)], self.files[max(file_id1, file_id2)], distance))
+            return
+        for id1 in self.members.get(file_id1, (file_id1,)):
+            for id2 in self.members.get(file_id2, (file_id2,)):
+                first, second = min(id1, id2), max(id1, id2)
+                self.pending_pairs.append((self.files[first], self.files[second], distance))
+
+    # The os.stat() result taken for a file during the scan, or None if the scan didn't need one
+    def file_stat(self, filepath):
+        return self.stats.get(self.files.id_of(filepath))
+
+    # Hash distance between two scanned files (or reference files), or None if either of them wasn't hashed
+    def hash_distance(self, filepath1, filepath2):
+        if self.reference is not None:
+            hashes = [self._hash_of(filepath) for filepath in (filepath1, filepath2)]
+            if hashes[0] is None or hashes[1] is None:
+                return None
+            return int(popcount64(hashes[0] ^ hashes[1]).sum())
+        if self.index is not None:
+            return self.index.hash_distance(filepath1, filepath2)
+        rows = []
+        for filepath in (filepath1, filepath2):
+            file_id = self.files.id_of(filepath)
+            if file_id is None:
+                return None
+            row = self.file_rows[self.copy_of.get(file_id, file_id)]
+            if row < 0:
+                return None
+            rows.append(row)
+        return self.matcher.distance(*rows)
+
+    # The packed hash of a scanned file, or else of a reference file
+    def _hash_of(self, filepath):
+        file_id = self.files.id_of(filepath)
+        if file_id is None:
+            return self.reference.hash_of(filepath)
+        if self.index is not None:
+            return self.index.hash_of(filepath)
+        row = self.file_rows[self.copy_of.get(file_id, file_id)]
+        return self.matcher.packed_row(row) if row >= 0 else None
+
+    # Pairs of the finished scan within threshold (the scan's own by default) whose files both have one of
+    # included_extensions, ordered by walk position, as (filepath1, filepath2, distance) tuples.
+    # Only the matching is redone, see HashIndex.pairs().
+    def pairs(self, threshold=None, included_extensions=None):
+        if self.index is None:
+            raise RuntimeError("pairs() needs a finished scan")
+        threshold = self.threshold if threshold is None else threshold
+        return self.index.pairs(threshold, included_extensions, self.expand_copies)
+
+    def _events(self, force=False):
+        if self.pending_problems:
+            problems = self.pending_problems
+            self.pending_problems = []
+            yield "problems", problems
+        if self.pending_pairs:
+            pairs = self.pending_pairs
+            self.pending_pairs = []
+            self.progress["pairs"] += len(pairs)
+            yield "pairs", pairs
+        now = time.monotonic()
+        if force or now - self.last_progress >= self.PROGRESS_INTERVAL:
+            self.last_progress = now
+            self.progress["elapsed"] = now - self.started
+            self.progress["hash_rate"] = self.progress["hashed"] / max(self.progress["elapsed"], 1e-6)
+            if self.file_queue is not None:
+                self.scan_stats.queue("walk", self.file_queue.qsize())
+            self.scan_stats.queue("hashing", sum(len(chunk) for chunk, refined in self.in_flight.values()) + len(self.pending_chunk) + len(self.refine_chunk))
+            self.scan_stats.queue("matching", len(self.match_batch) + len(self.prefilter_batch))
+            yield "progress", dict(self.progress)
+
+# Function to find duplicate images. Like find_duplicate_groups(), it decodes every image in full unless given
+# reduced_decode, so its hashes and pairs stay what they were before reduced decoding (see DecodeOptions)
+def find_duplicate_images(folder_path, hash_size, threshold, max_depth, included_extensions, multi_thread, num_threads, match_engine="auto", block_size=1024, cache_path=None, backend="thread", reduced_decode=False, exact_first=False, algorithm="phash", cascade=False):
+    scanner = DuplicateScanner(folder_path, hash_size, threshold, max_depth, included_extensions, multi_thread, num_threads, MatchOptions(match_engine, block_size), CacheOptions(cache_path), backend, DecodeOptions(reduced_decode), exact_first, algorithm=algorithm, cascade=cascade)
+    duplicates = []
+    for event, data in scanner.scan():
+        if event == "pairs":
+            duplicates.extend(data)
+    # Return pairs in walk order, the same order a nested loop over every file would produce them in
+    duplicates.sort(key=lambda pair: (scanner.files.id_of(pair[0]), scanner.files.id_of(pair[1])))
+    return [(filepath1, filepath2) for filepath1, filepath2, distance in duplicates]
+
+# Finds duplicate images and merges them into groups, returning the group dicts of DuplicateGrouper.group()
+# ordered by walk position. keep is one of grouping.KEEP_POLICIES.
+def find_duplicate_groups(folder_path, hash_size, threshold, max_depth, included_extensions, multi_thread, num_threads, keep="resolution", match_engine="auto", block_size=1024, cache_path=None, backend="thread", reduced_decode=False, exact_first=False, algorithm="phash", cascade=False):
+    scanner = DuplicateScanner(folder_path, hash_size, threshold, max_depth, included_extensions, multi_thread, num_threads, MatchOptions(match_engine, block_size), CacheOptions(cache_path), backend, DecodeOptions(reduced_decode), exact_first, expand_copies=False, algorithm=algorithm, cascade=cascade)
+    grouper = DuplicateGrouper(keep, scanner.hash_distance)
+    for event, data in scanner.scan():
+        if event == "pairs":
+            grouper.add_pairs(data)
+    groups = grouper.groups()
+    groups.sort(key=lambda group: min(scanner.files.id_of(filepath) for filepath, distance in group["files"]))
+    return groups
@@ -0,0 +1,183 @@
+import functools
+import hashlib
+import os
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from .hashing import default_worker_count
+from .index import HashIndex
+from .matching import OFFSET_LOOKUP_COST, OFFSET_WIDTH, BandTable, block_distances, lookup_bands, popcount64
+from .store import FileStats, PathTable
+
+# Splitting a scan over several processes or machines that share the file system. Every shard walks the same
+# folder but only hashes the files that fall in its shard, then saves its index (DuplicateScanner's shard
+# option and HashIndex.save()). merge_indexes() combines the saved shards into one index, matching every file
+# against the files of the other shards without hashing anything again. A shard that fails can simply be run
+# again, as each one is independent and its index file is only written once it is complete.
+
+# Ways of assigning files to shards:
+#   path   - by a hash of the file's path, which spreads the files evenly
+#   folder - by a hash of the file's folder, which keeps each folder in one shard (fewer folders per worker
+#            is kinder to network drives, but a few huge folders can leave the shards uneven)
+SHARD_BY = ("path", "folder")
+
+# Shard number (0 to count - 1) of count, split by one of SHARD_BY
+Shard = namedtuple("Shard", ("number", "count", "by"), defaults=("path",))
+
+
+# The shard (0 to count - 1) a file belongs to. Paths are taken relative to the scanned folder with / separators,
+# so every worker agrees however the folder is mounted on it.
+def shard_of(filepath, folder_path, count, by="path"):
+    relative = os.path.relpath(filepath, folder_path).replace(os.sep, "/")
+    if by == "folder":
+        relative = relative.rpartition("/")[0]
+    elif by != "path":
+        raise ValueError(f"Unknown shard method: {by}")
+    digest = hashlib.blake2b(os.fsencode(relative), digest_size=8).digest()
+    return int.from_bytes(digest, "little") % count
+
+# The shards an index covers, as [folder, count, shard_by, number] lists; an unsharded scan is shard 0 of 1
+def _covered_shards(info):
+    if "shards" in info:
+        return [list(shard) for shard in info["shards"]]
+    number, count = info.get("shard") or (0, 1)
+    return [[info.get("folder"), count, info.get("shard_by") if count > 1 else None, number]]
+
+# Checks that a set of shard indexes fits together: same algorithm, hash size and decode mode, and for each
+# sharded scan (a folder split count ways) every shard exactly once. Indexes of unsharded scans, of other
+# folders or of earlier merges can be merged in too. Raises ValueError describing the first problem found;
+# missing shards are allowed with partial.
+def check_shards(indexes, names, partial=False):
+    first = indexes[0].info
+    for index, name in zip(indexes, names):
+        for key in ("algorithm", "hash_size", "reduced_decode"):
+            if index.info.get(key) != first.get(key):
+                raise ValueError(f"{name} was made with {key} {index.info.get(key)!r}, not {first.get(key)!r} like {names[0]}")
+    scans = {}
+    for index, name in zip(indexes, names):
+        for folder, count, by, number in _covered_shards(index.info):
+            seen = scans.setdefault((folder, count, by), {})
+            if number in seen:
+                raise ValueError(f"{name} and {seen[number]} both hold shard {number} of {count} of {folder}")
+            seen[number] = name
+    if not partial:
+        for (folder, count, by), seen in scans.items():
+            missing = sorted(set(range(count)) - set(seen))
+            if missing:
+                raise ValueError(f"Shard(s) {', '.join(str(number) for number in missing)} of {count} of {folder} missing")
+
+# Opens shard indexes saved with HashIndex.save() and merges them into a single in-memory HashIndex holding
+# every pair within threshold (by default the lowest threshold the shards were scanned with). Pairs within a
+# shard come from that shard's index; pairs between shards are found by looking the rows of each shard up in
+# lookup tables of the shards before it (see _match_across_shards()). The shards' indexes don't keep frame
+# sequences, so two files with sequences in different shards are never paired; shard such scans by folder to
+# keep copies of an animation together. Raises ValueError if the indexes don't fit together (see
+# check_shards()). Returns None if cancel_event is set before the merge finishes.
+def merge_indexes(paths, threshold=None, partial=False, cancel_event=None, block_size=HashIndex.BLOCK_SIZE):
+    indexes = [HashIndex.open(path) for path in paths]
+    check_shards(indexes, paths, partial)
+    if threshold is None:
+        threshold = min(index.max_distance for index in indexes)
+    file_offsets = np.cumsum([0] + [len(index) for index in indexes])
+    row_offsets = np.cumsum([0] + [len(index.packed) for index in indexes])
+
+    members = {}
+    pairs_i, pairs_j, pairs_distances = [], [], []
+    for index, file_offset, row_offset in zip(indexes, file_offsets, row_offsets):
+        for file_id, member_ids in index.members.items():
+            members[file_id + file_offset] = [member_id + file_offset for member_id in member_ids]
+        if index.max_distance < threshold:
+            index.extend(threshold, cancel_event=cancel_event)
+        end = np.searchsorted(index.pair_distances, threshold, side="right")
+        pairs_i.append(index.pair_i[:end] + row_offset)
+        pairs_j.append(index.pair_j[:end] + row_offset)
+        pairs_distances.append(np.asarray(index.pair_distances[:end]))
+
+    packed = np.concatenate([index.packed for index in indexes]) if row_offsets[-1] else np.zeros((0, 1), dtype=np.uint64)
+    sequence_rows = None
+    if any(index.sequence_rows is not None for index in indexes):
+        sequence_rows = np.concatenate([np.asarray(index.sequence_rows) if index.sequence_rows is not None else np.zeros(len(index.packed), dtype=bool) for index in indexes])
+    found = _match_across_shards(packed, row_offsets, threshold, block_size, indexes[0].num_bits(), sequence_rows, cancel_event)
+    if found is None:
+        return None
+    pairs_i.append(found[0])
+    pairs_j.append(found[1])
+    pairs_distances.append(found[2])
+
+    files = PathTable.concatenate([index.files for index in indexes])
+    stats = FileStats.concatenate([index.stats for index in indexes], [len(index) for index in indexes])
+    row_file_ids = np.concatenate([index.row_file_ids + file_offset for index, file_offset in zip(indexes, file_offsets)])
+    info = {key: indexes[0].info.get(key) for key in ("algorithm", "hash_size", "reduced_decode")}
+    info["shards"] = sorted(shard for index in indexes for shard in _covered_shards(index.info))
+    info["folder"] = sorted({folder for folder, count, by, number in info["shards"]})
+    merged = HashIndex(files, row_file_ids, packed, members, threshold, (np.concatenate(pairs_i), np.concatenate(pairs_j), np.concatenate(pairs_distances)), stats, info, sequence_rows)
+    merged.alive = np.concatenate([index.alive for index in indexes])
+    return merged
+
+# Every pair of rows of packed from different shards within threshold, as (rows i, rows j, distances) arrays
+# with row i in the earlier shard; row_offsets are where each shard's rows start, plus the number of rows. The
+# rows of every shard but the last get a lookup table (see matching.BandTable) that the rows of the shards
+# after it are looked up in, a block of rows per task so NumPy can spread the work over every core; a shard is
+# compared with every row instead where the table wouldn't be quicker. Pairs of two rows marked in
+# sequence_rows are left out, as files with frame sequences are only paired on those.
+def _match_across_shards(packed, row_offsets, threshold, block_size, num_bits, sequence_rows=None, cancel_event=None):
+    num_workers = default_worker_count()
+    found_i, found_j, found_distances = [np.zeros(0, dtype=np.int64)], [np.zeros(0, dtype=np.int64)], [np.zeros(0, dtype=np.int64)]
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        for shard_start, shard_end in zip(row_offsets[:-2], row_offsets[1:-1]):
+            if shard_start == shard_end:
+                continue
+            shard_rows = packed[shard_start:shard_end]
+            bands = lookup_bands(num_bits, threshold, len(shard_rows), OFFSET_LOOKUP_COST, OFFSET_WIDTH)
+            if bands is not None:
+                match_block = functools.partial(_lookup_block, BandTable.build(shard_rows, bands))
+            else:
+                match_block = functools.partial(_match_block, block_size=block_size)
+            starts = range(shard_end, len(packed), block_size)
+            # Keeps only a few blocks in flight so memory doesn't grow with the number of files
+            pending = [executor.submit(match_block, shard_rows, packed[start:start + block_size], threshold, cancel_event) for start in starts[:2 * num_workers]]
+            next_start = 2 * num_workers
+            for start in starts:
+                if cancel_event is not None and cancel_event.is_set():
+                    for future in pending:
+                        future.cancel()
+                    return None
+                positions, rows, distances = pending.pop(0).result()
+                if next_start < len(starts):
+                    pending.append(executor.submit(match_block, shard_rows, packed[starts[next_start]:starts[next_start] + block_size], threshold, cancel_event))
+                    next_start += 1
+                rows_i, rows_j = rows + shard_start, positions + start
+                if sequence_rows is not None:
+                    keep = ~(sequence_rows[rows_i] & sequence_rows[rows_j])
+                    rows_i, rows_j, distances = rows_i[keep], rows_j[keep], distances[keep]
+                found_i.append(rows_i)
+                found_j.append(rows_j)
+                found_distances.append(distances)
+    if cancel_event is not None and cancel_event.is_set():
+        return None
+    return np.concatenate(found_i), np.concatenate(found_j), np.concatenate(found_distances)
+
+# (positions in batch, rows of shard_rows, distances) of the pairs within threshold that batch finds in table, a
+# BandTable of shard_rows; a pair close in several bands is found once for each, so the few matches are deduplicated
+def _lookup_block(table, shard_rows, batch, threshold, cancel_event=None):
+    positions, rows = table.candidates(batch, threshold)
+    distances = popcount64(batch[positions] ^ shard_rows[rows]).sum(axis=1, dtype=np.int64)
+    keep = distances <= threshold
+    positions, rows, distances = positions[keep], rows[keep], distances[keep]
+    unique = np.unique(positions * len(shard_rows) + rows, return_index=True)[1]
+    return positions[unique], rows[unique], distances[unique]
+
+# As _lookup_block(), comparing batch with every row of shard_rows a block at a time
+def _match_block(shard_rows, batch, threshold, cancel_event=None, block_size=HashIndex.BLOCK_SIZE):
+    found_positions, found_rows, found_distances = [np.zeros(0, dtype=np.int64)], [np.zeros(0, dtype=np.int64)], [np.zeros(0, dtype=np.int64)]
+    for col_start in range(0, len(shard_rows), block_size):
+        if cancel_event is not None and cancel_event.is_set():
+            break
+        distances = block_distances(batch, shard_rows[col_start:col_start + block_size])
+        positions, rows = np.nonzero(distances <= threshold)
+        found_positions.append(positions)
+        found_rows.append(rows + col_start)
+        found_distances.append(distances[positions, rows].astype(np.int64))
+    return np.concatenate(found_positions), np.concatenate(found_rows), np.concatenate(found_distances)
@@ -0,0 +1,273 @@
+import heapq
+import sys
+import threading
+import time
+from collections import Counter, namedtuple
+from contextlib import contextmanager, nullcontext
+
+# Lightweight instrumentation of a scan: where the time goes, stage by stage. Timing costs a couple of clock
+# reads per stage per file, which is nothing next to decoding an image, so it is always on. Profiling a stage
+# in depth (see ScanStats' profile_stage) is opt-in.
+
+# Stages a scan reports, in pipeline order:
+#   walk      - listing folders (the walker thread)
+#   exact     - comparing file contents for exact_first
+#   cache     - reading and writing the hash and thumbnail caches
+#   open      - opening files and reading their headers (hashing workers)
+#   wait      - waiting for a share of the decoding memory limit (hashing workers)
+#   decode    - decoding images, including reading their data (hashing workers)
+#   hash      - hashing decoded images (hashing workers)
+#   thumbnail - thumbnailing decoded images (hashing workers)
+#   sample    - picking and decoding the frames of animated images and videos, counted in frames (hashing workers)
+#   framehash - hashing those frames, counted in frames (hashing workers)
+#   match     - matching new hashes against the ones found before
+#   align     - matching the frame sequences of animated images and videos, counted in sequences
+#   index     - building the finished scan's HashIndex
+#   grouping  - merging pairs into groups (GUI and CLI --group)
+#   results   - adding results to the GUI's lists
+# Worker stages add up across workers, so with several workers they can exceed the scan's elapsed time.
+STAGES = ("walk", "exact", "cache", "open", "wait", "decode", "hash", "thumbnail", "sample", "framehash", "match", "align", "index", "grouping", "results")
+# Stages that run on the hashing workers, which can't be profiled in worker processes
+WORKER_STAGES = ("open", "wait", "decode", "hash", "thumbnail", "sample", "framehash")
+PROFILE_MODES = ("cprofile", "sample")
+
+# What a scan's ScanStats keep beyond the time per stage: the slowest_count slowest files, and a profile of
+# profile_stage (None for none) in profile_mode
+DiagnosticOptions = namedtuple("DiagnosticOptions", ("slowest_count", "profile_stage", "profile_mode"), defaults=(10, None, "cprofile"))
+
+
+# Times the stages of hashing one file on a worker. times maps each stage to (wall seconds, CPU seconds, count)
+# and is sent back with the file's result. hook(stage), if given, returns a context manager the stage runs in,
+# which is how a profiled stage is profiled on thread workers.
+class FileTimer:
+    def __init__(self, hook=None):
+        self.times = {}
+        self.hook = hook
+
+    @contextmanager
+    def stage(self, name, count=1):
+        wall, cpu = time.perf_counter(), time.thread_time()
+        try:
+            with self.hook(name) if self.hook is not None else nullcontext():
+                yield
+        finally:
+            previous_wall, previous_cpu, previous_count = self.times.get(name, (0.0, 0.0, 0))
+            self.times[name] = (previous_wall + time.perf_counter() - wall, previous_cpu + time.thread_time() - cpu, previous_count + count)
+
+
+# Collects the timings of a scan from every thread. stage() times a block of code, add_file() adds the stage
+# timings of a hashed file, queue() records a sampled queue depth, and snapshot() returns everything as a
+# JSON-compatible dict. The slowest_count files that took longest to open, decode, hash and thumbnail are kept.
+# With profile_stage, that stage is also profiled: with profile_mode "cprofile" by cProfile, or with "sample"
+# by looking at the stacks of the threads in the stage every sample_interval seconds, which barely slows them
+# down. Worker stages can only be profiled on thread workers. profile_report() then describes the result.
+class ScanStats:
+    def __init__(self, slowest_count=10, profile_stage=None, profile_mode="cprofile", sample_interval=0.005):
+        if profile_stage is not None and profile_stage not in STAGES:
+            raise ValueError(f"Unknown stage to profile: {profile_stage}")
+        if profile_mode not in PROFILE_MODES:
+            raise ValueError(f"Unknown profile mode: {profile_mode}")
+        self.slowest_count = slowest_count
+        self.profile_stage = profile_stage
+        self.profile_mode = profile_mode
+        self.sample_interval = sample_interval
+        self.lock = threading.Lock()
+        # stage -> [wall seconds, CPU seconds, count]
+        self.stages = {}
+        # queue -> [latest depth, peak depth]
+        self.queues = {}
+        # Heap of (seconds, filepath) of the slowest files
+        self.slowest = []
+        self.profilers = []
+        self.profiler_local = threading.local()
+        self.samples_self = Counter()
+        self.samples_total = Counter()
+        self.sample_count = 0
+        self.sampled_threads = Counter()
+        self.sampler = None
+        self.sampler_stop = threading.Event()
+
+    def add(self, stage, wall, cpu=0.0, count=1):
+        with self.lock:
+            totals = self.stages.setdefault(stage, [0.0, 0.0, 0])
+            totals[0] += wall
+            totals[1] += cpu
+            totals[2] += count
+
+    # Times a block of code as count items of stage, profiling it if it's the profiled stage
+    @contextmanager
+    def stage(self, name, count=1):
+        wall, cpu = time.perf_counter(), time.thread_time()
+        try:
+            with self.profiling(name):
+                yield
+        finally:
+            self.add(name, time.perf_counter() - wall, time.thread_time() - cpu, count)
+
+    # Adds the stage timings of a hashed file (FileTimer.times)
+    def add_file(self, filepath, times):
+        with self.lock:
+            for name, (wall, cpu, count) in times.items():
+                totals = self.stages.setdefault(name, [0.0, 0.0, 0])
+                totals[0] += wall
+                totals[1] += cpu
+                totals[2] += count
+            seconds = sum(wall for name, (wall, cpu, count) in times.items() if name != "wait")
+            if len(self.slowest) < self.slowest_count:
+                heapq.heappush(self.slowest, (seconds, filepath))
+            elif seconds > self.slowest[0][0]:
+                heapq.heapreplace(self.slowest, (seconds, filepath))
+
+    def queue(self, name, depth):
+        with self.lock:
+            depths = self.queues.setdefault(name, [0, 0])
+            depths[0] = depth
+            depths[1] = max(depths[1], depth)
+
+    # The instrumentation so far. progress is the scanner's progress dict, for file counts and cache hits.
+    def snapshot(self, progress=None):
+        with self.lock:
+            stages = {name: {"wall": round(wall, 4), "cpu": round(cpu, 4), "count": count, "per_second": round(count / wall, 1) if wall else None}
+                      for name, (wall, cpu, count) in sorted(self.stages.items(), key=lambda item: STAGES.index(item[0]) if item[0] in STAGES else len(STAGES))}
+            queues = {name: {"depth": depth, "peak": peak} for name, (depth, peak) in self.queues.items()}
+            slowest = [{"file": filepath, "seconds": round(seconds, 4)} for seconds, filepath in sorted(self.slowest, reverse=True)]
+        report = {"stages": stages, "queues": queues, "slowest": slowest}
+        if progress is not None:
+            looked_up = progress["hashed"] + progress["cached"] + progress["failed"] + progress["skipped"]
+            report["elapsed"] = round(progress["elapsed"], 3)
+            report["files_per_second"] = round(looked_up / progress["elapsed"], 1) if progress["elapsed"] else None
+            report["cache_hit_rate"] = round(progress["cached"] / looked_up, 4) if looked_up else None
+        return report
+
+    # One line for a status bar: the busiest stages' shares of the time measured, the deepest queue and the
+    # cache hit rate
+    def summary(self, progress=None):
+        report = self.snapshot(progress)
+        total = sum(stage["wall"] for name, stage in report["stages"].items() if name != "wait")
+        parts = []
+        if total:
+            busiest = sorted(((stage["wall"], name) for name, stage in report["stages"].items() if name != "wait"), reverse=True)[:3]
+            parts.append(", ".join(f"{name} {wall / total:.0%}" for wall, name in busiest if wall))
+        if report.get("files_per_second") is not None:
+            parts.append(f"{report['files_per_second']:.1f} files/s")
+        if report["queues"]:
+            name, depths = max(report["queues"].items(), key=lambda item: item[1]["depth"])
+            parts.append(f"{name} queue {depths['depth']}")
+        if report.get("cache_hit_rate") is not None and progress["cached"]:
+            parts.append(f"cache {report['cache_hit_rate']:.0%} hits")
+        return " | ".join(part for part in parts if part)
+
+    # Context manager the code of a stage runs in: profiles it if it's the profiled stage, otherwise does nothing
+    def profiling(self, name):
+        if name != self.profile_stage:
+            return nullcontext()
+        return self._sample_thread() if self.profile_mode == "sample" else self._cprofile_thread()
+
+    # Each thread gets its own cProfile.Profile, as a profiler only sees the thread it was enabled on. Where
+    # profilers are process-wide (Python 3.12 on) the first thread's profiler sees them all and the others
+    # are left unprofiled.
+    @contextmanager
+    def _cprofile_thread(self):
+        import cProfile
+        profiler = getattr(self.profiler_local, "profiler", None)
+        if profiler is None:
+            profiler = self.profiler_local.profiler = cProfile.Profile()
+            with self.lock:
+                self.profilers.append(profiler)
+        try:
+            profiler.enable()
+        except ValueError:
+            yield
+            return
+        try:
+            yield
+        finally:
+            profiler.disable()
+
+    @contextmanager
+    def _sample_thread(self):
+        thread_id = threading.get_ident()
+        with self.lock:
+            self.sampled_threads[thread_id] += 1
+            if self.sampler is None:
+                self.sampler = threading.Thread(target=self._sample, daemon=True)
+                self.sampler.start()
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.sampled_threads[thread_id] -= 1
+                if not self.sampled_threads[thread_id]:
+                    del self.sampled_threads[thread_id]
+
+    def _sample(self):
+        while not self.sampler_stop.wait(self.sample_interval):
+            with self.lock:
+                thread_ids = list(self.sampled_threads)
+            frames = sys._current_frames()
+            for thread_id in thread_ids:
+                frame = frames.get(thread_id)
+                if frame is None:
+                    continue
+                self.sample_count += 1
+                self.samples_self[_frame_key(frame)] += 1
+                seen = set()
+                while frame is not None:
+                    key = _frame_key(frame)
+                    if key not in seen:
+                        seen.add(key)
+                        self.samples_total[key] += 1
+                    frame = frame.f_back
+
+    # Stops profiling; call once the scan has finished
+    def stop_profiling(self):
+        self.sampler_stop.set()
+        if self.sampler is not None:
+            self.sampler.join()
+
+    # Writes the profile of the profiled stage to path: for cProfile a binary .prof file pstats can read if path
+    # ends in .prof, otherwise a text report as for profile_report()
+    def write_profile(self, path):
+        if self.profile_mode == "cprofile" and path.endswith(".prof"):
+            stats = self._pstats()
+            if stats is not None:
+                stats.dump_stats(path)
+            return
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(self.profile_report())
+
+    # Text report of the profiled stage: cProfile's 40 functions with the most cumulative time, or the 40
+    # functions most often on the sampled stacks, with how often they were running themselves
+    def profile_report(self, limit=40):
+        if self.profile_stage is None:
+            return ""
+        if self.profile_mode == "cprofile":
+            import io
+            stats = self._pstats()
+            if stats is None:
+                return f"No profile: the {self.profile_stage} stage never ran\n"
+            stream = io.StringIO()
+            stats.stream = stream
+            stats.sort_stats("cumulative").print_stats(limit)
+            return f"cProfile of the {self.profile_stage} stage\n" + stream.getvalue()
+        lines = [f"{self.sample_count} samples of the {self.profile_stage} stage every {self.sample_interval * 1000:g} ms",
+                 f"{'total':>7} {'self':>7}  function"]
+        for key, total in self.samples_total.most_common(limit):
+            filename, line, function = key
+            lines.append(f"{total / max(self.sample_count, 1):7.1%} {self.samples_self[key] / max(self.sample_count, 1):7.1%}  {function} ({filename}:{line})")
+        return "\n".join(lines) + "\n"
+
+    def _pstats(self):
+        import pstats
+        profilers = [profiler for profiler in self.profilers if profiler.getstats()]
+        if not profilers:
+            return None
+        stats = pstats.Stats(profilers[0])
+        for profiler in profilers[1:]:
+            stats.add(profiler)
+        return stats
+
+
+def _frame_key(frame):
+    code = frame.f_code
+    return code.co_filename, code.co_firstlineno, code.co_name
@@ -0,0 +1,263 @@
+import hashlib
+import json
+import os
+import threading
+from array import array
+from collections import namedtuple
+
+import numpy as np
+
+
+# Compact storage for scans of millions of files. Rather than a Python string, dict entry and stat object per
+# file (several hundred bytes each), files are numbered and everything about them lives in flat arrays indexed
+# by that number: their paths back to back in one byte string, their stats in parallel columns, their hashes in
+# one packed matrix (see index.HashIndex). The arrays can be written to a single file and opened again
+# memory-mapped, so a large index only pages in the parts that are actually used.
+
+
+# 8-byte key a path is looked up by; stable between runs so lookup tables can be saved with the paths
+def _path_key(encoded_path):
+    return int.from_bytes(hashlib.blake2b(encoded_path, digest_size=8).digest(), "little", signed=True)
+
+
+# Append-only table of file paths, numbered from 0 in the order they are added. Paths are stored as one UTF-8
+# byte string plus an offset per path (os.fsencode, so undecodable names survive). Looking a path up by name
+# uses a sorted array of path keys, built the first time it's needed and extended as paths are added.
+# One thread may append while others look paths up.
+class PathTable:
+    # Paths added since the sorted keys were last rebuilt are kept in a dict until there are this many
+    RECENT_LIMIT = 65536
+
+    def __init__(self, blob=None, offsets=None, lookup_keys=None, lookup_ids=None):
+        self.blob = bytearray() if blob is None else blob
+        self.offsets = array("q", [0]) if offsets is None else offsets
+        self.lookup_keys = np.zeros(0, dtype=np.int64) if lookup_keys is None else lookup_keys
+        self.lookup_ids = np.zeros(0, dtype=np.int64) if lookup_ids is None else lookup_ids
+        self.recent = None
+        self.indexed = len(self.lookup_ids)
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, path_id):
+        if not -len(self) <= path_id < len(self):
+            raise IndexError("path id out of range")
+        path_id %= len(self)
+        return os.fsdecode(bytes(self.blob[self.offsets[path_id]:self.offsets[path_id + 1]]))
+
+    def __iter__(self):
+        for path_id in range(len(self)):
+            yield self[path_id]
+
+    def append(self, path):
+        self.blob += os.fsencode(path)
+        self.offsets.append(len(self.blob))
+        return len(self) - 1
+
+    # The id of a path, or None if it isn't in the table
+    def id_of(self, path):
+        encoded = os.fsencode(path)
+        key = _path_key(encoded)
+        with self.lock:
+            self._index_new_paths()
+            candidates = list(self.recent.get(key, ()))
+            position = int(np.searchsorted(self.lookup_keys, key))
+            while position < len(self.lookup_keys) and self.lookup_keys[position] == key:
+                candidates.append(int(self.lookup_ids[position]))
+                position += 1
+        for path_id in candidates:
+            if bytes(self.blob[self.offsets[path_id]:self.offsets[path_id + 1]]) == encoded:
+                return path_id
+        return None
+
+    def _index_new_paths(self):
+        if self.recent is None:
+            self.recent = {}
+        for path_id in range(self.indexed, len(self)):
+            key = _path_key(bytes(self.blob[self.offsets[path_id]:self.offsets[path_id + 1]]))
+            self.recent.setdefault(key, []).append(path_id)
+        self.indexed = len(self)
+        if len(self.recent) >= max(self.RECENT_LIMIT, len(self.lookup_ids) // 8):
+            self._merge_recent()
+
+    def _merge_recent(self):
+        keys = [key for key, path_ids in self.recent.items() for path_id in path_ids]
+        path_ids = [path_id for key, path_ids in self.recent.items() for path_id in path_ids]
+        all_keys = np.concatenate((self.lookup_keys, np.array(keys, dtype=np.int64)))
+        all_ids = np.concatenate((self.lookup_ids, np.array(path_ids, dtype=np.int64)))
+        order = np.argsort(all_keys, kind="stable")
+        self.lookup_keys, self.lookup_ids = all_keys[order], all_ids[order]
+        self.recent = {}
+
+    # Boolean array saying which paths end with one of suffixes, ignoring ASCII case, worked out on the
+    # byte string directly so it takes a fraction of a second even for millions of paths
+    def endswith(self, suffixes):
+        offsets = np.asarray(self.offsets, dtype=np.int64)
+        blob = np.frombuffer(self.blob, dtype=np.uint8) if isinstance(self.blob, (bytes, bytearray)) else np.asarray(self.blob, dtype=np.uint8)
+        ends = offsets[1:]
+        lengths = ends - offsets[:-1]
+        found = np.zeros(len(self), dtype=bool)
+        for suffix in {os.fsencode(suffix.lower()) for suffix in suffixes}:
+            if not suffix:
+                found[:] = True
+                continue
+            candidates = np.nonzero(lengths >= len(suffix))[0]
+            tails = blob[(ends[candidates] - len(suffix))[:, None] + np.arange(len(suffix))]
+            tails = np.where((tails >= ord("A")) & (tails <= ord("Z")), tails + 32, tails)
+            found[candidates[(tails == np.frombuffer(suffix, dtype=np.uint8)).all(axis=1)]] = True
+        return found
+
+    def to_arrays(self):
+        with self.lock:
+            self._index_new_paths()
+            self._merge_recent()
+        return {
+            "path_blob": np.frombuffer(bytes(self.blob), dtype=np.uint8),
+            "path_offsets": np.asarray(self.offsets, dtype=np.int64),
+            "path_lookup_keys": self.lookup_keys,
+            "path_lookup_ids": self.lookup_ids,
+        }
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        return cls(arrays["path_blob"], arrays["path_offsets"], arrays["path_lookup_keys"], arrays["path_lookup_ids"])
+
+    # One table holding the paths of tables one after the other, numbered on from each other. The result is
+    # built from the tables' arrays in bulk and is read-only (it can't be appended to).
+    @classmethod
+    def concatenate(cls, tables):
+        parts = [table.to_arrays() for table in tables]
+        blob_offsets = np.cumsum([0] + [len(part["path_blob"]) for part in parts])
+        id_offsets = np.cumsum([0] + [len(table) for table in tables])
+        blob = np.concatenate([part["path_blob"] for part in parts])
+        offsets = np.concatenate([[0]] + [part["path_offsets"][1:] + blob_offset for part, blob_offset in zip(parts, blob_offsets)]).astype(np.int64)
+        keys = np.concatenate([part["path_lookup_keys"] for part in parts])
+        ids = np.concatenate([part["path_lookup_ids"] + id_offset for part, id_offset in zip(parts, id_offsets)])
+        order = np.argsort(keys, kind="stable")
+        return cls(blob, offsets, keys[order], ids[order])
+
+
+# The parts of os.stat() that scans use, as kept by FileStats. st_mtime and st_ctime are derived from the
+# nanosecond values, so it can stand in for an os.stat_result.
+class FileStat(namedtuple("FileStat", ("st_size", "st_mtime_ns", "st_ctime_ns", "st_ino"))):
+    __slots__ = ()
+
+    @property
+    def st_mtime(self):
+        return self.st_mtime_ns / 1e9
+
+    @property
+    def st_ctime(self):
+        return self.st_ctime_ns / 1e9
+
+
+# Stats of numbered files as parallel columns, 32 bytes a file. A size of -1 marks a file without a stat.
+class FileStats:
+    COLUMNS = ("size", "mtime_ns", "ctime_ns", "inode")
+
+    def __init__(self, columns=None):
+        if columns is None:
+            columns = {name: array("Q" if name == "inode" else "q") for name in self.COLUMNS}
+        self.columns = columns
+
+    def __len__(self):
+        return len(self.columns["size"])
+
+    def append(self, stat):
+        columns = self.columns
+        if stat is None:
+            for name in self.COLUMNS:
+                columns[name].append(-1 if name == "size" else 0)
+            return
+        columns["size"].append(stat.st_size)
+        columns["mtime_ns"].append(stat.st_mtime_ns)
+        columns["ctime_ns"].append(getattr(stat, "st_ctime_ns", int(stat.st_ctime * 1e9)))
+        columns["inode"].append(stat.st_ino)
+
+    # The FileStat of a file, or None if it has none (or is beyond the files added so far)
+    def get(self, file_id):
+        if file_id is None or not 0 <= file_id < len(self) or self.columns["size"][file_id] < 0:
+            return None
+        return FileStat(*(int(self.columns[name][file_id]) for name in self.COLUMNS))
+
+    def to_arrays(self):
+        return {"stat_" + name: np.asarray(column, dtype=np.uint64 if name == "inode" else np.int64) for name, column in self.columns.items()}
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        if "stat_size" not in arrays:
+            return cls()
+        return cls({name: arrays["stat_" + name] for name in cls.COLUMNS})
+
+    # One FileStats holding the stats of each of stats_list in turn, the n-th padded to lengths[n] files
+    @classmethod
+    def concatenate(cls, stats_list, lengths):
+        columns = {}
+        for name in cls.COLUMNS:
+            dtype = np.uint64 if name == "inode" else np.int64
+            parts = []
+            for stats, length in zip(stats_list, lengths):
+                column = np.asarray(stats.columns[name], dtype=dtype)
+                padding = np.full(length - len(column), -1 if name == "size" else 0, dtype=dtype)
+                parts.append(np.concatenate((column, padding)))
+            columns[name] = np.concatenate(parts) if parts else np.zeros(0, dtype=dtype)
+        return cls(columns)
+
+
+# File format for a set of named NumPy arrays plus a JSON-compatible info dict:
+#   16 byte magic, header offset and length (two little-endian uint64s), the arrays' raw bytes each aligned to
+#   64 bytes, then the JSON header describing them (dtype, shape, offset) and holding info.
+# Arrays are written in C order so each can be memory-mapped in place.
+STORE_MAGIC = b"DUPLINATOR-STORE"
+STORE_VERSION = 1
+STORE_ALIGNMENT = 64
+
+
+# Writes info and arrays to path. The file is written under a temporary name and moved into place, so a
+# reader never sees a partly written store.
+def write_store(path, info, arrays):
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    descriptions = {}
+    try:
+        with open(temp_path, "wb") as f:
+            f.write(STORE_MAGIC + bytes(16))
+            for name, values in arrays.items():
+                values = np.ascontiguousarray(values)
+                f.write(bytes(-f.tell() % STORE_ALIGNMENT))
+                descriptions[name] = {"dtype": values.dtype.str, "shape": list(values.shape), "offset": f.tell()}
+                f.write(values.tobytes())
+            header = json.dumps({"version": STORE_VERSION, "info": info, "arrays": descriptions}).encode("utf-8")
+            header_offset = f.tell()
+            f.write(header)
+            f.seek(len(STORE_MAGIC))
+            f.write(np.array([header_offset, len(header)], dtype="<u8").tobytes())
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+# Reads a file written by write_store, returning (info, {name: array}). With mmap the arrays are read-only
+# memory maps of the file, so nothing is loaded until it is used; otherwise they are read into memory.
+# Raises ValueError if path isn't a store this version can read.
+def read_store(path, mmap=True):
+    with open(path, "rb") as f:
+        preamble = f.read(len(STORE_MAGIC) + 16)
+        if len(preamble) < len(STORE_MAGIC) + 16 or preamble[:len(STORE_MAGIC)] != STORE_MAGIC:
+            raise ValueError(f"Not a Duplinator index: {path}")
+        header_offset, header_length = np.frombuffer(preamble[len(STORE_MAGIC):], dtype="<u8").tolist()
+        f.seek(header_offset)
+        header = json.loads(f.read(header_length).decode("utf-8"))
+        if header["version"] != STORE_VERSION:
+            raise ValueError(f"Unsupported Duplinator index version {header['version']}: {path}")
+        arrays = {}
+        for name, description in header["arrays"].items():
+            dtype, shape = np.dtype(description["dtype"]), tuple(description["shape"])
+            count = int(np.prod(shape))
+            if mmap and count:
+                arrays[name] = np.memmap(path, dtype=dtype, mode="r", offset=description["offset"], shape=shape)
+            else:
+                f.seek(description["offset"])
+                arrays[name] = np.fromfile(f, dtype=dtype, count=count).reshape(shape)
+    return header["info"], arrays
@@ -0,0 +1,128 @@
+import io
+import os
+import sqlite3
+import time
+
+from .cache import default_cache_dir
+
+# Thumbnails are scaled to fit inside a square of this many pixels
+THUMBNAIL_SIZE = 150
+# Thumbnails average a few KB each, so this keeps tens of thousands of them
+THUMBNAIL_CACHE_MAX_BYTES = 256 * 1024 * 1024
+
+
+def default_thumbnail_cache_path():
+    return os.path.join(default_cache_dir(), "thumbnails.sqlite")
+
+# Scales an already opened image to fit inside a max_size square, keeping its aspect ratio.
+# reducing_gap lets PIL box-reduce large images before the LANCZOS pass, roughly halving its cost.
+def make_thumbnail(img, max_size=THUMBNAIL_SIZE):
+    from PIL import Image
+    width, height = img.size
+    if width > height:
+        new_width = max_size
+        new_height = max(1, int((height / width) * max_size))
+    else:
+        new_height = max_size
+        new_width = max(1, int((width / height) * max_size))
+    if img.mode not in ("RGB", "L"):
+        img = img.convert("RGB")
+    return img.resize((new_width, new_height), Image.Resampling.LANCZOS, reducing_gap=2.0).convert("RGB")
+
+def encode_thumbnail(thumbnail):
+    data = io.BytesIO()
+    thumbnail.save(data, "JPEG", quality=85)
+    return data.getvalue()
+
+# Decodes a file just far enough to thumbnail it.
+# Returns (width, height, jpeg_bytes), width and height being the resolution of the original image.
+def load_thumbnail(filepath, max_size=THUMBNAIL_SIZE):
+    from PIL import Image
+    with Image.open(filepath) as img:
+        width, height = img.size
+        if img.format == "JPEG":
+            img.draft("RGB", (max_size, max_size))
+        return width, height, encode_thumbnail(make_thumbnail(img, max_size))
+
+# Persistent, size-bounded SQLite store of encoded thumbnails, so reopening results doesn't decode every image again.
+# Like the hash cache, an entry is only used while the file's size and mtime_ns still match. Once the stored
+# thumbnails outgrow max_bytes the least recently used ones are dropped. Each connection must stay on the
+# thread that opened it.
+class ThumbnailCache:
+    # Share of max_bytes written through this connection before the total size is checked again
+    PRUNE_CHECK_FRACTION = 1 / 16
+    # Use times only steer pruning, so they are only updated once they are this many seconds old, and written
+    # this many at a time (and before pruning or closing) rather than one write per thumbnail shown
+    TOUCH_INTERVAL = 3600
+    TOUCH_BATCH_SIZE = 500
+
+    def __init__(self, cache_path, max_bytes=THUMBNAIL_CACHE_MAX_BYTES):
+        cache_dir = os.path.dirname(cache_path)
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.unchecked_bytes = 0
+        self.touched = {}
+        self.connection = sqlite3.connect(cache_path, timeout=30)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS thumbnails ("
+            "path TEXT PRIMARY KEY, size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL, "
+            "width INTEGER NOT NULL, height INTEGER NOT NULL, data BLOB NOT NULL, "
+            "bytes INTEGER NOT NULL, last_used REAL NOT NULL)"
+        )
+        self.connection.execute("CREATE INDEX IF NOT EXISTS thumbnails_last_used ON thumbnails (last_used)")
+        self.connection.commit()
+
+    # Returns (width, height, jpeg_bytes) for a file if an up to date thumbnail is stored, otherwise None
+    def get(self, path, stat):
+        row = self.connection.execute("SELECT size, mtime_ns, width, height, data, last_used FROM thumbnails WHERE path = ?", (path,)).fetchone()
+        if row is None or row[:2] != (stat.st_size, stat.st_mtime_ns):
+            return None
+        now = time.time()
+        if now - row[5] > self.TOUCH_INTERVAL:
+            self.touched[path] = now
+            if len(self.touched) >= self.TOUCH_BATCH_SIZE:
+                self.flush_touches()
+        return row[2:5]
+
+    # Writes the use times get() has put off
+    def flush_touches(self):
+        if self.touched:
+            with self.connection:
+                self.connection.executemany("UPDATE thumbnails SET last_used = ? WHERE path = ?", ((used, path) for path, used in self.touched.items()))
+            self.touched = {}
+
+    # entries is an iterable of (path, size, mtime_ns, width, height, jpeg_bytes)
+    def store(self, entries):
+        now = time.time()
+        rows = [(*entry, len(entry[5]), now) for entry in entries]
+        with self.connection:
+            self.connection.executemany("INSERT OR REPLACE INTO thumbnails VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+        self.unchecked_bytes += sum(row[6] for row in rows)
+        if self.unchecked_bytes >= self.max_bytes * self.PRUNE_CHECK_FRACTION:
+            self.prune()
+
+    # Drops the least recently used thumbnails until the cache is back under 90% of max_bytes
+    def prune(self):
+        self.unchecked_bytes = 0
+        self.flush_touches()
+        total = self.connection.execute("SELECT COALESCE(SUM(bytes), 0) FROM thumbnails").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        to_free = total - int(self.max_bytes * 0.9)
+        evicted = []
+        for path, size in self.connection.execute("SELECT path, bytes FROM thumbnails ORDER BY last_used"):
+            evicted.append((path,))
+            to_free -= size
+            if to_free <= 0:
+                break
+        with self.connection:
+            self.connection.executemany("DELETE FROM thumbnails WHERE path = ?", evicted)
+
+    def close(self):
+        try:
+            self.flush_touches()
+        finally:
+            self.connection.close()
@@ -0,0 +1,109 @@
+import os
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+# Folders listed at the same time. Listing is mostly waiting on the file system (especially network shares),
+# so this is independent of the core count.
+WALK_WORKERS = 8
+
+# How a scan walks its folder: skip_hidden, follow_symlinks and workers are passed on to walk_files()
+WalkOptions = namedtuple("WalkOptions", ("skip_hidden", "follow_symlinks", "workers"), defaults=(False, False, WALK_WORKERS))
+
+# Windows marks hidden folders with an attribute that scandir already returns with each entry
+FILE_ATTRIBUTE_HIDDEN = 0x2
+
+
+def _is_hidden(entry):
+    if entry.name.startswith("."):
+        return True
+    if os.name == "nt":
+        try:
+            return bool(entry.stat(follow_symlinks=False).st_file_attributes & FILE_ATTRIBUTE_HIDDEN)
+        except OSError:
+            return False
+    return False
+
+# True if path is parent or somewhere inside it
+def _contains(parent, path):
+    return path == parent or path.startswith(parent.rstrip(os.sep) + os.sep)
+
+# Lists one folder. Returns ([(filepath, stat), ...] for matching files, [(path, is_symlink), ...] for the
+# subfolders to walk into). Everything comes from the scandir entries, so apart from the stats asked for with
+# with_stat this costs no system calls beyond the listing itself (is_dir() only needs one for symlinks).
+# A file whose stat fails is returned with None; a folder that can't be listed is skipped, as os.walk does.
+def _list_folder(path, descend, included_extensions, with_stat, skip_hidden):
+    files, subfolders = [], []
+    try:
+        with os.scandir(path) as entries:
+            for entry in entries:
+                try:
+                    is_dir = entry.is_dir()
+                except OSError:
+                    is_dir = False
+                if not is_dir:
+                    if entry.name.lower().endswith(included_extensions):
+                        stat = None
+                        if with_stat:
+                            try:
+                                stat = entry.stat()
+                            except OSError:
+                                pass
+                        files.append((entry.path, stat))
+                elif descend and not (skip_hidden and _is_hidden(entry)):
+                    subfolders.append((entry.path, entry.is_symlink()))
+    except OSError:
+        pass
+    return files, subfolders
+
+# Walks folder_path with os.scandir, listing up to num_workers folders at once, and yields (filepath, stat) for
+# every file with one of included_extensions. Files come out in the same order os.walk would produce them,
+# however the listings finish. max_depth is the number of subfolder levels below folder_path to include
+# (0 for none, None for all). stat is the os.stat() of the file (size, mtime, ctime, inode...) if with_stat
+# is set, fetched on the walking threads, or None; on Windows it is free with the listing, though st_ino is 0.
+# skip_hidden leaves out folders starting with a dot or marked hidden. Symlinked folders are only walked with
+# follow_symlinks, and then only once each and only if they don't lead back into the folders already walked,
+# so links can't make the walk loop or report a file twice. Resolving a link is the only extra cost.
+def walk_files(folder_path, max_depth, included_extensions, with_stat=False, skip_hidden=False, follow_symlinks=False, num_workers=WALK_WORKERS):
+    included_extensions = tuple(included_extensions)
+    # Real paths of every tree being walked, to check symlink targets against
+    walked_trees = [os.path.realpath(folder_path)] if follow_symlinks else []
+    lookahead = 4 * num_workers
+    executor = ThreadPoolExecutor(max_workers=num_workers)
+
+    def submit(path, depth):
+        descend = max_depth is None or depth < max_depth
+        return executor.submit(_list_folder, path, descend, included_extensions, with_stat, skip_hidden)
+
+    try:
+        # Folders still to be yielded as [path, depth, listing future], the next one last. The next few are
+        # listed ahead of time; the rest wait so memory doesn't grow with the size of the tree.
+        stack = [[folder_path, 0, None]]
+        while stack:
+            listed = 0
+            for folder in reversed(stack):
+                if listed == lookahead:
+                    break
+                if folder[2] is None:
+                    folder[2] = submit(folder[0], folder[1])
+                listed += 1
+            path, depth, future = stack.pop()
+            files, subfolders = future.result()
+            yield from files
+            children = []
+            for subfolder, is_symlink in subfolders:
+                if is_symlink:
+                    if not follow_symlinks:
+                        continue
+                    target = os.path.realpath(subfolder)
+                    if any(_contains(tree, target) or _contains(target, tree) for tree in walked_trees):
+                        continue
+                    walked_trees.append(target)
+                children.append([subfolder, depth + 1, None])
+            stack.extend(reversed(children))
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+# Function to allow extended subfolder searches greater than a single subfolder
+def list_files(folder_path, max_depth, included_extensions, skip_hidden=False, follow_symlinks=False):
+    for filepath, stat in walk_files(folder_path, max_depth, included_extensions, skip_hidden=skip_hidden, follow_symlinks=follow_symlinks):
+        yield filepath
@@ -0,0 +1,74 @@
+import os
+import shutil
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from duplinator import SUPPORTED_EXTENSIONS
+from duplinator.cache import CacheOptions, HashCache
+from duplinator.scanner import DuplicateScanner
+
+
+@pytest.fixture
+def photos(tmp_path):
+    folder = tmp_path / "photos"
+    folder.mkdir()
+    rng = np.random.default_rng(0)
+    for number in range(4):
+        Image.fromarray(rng.integers(0, 256, size=(48, 64, 3), dtype=np.uint8)).save(folder / f"{number}.png")
+    return folder
+
+# Scans folder with the cache at cache_path and returns its progress counts
+def scan(folder, cache_path, hash_size=8, extra_hashes=(), **options):
+    scanner = DuplicateScanner(str(folder), hash_size, 5, 0, SUPPORTED_EXTENSIONS, caching=CacheOptions(cache_path, extra_hashes=extra_hashes), **options)
+    for event, data in scanner.scan():
+        pass
+    return scanner.progress
+
+
+def test_unchanged_files_are_not_hashed_again(photos, tmp_path):
+    cache_path = str(tmp_path / "hashes.sqlite")
+    assert scan(photos, cache_path)["hashed"] == 4
+    progress = scan(photos, cache_path)
+    assert progress["hashed"] == 0 and progress["cached"] == 4
+
+
+# A cached hash is only used while the file's size, modification time and inode are all unchanged
+@pytest.mark.parametrize("change", ["size", "mtime", "inode"])
+def test_changed_files_are_hashed_again(photos, tmp_path, change):
+    cache_path = str(tmp_path / "hashes.sqlite")
+    scan(photos, cache_path)
+    path = photos / "0.png"
+    stat = os.stat(path)
+    if change == "size":
+        with open(path, "ab") as f:
+            f.write(b"\0")
+    elif change == "inode":
+        shutil.copyfile(path, tmp_path / "copy.png")
+        os.replace(tmp_path / "copy.png", path)
+        assert os.stat(path).st_ino != stat.st_ino
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + (1_000_000_000 if change == "mtime" else 0)))
+    progress = scan(photos, cache_path)
+    assert progress["hashed"] == 1 and progress["cached"] == 3
+
+
+# Extra hashes are cached alongside the scan's own, so scanning again with one of them decodes nothing
+def test_extra_hashes_make_other_settings_cached(photos, tmp_path):
+    cache_path = str(tmp_path / "hashes.sqlite")
+    scan(photos, cache_path, extra_hashes=[("phash", 16), ("dhash", 8)])
+    for hash_size, algorithm in ((16, "phash"), (8, "dhash")):
+        progress = scan(photos, cache_path, hash_size, algorithm=algorithm)
+        assert progress["hashed"] == 0 and progress["cached"] == 4
+
+
+def test_deleted_files_are_evicted(photos, tmp_path):
+    cache_path = str(tmp_path / "hashes.sqlite")
+    scan(photos, cache_path)
+    os.remove(photos / "0.png")
+    scan(photos, cache_path)
+    cache = HashCache(cache_path)
+    try:
+        assert set(cache.load(str(photos), "phash", 8)) == {os.path.abspath(photos / f"{number}.png") for number in range(1, 4)}
+    finally:
+        cache.close()
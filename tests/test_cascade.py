@@ -0,0 +1,70 @@
+import io
+import struct
+
+import numpy as np
+import pytest
+from PIL import Image, ImageEnhance, ImageFilter
+
+from duplinator import SUPPORTED_EXTENSIONS
+from duplinator.hashing import embedded_thumbnail
+from duplinator.scanner import DuplicateScanner
+
+
+# Saves img as a JPEG with a 160 pixel EXIF thumbnail, the way cameras do: IFD0 holds the orientation and
+# IFD1 points at the thumbnail, which follows the two IFDs
+def save_with_thumbnail(img, path, quality=90):
+    thumbnail = img.copy()
+    thumbnail.thumbnail((160, 160))
+    buffer = io.BytesIO()
+    thumbnail.save(buffer, "JPEG", quality=85)
+    data = buffer.getvalue()
+    ifd0 = struct.pack("<HHHII", 1, 0x0112, 3, 1, 1) + struct.pack("<I", 26)
+    ifd1 = struct.pack("<HHHIIHHII", 2, 0x0201, 4, 1, 56, 0x0202, 4, 1, len(data)) + struct.pack("<I", 0)
+    img.save(path, quality=quality, exif=b"Exif\0\0II*\0" + struct.pack("<I", 8) + ifd0 + ifd1 + data)
+
+def smooth_noise(rng, width=1024, height=768):
+    img = Image.fromarray(rng.integers(0, 256, size=(height // 32, width // 32, 3), dtype=np.uint8))
+    return img.resize((width, height), Image.Resampling.BILINEAR).filter(ImageFilter.GaussianBlur(8))
+
+# Twenty camera-like photos and edited copies of four of them (resized, recompressed, brightened, cropped),
+# plus two PNGs, which have no thumbnail to take the prefilter hash from
+@pytest.fixture(scope="module")
+def photos(tmp_path_factory):
+    folder = tmp_path_factory.mktemp("photos")
+    rng = np.random.default_rng(0)
+    for number in range(20):
+        img = smooth_noise(rng)
+        save_with_thumbnail(img, folder / f"{number}.jpg")
+        if number == 0:
+            save_with_thumbnail(img.resize((512, 384)), folder / f"{number} resized.jpg")
+        elif number == 1:
+            save_with_thumbnail(img, folder / f"{number} recompressed.jpg", quality=40)
+        elif number == 2:
+            save_with_thumbnail(ImageEnhance.Brightness(img).enhance(1.1), folder / f"{number} brighter.jpg")
+        elif number == 3:
+            save_with_thumbnail(img.crop((16, 12, 1008, 756)), folder / f"{number} cropped.jpg")
+    for number in range(2):
+        smooth_noise(rng, 512, 384).save(folder / f"{number}.png")
+    return folder
+
+def scan(photos, **options):
+    scanner = DuplicateScanner(str(photos), 8, 8, 0, SUPPORTED_EXTENSIONS, **options)
+    for event, data in scanner.scan():
+        pass
+    return scanner
+
+
+def test_fixture_photos_have_thumbnails(photos):
+    with Image.open(photos / "0.jpg") as img:
+        assert embedded_thumbnail(img, 32).size == (160, 120)
+
+
+# The cascade finds every pair the full scan does here, decoding only the files in a candidate pair
+@pytest.mark.parametrize("multi_thread, num_threads", [(False, 1), (True, 2)])
+def test_cascade_finds_the_pairs_of_a_full_scan(photos, multi_thread, num_threads):
+    full = scan(photos)
+    cascade = scan(photos, cascade=True, multi_thread=multi_thread, num_threads=num_threads)
+    assert len(full.pairs()) == 4
+    assert sorted(cascade.pairs()) == sorted(full.pairs())
+    # Of the JPEGs only the eight paired ones are decoded; the PNGs got both hashes from their first decode
+    assert cascade.progress["refined"] == 8
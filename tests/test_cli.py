@@ -0,0 +1,90 @@
+import csv
+import io
+import json
+
+import numpy as np
+import pytest
+from PIL import Image, ImageFilter
+
+from duplinator.cli import main
+
+
+# Four smoothed noise images and a half-size copy of the first
+@pytest.fixture(scope="module")
+def photos(tmp_path_factory):
+    folder = tmp_path_factory.mktemp("photos")
+    rng = np.random.default_rng(0)
+    for number in range(4):
+        img = Image.fromarray(rng.integers(0, 256, size=(48, 64, 3), dtype=np.uint8)).resize((256, 192), Image.Resampling.BILINEAR).filter(ImageFilter.GaussianBlur(6))
+        img.save(folder / f"{number}.png")
+    with Image.open(folder / "0.png") as img:
+        img.resize((128, 96)).save(folder / "0 small.png")
+    return folder
+
+def run(capsys, *argv):
+    code = main(list(argv))
+    out, err = capsys.readouterr()
+    return code, out, err
+
+def scan(capsys, folder, *options):
+    return run(capsys, str(folder), "--no-cache", *options)
+
+def expected_pair(photos):
+    return {str(photos / "0.png"), str(photos / "0 small.png")}
+
+
+def test_ndjson_writes_one_pair_per_line(photos, capsys):
+    code, out, err = scan(capsys, photos)
+    assert code == 0
+    records = [json.loads(line) for line in out.splitlines()]
+    assert len(records) == 1 and {records[0]["file1"], records[0]["file2"]} == expected_pair(photos)
+    assert records[0]["distance"] <= 5
+
+
+def test_csv_has_a_header_row(photos, capsys):
+    code, out, err = scan(capsys, photos, "--format", "csv")
+    rows = list(csv.reader(io.StringIO(out)))
+    assert code == 0 and rows[0] == ["file1", "file2", "distance"]
+    assert len(rows) == 2 and set(rows[1][:2]) == expected_pair(photos)
+
+
+def test_json_is_one_array(photos, capsys):
+    code, out, err = scan(capsys, photos, "--format", "json")
+    records = json.loads(out)
+    assert code == 0 and len(records) == 1 and {records[0]["file1"], records[0]["file2"]} == expected_pair(photos)
+
+
+def test_group_names_the_file_to_keep(photos, capsys):
+    code, out, err = scan(capsys, photos, "--group", "--keep", "resolution")
+    groups = [json.loads(line) for line in out.splitlines()]
+    assert code == 0 and len(groups) == 1
+    assert groups[0]["keep"] == str(photos / "0.png")
+    assert {member["file"] for member in groups[0]["files"]} == expected_pair(photos)
+
+
+def test_output_file(photos, tmp_path, capsys):
+    code, out, err = scan(capsys, photos, "-o", str(tmp_path / "pairs.ndjson"))
+    assert code == 0 and out == ""
+    assert len((tmp_path / "pairs.ndjson").read_text().splitlines()) == 1
+
+
+# Bad settings are reported the same way, before anything is scanned
+@pytest.mark.parametrize("argv, message", [
+    (["--threshold", "65"], "--threshold must be at most 64"),
+    (["--algorithm", "whash", "--hash-size", "6"], "power of 2"),
+    (["--also-hash", "sha1"], "--also-hash"),
+])
+def test_bad_settings_exit_with_2(photos, capsys, argv, message):
+    code, out, err = scan(capsys, photos, *argv)
+    assert code == 2 and out == ""
+    assert err.startswith("duplinator: error: ") and message in err
+
+
+def test_merge_checks_the_threshold_against_the_saved_hashes(photos, tmp_path, capsys):
+    paths = [str(tmp_path / f"shard{number}.dupidx") for number in range(2)]
+    for number, path in enumerate(paths):
+        assert scan(capsys, photos, "--shard", f"{number}/2", "--save-index", path)[0] == 0
+    code, out, err = run(capsys, "--merge", *paths, "--threshold", "65")
+    assert code == 2 and "--threshold must be at most 64" in err
+    code, out, err = run(capsys, "--merge", *paths)
+    assert code == 0 and {frozenset((record["file1"], record["file2"])) for record in map(json.loads, out.splitlines())} == {frozenset(expected_pair(photos))}
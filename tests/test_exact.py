@@ -0,0 +1,64 @@
+import os
+import shutil
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from duplinator import SUPPORTED_EXTENSIONS
+from duplinator.exact import PARTIAL_DIGEST_BYTES, find_exact_duplicates
+from duplinator.scanner import DuplicateScanner
+
+
+def write(path, data):
+    path.write_bytes(data)
+    return str(path)
+
+def find(paths, num_workers=1):
+    return find_exact_duplicates(paths, {path: os.path.getsize(path) for path in paths}, num_workers)
+
+
+# Large files that only differ between their first and last few KB are told apart by the full digest
+@pytest.mark.parametrize("num_workers", [1, 3])
+def test_only_identical_files_are_grouped(tmp_path, num_workers):
+    large = os.urandom(8 * PARTIAL_DIGEST_BYTES)
+    middle_changed = bytearray(large)
+    middle_changed[len(large) // 2] ^= 1
+    paths = [
+        write(tmp_path / "large", large),
+        write(tmp_path / "large copy", large),
+        write(tmp_path / "middle changed", bytes(middle_changed)),
+        write(tmp_path / "small", b"small"),
+        write(tmp_path / "small copy", b"small"),
+        write(tmp_path / "other small", b"smell"),
+        write(tmp_path / "longer", large + b"\0"),
+    ]
+    assert sorted(find(paths, num_workers)) == [[paths[0], paths[1]], [paths[3], paths[4]]]
+
+
+# Two photos and two byte-identical copies of the first, which are paired at distance 0 without being decoded
+@pytest.fixture
+def photos(tmp_path):
+    folder = tmp_path / "photos"
+    folder.mkdir()
+    rng = np.random.default_rng(0)
+    for number in range(2):
+        Image.fromarray(rng.integers(0, 256, size=(48, 64, 3), dtype=np.uint8)).save(folder / f"{number}.png")
+    for name in ("0 copy.png", "0 copy 2.png"):
+        shutil.copyfile(folder / "0.png", folder / name)
+    return folder
+
+@pytest.mark.parametrize("expand_copies", [True, False])
+def test_exact_first_hashes_one_file_of_each_copy(photos, expand_copies):
+    scanner = DuplicateScanner(str(photos), 8, 5, 0, SUPPORTED_EXTENSIONS, exact_first=True, expand_copies=expand_copies)
+    for event, data in scanner.scan():
+        pass
+    assert scanner.progress["hashed"] == 2 and scanner.progress["exact_copies"] == 2
+    copies = [str(photos / name) for name in ("0.png", "0 copy.png", "0 copy 2.png")]
+    pairs = {frozenset(pair[:2]): pair[2] for pair in scanner.pairs()}
+    assert set(pairs.values()) == {0}
+    if expand_copies:
+        assert set(pairs) == {frozenset((first, second)) for first in copies for second in copies if first < second}
+    else:
+        # Each copy is only paired with the one the walk found first
+        assert len(pairs) == 2 and set.union(*map(set, pairs)) == set(copies) and len(frozenset.intersection(*pairs)) == 1
@@ -0,0 +1,103 @@
+import json
+
+import numpy as np
+import pytest
+from PIL import Image, ImageFilter
+
+from duplinator import frames, hashing
+from duplinator.cli import main
+from duplinator.frames import FrameOptions, SequenceMatcher, align_sequences, even_positions, unpack_sequence
+from duplinator.hashing import compute_hash_chunk
+
+
+# A panning shot over smoothed noise, one frame per step
+def panning(seed, count, size=(1024, 768), step=32):
+    width, height = size
+    rng = np.random.default_rng(seed)
+    scene = Image.fromarray(rng.integers(0, 256, size=(height // 16, (width + count * step) // 16, 3), dtype=np.uint8))
+    scene = scene.resize((width + count * step, height), Image.Resampling.BILINEAR).filter(ImageFilter.GaussianBlur(6))
+    return [scene.crop((number * step, 0, number * step + width, height)) for number in range(count)]
+
+def save_animation(path, frame_images):
+    frame_images[0].save(path, save_all=True, append_images=frame_images[1:], duration=100, loop=0)
+
+# An animation, a half-size copy, a copy missing its first frames, an unrelated animation and a still image
+@pytest.fixture(scope="module")
+def clips(tmp_path_factory):
+    folder = tmp_path_factory.mktemp("clips")
+    clip = panning(0, 12)
+    save_animation(folder / "clip.webp", clip)
+    save_animation(folder / "clip small.webp", [frame.resize((512, 384)) for frame in clip])
+    save_animation(folder / "clip trimmed.webp", clip[3:])
+    save_animation(folder / "other.png", panning(1, 12, (320, 240), 16))
+    panning(2, 1)[0].save(folder / "still.png")
+    return folder
+
+# Random 64-bit frame hashes as a frame sequence (see hash_frames), each frame changed in flips bits
+def sequence(frames, flips=0, seed=0):
+    rng = np.random.default_rng(seed)
+    changed = []
+    for value in frames:
+        for bit in rng.choice(64, size=flips, replace=False):
+            value ^= 1 << int(bit)
+        changed.append(value)
+    return b"".join(value.to_bytes(8, "big") for value in changed)
+
+def random_frames(count, seed):
+    rng = np.random.default_rng(seed)
+    return [int(value) for value in rng.integers(0, 2 ** 63, size=count)]
+
+def sequence_pairs(capsys, folder, *options):
+    assert main([str(folder), "--no-cache", *options]) == 0
+    out, err = capsys.readouterr()
+    return {frozenset((record["file1"], record["file2"])) for record in map(json.loads, out.splitlines())}
+
+
+def test_even_positions():
+    assert even_positions(5, 8) == [0, 1, 2, 3, 4]
+    assert even_positions(100, 4) == [12, 37, 62, 87]
+
+
+# Frames pair up in order only: a clip played backwards lines up on a single frame
+def test_align_sequences():
+    frames = random_frames(8, 0)
+    clip = unpack_sequence(sequence(frames), 64)
+    assert align_sequences(clip, unpack_sequence(sequence(frames[2:], flips=2), 64), 4) == (6, 12)
+    assert align_sequences(clip, unpack_sequence(sequence(frames[::-1]), 64), 4)[0] == 1
+
+
+# Trimmed and re-encoded copies are paired; a clip sharing a single frame with another isn't
+def test_sequence_matcher_pairs_copies_of_a_clip():
+    frames, other = random_frames(12, 0), random_frames(12, 1)
+    matcher = SequenceMatcher(64, 6, block_size=16)
+    assert matcher.add([("clip", sequence(frames)), ("other", sequence(other))]) == []
+    found = matcher.add([("trimmed", sequence(frames[4:], flips=3, seed=1)), ("one shared frame", sequence(other[:1] + random_frames(11, 2)))])
+    assert found == [("clip", "trimmed", 3)]
+    assert len(matcher) == 4
+
+
+def test_copies_of_an_animation_are_paired_by_their_frames(clips, capsys):
+    names = {frozenset(path.rsplit("/", 1)[1] for path in pair) for pair in sequence_pairs(capsys, clips, "--frames", "8")}
+    assert names == {frozenset(pair) for pair in (("clip.webp", "clip small.webp"), ("clip.webp", "clip trimmed.webp"), ("clip small.webp", "clip trimmed.webp"))}
+
+
+# Sampling frames opens an animated image once and takes its still hashes and thumbnail from the first frame,
+# so they are the same as without frames
+@pytest.mark.parametrize("reduced_decode", [True, False])
+def test_animated_images_are_opened_once(clips, monkeypatch, reduced_decode):
+    open_image = hashing.open_image
+    opened = []
+    def counting_open(filepath, budget=None):
+        opened.append(filepath)
+        return open_image(filepath, budget)
+    paths = [str(clips / name) for name in ("clip.webp", "other.png", "still.png")]
+    still = compute_hash_chunk(paths, 8, reduced_decode, 128, extra_specs=[("dhash", 8)])
+    monkeypatch.setattr(hashing, "open_image", counting_open)
+    monkeypatch.setattr(frames, "open_image", counting_open)
+    sampled = compute_hash_chunk(paths, 8, reduced_decode, 128, extra_specs=[("dhash", 8)], frame_spec=FrameOptions(8))
+    # A still image is only found to have a single frame once it is open, and is then hashed as usual
+    assert opened == [*paths, paths[2]]
+    assert (sampled[0][1] is not None) == reduced_decode
+    for still_result, sampled_result in zip(still, sampled):
+        assert sampled_result[:5] == still_result[:5]
+    assert [len(result[6]) for result in sampled] == [64, 64, 0]
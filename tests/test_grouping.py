@@ -0,0 +1,73 @@
+import random
+
+import pytest
+
+from duplinator.grouping import DuplicateGrouper, UnionFind
+
+
+def test_union_find_matches_connected_components():
+    rng = random.Random(0)
+    edges = [(rng.randrange(200), rng.randrange(200)) for _ in range(150)]
+    union_find = UnionFind()
+    for item1, item2 in edges:
+        union_find.union(item1, item2)
+    # Components by repeatedly relabelling every item with the smallest label of a neighbour
+    labels = {item: item for edge in edges for item in edge}
+    changed = True
+    while changed:
+        changed = False
+        for item1, item2 in edges:
+            low = min(labels[item1], labels[item2])
+            if labels[item1] != low or labels[item2] != low:
+                labels[item1] = labels[item2] = low
+                changed = True
+    for item1 in labels:
+        for item2 in labels:
+            assert (union_find.find(item1) == union_find.find(item2)) == (labels[item1] == labels[item2])
+    assert sum(union_find.size.values()) == len(labels)
+    assert -1 not in union_find
+
+
+def test_union_returns_the_root_of_the_merged_set():
+    union_find = UnionFind()
+    root = union_find.union("a", "b")
+    assert union_find.union("c", "a") == root == union_find.find("c")
+    assert union_find.union("a", "c") == root
+    assert union_find.size == {root: 3}
+
+
+def attributes(width, size, mtime):
+    return {"width": width, "height": width, "size": size, "mtime": mtime}
+
+@pytest.mark.parametrize("keep, expected", [("resolution", "big.jpg"), ("size", "heavy.jpg"), ("oldest", "old.jpg")])
+def test_grouper_merges_pairs_and_keeps_by_policy(keep, expected):
+    known = {
+        "big.jpg": attributes(4000, 2_000_000, 300),
+        "heavy.jpg": attributes(3000, 5_000_000, 200),
+        "old.jpg": attributes(1000, 100_000, 100),
+        "other.jpg": attributes(500, 50_000, 400),
+        "other copy.jpg": attributes(500, 50_000, 500),
+    }
+    grouper = DuplicateGrouper(keep, attributes=known)
+    changed, removed = grouper.add_pairs([("big.jpg", "heavy.jpg", 3), ("other.jpg", "other copy.jpg", 0)])
+    # Files seen on their own count as groups of one until they are merged
+    assert changed == {"big.jpg", "other.jpg"} and removed == {"heavy.jpg", "other copy.jpg"}
+    changed, removed = grouper.add_pairs([("old.jpg", "heavy.jpg", 4)])
+    assert changed == {"big.jpg"} and removed == {"old.jpg"} and grouper.root("old.jpg") == "big.jpg"
+    groups = grouper.groups()
+    assert len(grouper) == 2
+    assert groups[0]["keep"] == expected and groups[0]["files"][0] == (expected, 0)
+    assert sorted(filepath for filepath, distance in groups[0]["files"]) == ["big.jpg", "heavy.jpg", "old.jpg"]
+    assert groups[1]["keep"] == "other.jpg" and groups[1]["files"] == [("other.jpg", 0), ("other copy.jpg", 0)]
+
+
+# Without hash_distance only the distances of pairs that were matched directly are known
+def test_grouper_distances_without_hash_distance():
+    known = {name: attributes(width, 1000, 0) for name, width in (("a", 30), ("b", 20), ("c", 10))}
+    grouper = DuplicateGrouper("resolution", attributes=known)
+    grouper.add_pairs([("a", "b", 2), ("b", "c", 5)])
+    assert grouper.groups()[0]["files"] == [("a", 0), ("b", 2), ("c", None)]
+    distances = {("a", "b"): 2, ("a", "c"): 6}
+    grouper = DuplicateGrouper("resolution", lambda filepath1, filepath2: distances[(filepath1, filepath2)], known)
+    grouper.add_pairs([("a", "b", 2), ("b", "c", 5)])
+    assert grouper.groups()[0]["files"][2] == ("c", 6)
@@ -0,0 +1,127 @@
+import threading
+import time
+
+import numpy as np
+import pytest
+from PIL import Image, ImageFilter
+
+from duplinator import SUPPORTED_EXTENSIONS
+from duplinator.cache import HashCache
+from duplinator.hashing import DecodeBudget, compute_hash, hash_decode_target, hash_image_file_multi, open_image, parse_hash_specs, reduce_for_hashing
+from duplinator.scanner import find_duplicate_images
+
+
+# A large photo-like image: smoothed noise, so it has detail at every scale a hash looks at
+def smooth_noise(width, height, seed=0):
+    rng = np.random.default_rng(seed)
+    img = Image.fromarray(rng.integers(0, 256, size=(height // 32, width // 32, 3), dtype=np.uint8))
+    return img.resize((width, height), Image.Resampling.BILINEAR).filter(ImageFilter.GaussianBlur(8))
+
+@pytest.fixture(scope="module")
+def photos(tmp_path_factory):
+    folder = tmp_path_factory.mktemp("photos")
+    img = smooth_noise(2400, 1800)
+    img.save(folder / "large.jpg", quality=92)
+    img.save(folder / "large.png")
+    img.resize((600, 450)).save(folder / "small copy.jpg", quality=85)
+    return folder
+
+# The same photo stored as plain rows of pixels, bottom up in a BMP and top down in an uncompressed TIFF
+@pytest.fixture(scope="module")
+def raw_photos(tmp_path_factory):
+    folder = tmp_path_factory.mktemp("raw")
+    img = smooth_noise(2400, 1800)
+    img.save(folder / "large.bmp")
+    img.save(folder / "large.tif")
+    return folder
+
+
+# JPEGs are decoded DCT-scaled and other formats box-reduced, never below the size the hash needs
+@pytest.mark.parametrize("name", ["large.jpg", "large.png"])
+def test_reduced_decode_is_small_but_large_enough(photos, name):
+    target = hash_decode_target(8)
+    with Image.open(photos / name) as img:
+        reduced = reduce_for_hashing(img, 8)
+        assert target <= min(reduced.size) < 2 * target
+
+
+@pytest.mark.parametrize("name", ["large.jpg", "large.png"])
+@pytest.mark.parametrize("hash_size, max_bits", [(8, 2), (16, 4)])
+def test_reduced_decode_hash_is_close_to_full_decode(photos, name, hash_size, max_bits):
+    reduced = compute_hash(str(photos / name), hash_size, reduced_decode=True)
+    full = compute_hash(str(photos / name), hash_size, reduced_decode=False)
+    assert reduced - full <= max_bits
+
+
+# The compatibility functions keep decoding in full, so their pairs don't change, and cache those hashes apart
+def test_find_duplicate_images_decodes_in_full_by_default(photos, tmp_path):
+    cache_path = str(tmp_path / "hashes.sqlite")
+    pairs = find_duplicate_images(str(photos), 8, 5, 0, SUPPORTED_EXTENSIONS, False, 1, cache_path=cache_path)
+    assert {frozenset(pair) for pair in pairs} == {frozenset((str(photos / first), str(photos / second))) for first, second in (("large.jpg", "large.png"), ("large.jpg", "small copy.jpg"), ("large.png", "small copy.jpg"))}
+    cache = HashCache(cache_path)
+    try:
+        assert len(cache.load(str(photos), "phash-full", 8)) == 3
+        assert not cache.load(str(photos), "phash", 8)
+    finally:
+        cache.close()
+
+
+def test_parse_hash_specs():
+    assert parse_hash_specs("12, dhash, whash:16, 12,,", "phash", 8) == [("phash", 12), ("dhash", 8), ("whash", 16)]
+    for text in ("sha1", "phash:x", "1", "whash:12"):
+        with pytest.raises(ValueError):
+            parse_hash_specs(text, "phash", 8)
+
+
+# Every spec's hash comes from one decode, reduced for the largest of them, so each is within the reduced
+# decode's margin of hashing with that spec alone
+def test_hash_specs_from_one_decode(photos):
+    specs = [("phash", 8), ("phash", 16), ("dhash", 8)]
+    hashes, thumbnail, problem = hash_image_file_multi(str(photos / "large.jpg"), specs)
+    assert problem is None
+    for (algorithm, hash_size), image_hash in zip(specs, hashes):
+        alone = hash_image_file_multi(str(photos / "large.jpg"), [(algorithm, hash_size)])[0][0]
+        assert image_hash.hash.shape == (hash_size, hash_size) and image_hash - alone <= hash_size // 4
+
+
+# A reservation waits while the ones already held would take the total over the limit, but one on its own is
+# always let through
+def test_decode_budget_waits_for_memory_to_be_released():
+    budget = DecodeBudget(100)
+    granted = threading.Event()
+    def reserve():
+        with budget.reserve(60):
+            granted.set()
+    with budget.reserve(60):
+        waiting = threading.Thread(target=reserve)
+        waiting.start()
+        time.sleep(0.1)
+        assert not granted.is_set()
+    waiting.join(5)
+    assert granted.is_set() and budget.used.value == 0
+    with budget.reserve(1000):
+        assert budget.used.value == 1000
+
+
+# Only a budget lets an image past PIL's decompression bomb check, and the check is back in place afterwards
+def test_open_image_lifts_the_pixel_limit_only_with_a_budget(photos, monkeypatch):
+    monkeypatch.setattr(Image, "MAX_IMAGE_PIXELS", 1000)
+    with pytest.raises(Image.DecompressionBombError):
+        open_image(str(photos / "large.png"))
+    with open_image(str(photos / "large.png"), DecodeBudget(1 << 30)) as img:
+        assert img.size == (2400, 1800)
+    assert Image.MAX_IMAGE_PIXELS == 1000
+
+
+# Uncompressed images too large for the budget are decoded a band of rows at a time, giving the same hash as a
+# whole decode; a compressed one can't be, so it is skipped
+@pytest.mark.parametrize("name", ["large.bmp", "large.tif"])
+def test_raw_images_over_the_budget_are_decoded_in_bands(raw_photos, name):
+    whole = hash_image_file_multi(str(raw_photos / name), [("phash", 8)])
+    banded = hash_image_file_multi(str(raw_photos / name), [("phash", 8)], budget=DecodeBudget(4 << 20))
+    assert banded[2] is None and banded[0] == whole[0]
+
+
+def test_compressed_images_over_the_budget_are_skipped(photos):
+    hashes, thumbnail, problem = hash_image_file_multi(str(photos / "large.png"), [("phash", 8)], budget=DecodeBudget(4 << 20))
+    assert hashes is None and problem.status == "skipped"
@@ -0,0 +1,95 @@
+import time
+
+import numpy as np
+import pytest
+
+from duplinator.index import HashIndex
+
+
+# n random hashes of words 64-bit words, every tenth one a near copy of the one before it
+def random_hashes(n, words=1, seed=0):
+    rng = np.random.default_rng(seed)
+    packed = rng.integers(0, 2 ** 64 - 1, size=(n, words), dtype=np.uint64, endpoint=True)
+    for row in range(1, n, 10):
+        packed[row] = packed[row - 1]
+        for bit in rng.choice(64 * words, size=rng.integers(0, 8), replace=False):
+            packed[row, bit // 64] ^= np.uint64(1) << np.uint64(bit % 64)
+    return packed
+
+def make_index(packed, threshold=0):
+    return HashIndex([f"/photos/{row}.jpg" for row in range(len(packed))], np.arange(len(packed)), packed, {}, threshold, ([], [], []))
+
+def table(index):
+    return sorted(zip(index.pair_i.tolist(), index.pair_j.tolist(), index.pair_distances.tolist()))
+
+
+@pytest.mark.parametrize("words", [1, 2])
+@pytest.mark.parametrize("threshold", [3, 6, 9, 14])
+def test_extend_lookup_matches_brute_force(words, threshold):
+    packed = random_hashes(5000, words)
+    looked_up, compared = make_index(packed, 2), make_index(packed, 2)
+    compared.lookup_bands = lambda threshold: None
+    assert looked_up.extend(threshold) == compared.extend(threshold) == threshold
+    assert table(looked_up) == table(compared)
+
+
+# Raising the threshold of a large index a few steps looks each hash up rather than comparing every pair,
+# which took around 45 seconds on a single core
+def test_extend_100k_hashes_is_quick():
+    index = make_index(random_hashes(100_000), 5)
+    assert index.lookup_bands(7) is not None
+    start = time.perf_counter()
+    index.extend(7)
+    assert time.perf_counter() - start < 2.0
+    start = time.perf_counter()
+    index.pairs(6)
+    assert time.perf_counter() - start < 0.5
+
+
+# Files 0 to 3: rows 0 and 1 are 2 bits apart, row 2 is 9 bits from row 1, and file 3 is an exact copy of file 0
+def small_index():
+    packed = np.array([[0b11], [0b1111], [0b1111111111111]], dtype=np.uint64)
+    files = ["/photos/a.jpg", "/photos/b.png", "/photos/c.jpg", "/photos/a copy.jpg"]
+    return HashIndex(files, [0, 1, 2], packed, {0: [0, 3]}, 2, ([0], [1], [2]), info={"algorithm": "phash", "hash_size": 8})
+
+
+def test_pairs_filter_by_threshold_and_extension():
+    index = small_index()
+    assert index.pairs(0) == [("/photos/a.jpg", "/photos/a copy.jpg", 0)]
+    assert index.pairs(2) == [("/photos/a.jpg", "/photos/b.png", 2), ("/photos/a.jpg", "/photos/a copy.jpg", 0), ("/photos/b.png", "/photos/a copy.jpg", 2)]
+    assert index.pairs(2, expand_copies=False) == [("/photos/a.jpg", "/photos/b.png", 2), ("/photos/a.jpg", "/photos/a copy.jpg", 0)]
+    assert index.pairs(11, [".jpg"]) == [("/photos/a.jpg", "/photos/c.jpg", 11), ("/photos/a.jpg", "/photos/a copy.jpg", 0), ("/photos/c.jpg", "/photos/a copy.jpg", 11)]
+    assert index.max_distance == 11
+    assert index.hash_distance("/photos/a copy.jpg", "/photos/c.jpg") == 11
+
+
+def test_remove_drops_files_from_every_pair():
+    index = small_index()
+    index.remove(["/photos/a.jpg", "/photos/not indexed.jpg"])
+    assert index.pairs(9) == [("/photos/b.png", "/photos/c.jpg", 9), ("/photos/b.png", "/photos/a copy.jpg", 2)]
+    # The copy still has its hash, which it shares with the removed file
+    assert index.hash_of("/photos/a copy.jpg") is not None
+
+
+@pytest.mark.parametrize("mmap", [True, False])
+def test_save_and_open_round_trip(tmp_path, mmap):
+    # The last file is an exact copy of the first, so it has no row of its own
+    index = HashIndex([f"/photos/{row}.jpg" for row in range(300)], np.arange(299), random_hashes(299, 2), {0: [0, 299]}, 0, ([], [], []), info={"folder": "/photos"})
+    index.extend(4)
+    index.remove(["/photos/5.jpg"])
+    index.save(tmp_path / "photos.dupidx")
+    opened = HashIndex.open(tmp_path / "photos.dupidx", mmap)
+    assert opened.info == index.info and opened.max_distance == 4 and opened.members == index.members
+    assert list(opened.files) == list(index.files)
+    assert np.array_equal(opened.packed, index.packed)
+    assert opened.pairs(4) == index.pairs(4)
+    # An opened index can still be extended and have files removed
+    assert opened.pairs(8) == index.pairs(8)
+    opened.remove(["/photos/0.jpg"])
+    assert all("/photos/0.jpg" not in pair for pair in opened.pairs(8))
+
+
+def test_open_rejects_other_files(tmp_path):
+    (tmp_path / "notes.txt").write_text("not an index")
+    with pytest.raises(ValueError):
+        HashIndex.open(tmp_path / "notes.txt")
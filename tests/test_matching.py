@@ -0,0 +1,59 @@
+import random
+
+import pytest
+
+from duplinator.matching import HammingIndex, StreamingMatcher, find_hash_pairs, hash_bytes_to_int
+
+
+# n random hashes of num_bits as hash bytes (see hash_to_bytes), every fifth one a near copy of the one before it
+def random_hash_bytes(n, num_bits, seed=0):
+    rng = random.Random(seed)
+    num_bytes = (num_bits + 7) // 8
+    values = []
+    for row in range(n):
+        if row % 5 == 1:
+            value = values[-1]
+            for bit in rng.sample(range(num_bits), rng.randrange(num_bits // 4)):
+                value ^= 1 << bit
+        else:
+            value = rng.getrandbits(num_bits)
+        values.append(value)
+    return [(value << (num_bytes * 8 - num_bits)).to_bytes(num_bytes, "big") for value in values]
+
+def brute_force_pairs(hash_bytes_list, num_bits, threshold):
+    values = [hash_bytes_to_int(hash_bytes, num_bits) for hash_bytes in hash_bytes_list]
+    return [(i, j, (values[i] ^ values[j]).bit_count()) for i in range(len(values)) for j in range(i + 1, len(values)) if (values[i] ^ values[j]).bit_count() <= threshold]
+
+
+# 36 and 256 bits are phash at hash sizes 6 and 16, 112 bits colorhash at 8
+@pytest.mark.parametrize("num_bits", [36, 64, 112, 256])
+@pytest.mark.parametrize("threshold", [0, 3, 8, 20])
+@pytest.mark.parametrize("engine", ["index", "bruteforce"])
+def test_find_hash_pairs_matches_brute_force(num_bits, threshold, engine):
+    hash_bytes_list = random_hash_bytes(300, num_bits)
+    expected = brute_force_pairs(hash_bytes_list, num_bits, threshold)
+    found = list(find_hash_pairs(hash_bytes_list, num_bits, threshold, engine, block_size=64))
+    assert sorted(found) == expected
+    if engine == "index":
+        # The index yields pairs in nested loop order
+        assert found == expected
+
+
+def test_hamming_index_threshold_of_every_bit_matches_everything():
+    index = HammingIndex(16, 16)
+    for value in (0, 0xFFFF, 0x00FF):
+        index.add(value)
+    assert list(index.find_pairs()) == [(0, 1, 16), (0, 2, 8), (1, 2, 8)]
+
+
+@pytest.mark.parametrize("num_bits", [64, 256])
+@pytest.mark.parametrize("engine", ["index", "bruteforce"])
+def test_streaming_matcher_matches_find_hash_pairs(num_bits, engine):
+    hash_bytes_list = random_hash_bytes(500, num_bits, seed=1)
+    matcher = StreamingMatcher(num_bits, 10, engine, block_size=32)
+    found = []
+    for start in range(0, len(hash_bytes_list), 70):
+        found.extend(matcher.add(hash_bytes_list[start:start + 70]))
+    assert sorted(found) == brute_force_pairs(hash_bytes_list, num_bits, 10)
+    assert all(matcher.distance(i, j) == distance for i, j, distance in found)
+    assert [bytes(row) for row in matcher.packed_hashes()] == [bytes(matcher.packed_row(i)) for i in range(len(hash_bytes_list))]
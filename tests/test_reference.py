@@ -0,0 +1,104 @@
+import numpy as np
+import pytest
+from PIL import Image, ImageFilter
+
+from duplinator import SUPPORTED_EXTENSIONS
+from duplinator.index import HashIndex
+from duplinator.matching import block_distances
+from duplinator.reference import ReferenceIndex, TableThresholdTooLow
+from duplinator.scanner import DuplicateScanner
+
+
+# n random 64-bit hashes and, for the first tenth of them, a near copy with up to 8 bits changed
+def hashes_and_near_copies(n, seed=0):
+    rng = np.random.default_rng(seed)
+    packed = rng.integers(0, 2 ** 64 - 1, size=(n, 1), dtype=np.uint64, endpoint=True)
+    copies = packed[:n // 10].copy()
+    for row in range(len(copies)):
+        for bit in rng.choice(64, size=rng.integers(0, 9), replace=False):
+            copies[row, 0] ^= np.uint64(1) << np.uint64(bit)
+    return packed, np.concatenate((copies, rng.integers(0, 2 ** 64 - 1, size=(n // 10, 1), dtype=np.uint64, endpoint=True)))
+
+# Files 0 and 1 of the reference are exact copies sharing row 0; file 2 is a PNG
+def reference_index(packed, threshold):
+    files = ["/archive/0.jpg", "/archive/0 copy.jpg", "/archive/2.png"] + [f"/archive/{row}.jpg" for row in range(3, len(packed) + 1)]
+    row_file_ids = np.array([0] + list(range(2, len(packed) + 1)))
+    index = HashIndex(files, row_file_ids, packed, {0: [0, 1]}, 0, ([], [], []))
+    return ReferenceIndex(index, threshold)
+
+def brute_force_matches(queries, packed, threshold):
+    distances = block_distances(queries, packed)
+    positions, rows = np.nonzero(distances <= threshold)
+    return sorted(zip(positions.tolist(), rows.tolist(), distances[positions, rows].tolist()))
+
+def matches(reference, queries, threshold=None):
+    return sorted(zip(*(column.tolist() for column in reference.match(queries, threshold))))
+
+
+# With a lookup table at low thresholds and comparing every row at high ones
+@pytest.mark.parametrize("threshold", [3, 6, 12])
+def test_match_finds_what_comparing_every_row_does(threshold, monkeypatch):
+    packed, queries = hashes_and_near_copies(3000)
+    reference = reference_index(packed, threshold)
+    assert (reference.table is None) == (threshold == 12)
+    monkeypatch.setattr(ReferenceIndex, "QUERY_BATCH_SIZE", 64)
+    assert matches(reference, queries) == brute_force_matches(queries, packed, threshold)
+    assert matches(reference, queries, threshold // 2) == brute_force_matches(queries, packed, threshold // 2)
+    with pytest.raises(ValueError):
+        reference.match(queries, threshold + 1)
+
+
+def test_saved_table_is_reused_up_to_its_threshold(tmp_path):
+    packed, queries = hashes_and_near_copies(3000)
+    reference_index(packed, 6).save(tmp_path / "archive.dupidx")
+    for mmap in (True, False):
+        opened = ReferenceIndex.open(tmp_path / "archive.dupidx", 4, mmap)
+        assert opened.threshold == 6 and opened.table is not None
+        assert matches(opened, queries, 4) == brute_force_matches(queries, packed, 4)
+    with pytest.raises(TableThresholdTooLow):
+        ReferenceIndex.open(tmp_path / "archive.dupidx", 8)
+    rebuilt = ReferenceIndex.open(tmp_path / "archive.dupidx", 8, rebuild=True)
+    assert rebuilt.threshold == 8 and matches(rebuilt, queries) == brute_force_matches(queries, packed, 8)
+
+
+def test_row_files_leave_out_removed_files_and_other_types():
+    reference = reference_index(*hashes_and_near_copies(30)[:1], 4)
+    assert reference.row_files(0) == ["/archive/0.jpg", "/archive/0 copy.jpg"]
+    assert reference.row_files(0, expand_copies=False) == ["/archive/0.jpg"]
+    assert reference.row_files(1, (".jpg",)) == []
+    reference.index.remove(["/archive/0.jpg"])
+    assert reference.row_files(0, expand_copies=False) == ["/archive/0 copy.jpg"]
+
+
+# An archive of smoothed noise images and a folder with a resized copy of one of them and a new image saved twice
+@pytest.fixture(scope="module")
+def folders(tmp_path_factory):
+    archive, incoming = tmp_path_factory.mktemp("archive"), tmp_path_factory.mktemp("incoming")
+    rng = np.random.default_rng(0)
+    images = [Image.fromarray(rng.integers(0, 256, size=(24, 32, 3), dtype=np.uint8)).resize((256, 192), Image.Resampling.BILINEAR).filter(ImageFilter.GaussianBlur(6)) for number in range(7)]
+    for number, img in enumerate(images[:6]):
+        img.save(archive / f"{number}.png")
+    images[0].resize((128, 96)).save(incoming / "0 small.png")
+    images[6].save(incoming / "6.png")
+    images[6].save(incoming / "6.jpg", quality=90)
+    return archive, incoming
+
+# Scans folder, returning the scanner and every pair it reported
+def scan(folder, **options):
+    scanner = DuplicateScanner(str(folder), 8, 5, 0, SUPPORTED_EXTENSIONS, **options)
+    pairs = []
+    for event, data in scanner.scan():
+        if event == "pairs":
+            pairs.extend(data)
+    return scanner, pairs
+
+
+@pytest.mark.parametrize("folder_pairs", [True, False])
+def test_scan_against_a_reference(folders, tmp_path, folder_pairs):
+    archive, incoming = folders
+    ReferenceIndex(scan(archive)[0].index, 5).save(tmp_path / "archive.dupidx")
+    scanner, pairs = scan(incoming, reference=ReferenceIndex.open(tmp_path / "archive.dupidx"), folder_pairs=folder_pairs)
+    # A reference pair names the scanned file first
+    assert {pair[:2] for pair in pairs if pair[1].startswith(str(archive))} == {(str(incoming / "0 small.png"), str(archive / "0.png"))}
+    found_in_folder = {frozenset(pair[:2]) for pair in pairs if not pair[1].startswith(str(archive))}
+    assert found_in_folder == ({frozenset((str(incoming / "6.png"), str(incoming / "6.jpg")))} if folder_pairs else set())
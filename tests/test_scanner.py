@@ -0,0 +1,71 @@
+import numpy as np
+import pytest
+from PIL import Image, ImageFilter
+
+from duplinator import SUPPORTED_EXTENSIONS
+from duplinator.hashing import DecodeOptions, compute_hash, hash_files_parallel
+from duplinator.scanner import DuplicateScanner
+
+
+# Twelve smoothed noise images and half-size copies of the first four
+@pytest.fixture(scope="module")
+def photos(tmp_path_factory):
+    folder = tmp_path_factory.mktemp("photos")
+    rng = np.random.default_rng(0)
+    for number in range(12):
+        img = Image.fromarray(rng.integers(0, 256, size=(24, 32, 3), dtype=np.uint8)).resize((256, 192), Image.Resampling.BILINEAR).filter(ImageFilter.GaussianBlur(6))
+        img.save(folder / f"{number}.png")
+        if number < 4:
+            img.resize((128, 96)).save(folder / f"{number} small.png")
+    return folder
+
+def expected_pairs(photos):
+    return {frozenset((str(photos / f"{number}.png"), str(photos / f"{number} small.png"))) for number in range(4)}
+
+def scanner_for(photos, multi_thread=False, num_threads=1, **options):
+    return DuplicateScanner(str(photos), 8, 5, 0, SUPPORTED_EXTENSIONS, multi_thread, num_threads, **options)
+
+
+# Pairs are reported as they are found, and together they are the finished scan's pairs
+@pytest.mark.parametrize("multi_thread, num_threads", [(False, 1), (True, 2)])
+def test_streamed_pairs_are_the_finished_scans(photos, multi_thread, num_threads):
+    scanner = scanner_for(photos, multi_thread, num_threads)
+    streamed = []
+    progress = None
+    for event, data in scanner.scan():
+        if event == "pairs":
+            streamed.extend(data)
+        elif event == "progress":
+            progress = data
+    assert {frozenset(pair[:2]) for pair in streamed} == expected_pairs(photos)
+    assert sorted(scanner.pairs()) == sorted(streamed)
+    assert progress["stage"] == "done" and progress["hashed"] == 16 and progress["pairs"] == 4
+
+
+# Worker processes share the memory limit and give the same pairs as hashing on the scan's own thread
+@pytest.mark.parametrize("num_threads", [2, "auto"])
+def test_process_backend_finds_the_same_pairs(photos, num_threads):
+    scanner = scanner_for(photos, True, num_threads, backend="process", decode=DecodeOptions(memory_limit=64 << 20), chunk_size=3)
+    for event, data in scanner.scan():
+        pass
+    assert {frozenset(pair[:2]) for pair in scanner.pairs()} == expected_pairs(photos)
+    assert scanner.progress["hashed"] == 16
+
+
+@pytest.mark.parametrize("backend", ["thread", "process"])
+def test_hash_files_parallel_keeps_the_input_order(photos, backend):
+    paths = sorted(str(path) for path in photos.iterdir())
+    assert list(hash_files_parallel(paths, 8, backend, 2, chunk_size=3)) == [(path, compute_hash(path, 8)) for path in paths]
+
+
+# Cancelling between events ends the scan without finishing it, so it has no pairs to answer with
+def test_cancel_stops_the_scan(photos):
+    scanner = scanner_for(photos, True, 2)
+    events = scanner.scan()
+    next(events)
+    scanner.cancel()
+    for event in events:
+        pass
+    assert scanner.cancelled and scanner.progress["stage"] != "done"
+    with pytest.raises(RuntimeError):
+        scanner.pairs()
@@ -0,0 +1,106 @@
+import numpy as np
+import pytest
+from PIL import Image, ImageFilter
+
+from duplinator import SUPPORTED_EXTENSIONS
+from duplinator.cache import CacheOptions
+from duplinator.index import HashIndex
+from duplinator.matching import OFFSET_LOOKUP_COST, OFFSET_WIDTH, block_distances, lookup_bands
+from duplinator.scanner import DuplicateScanner
+from duplinator.shards import Shard, merge_indexes
+
+
+# Three folders of smoothed noise images, each with a resized and a brightened copy somewhere in the tree
+@pytest.fixture(scope="module")
+def photos(tmp_path_factory):
+    folder = tmp_path_factory.mktemp("photos")
+    rng = np.random.default_rng(0)
+    for name in ("2019", "2020", "2021"):
+        (folder / name).mkdir()
+    for number in range(12):
+        img = Image.fromarray(rng.integers(0, 256, size=(48, 64, 3), dtype=np.uint8)).resize((256, 192), Image.Resampling.BILINEAR).filter(ImageFilter.GaussianBlur(6))
+        img.save(folder / "2019" / f"{number}.png")
+        img.resize((200, 150)).save(folder / ("2020", "2021")[number % 2] / f"{number} small.png")
+        img.point(lambda value: min(255, value + 12)).save(folder / "2021" / f"{number} bright.jpg", quality=90)
+    return folder
+
+def scan(folder, threshold, shard=None):
+    scanner = DuplicateScanner(str(folder), 8, threshold, None, SUPPORTED_EXTENSIONS, shard=shard, caching=CacheOptions(None))
+    for event, data in scanner.scan():
+        pass
+    return scanner.index
+
+# A HashIndex of packed with every pair within threshold found by comparing every pair
+def brute_force_index(filepaths, packed, threshold, info=None, sequence_rows=None):
+    close = np.triu(block_distances(packed, packed) <= threshold, k=1)
+    if sequence_rows is not None:
+        close &= ~(sequence_rows[:, None] & sequence_rows[None, :])
+    rows_i, rows_j = np.nonzero(close)
+    distances = block_distances(packed, packed)[rows_i, rows_j]
+    return HashIndex(filepaths, np.arange(len(packed)), packed, {}, threshold, (rows_i, rows_j, distances), info=info, sequence_rows=sequence_rows)
+
+# Random 64-bit hashes split into indexes of three folders as if scanned apart, every tenth hash a near copy
+# of one a few hundred rows before it so most copies land in another folder's index
+def random_indexes(tmp_path, threshold, sizes=(900, 0, 1100), sequence_rows=None):
+    rng = np.random.default_rng(0)
+    packed = rng.integers(0, 2 ** 64 - 1, size=(sum(sizes), 1), dtype=np.uint64, endpoint=True)
+    for row in range(300, len(packed), 10):
+        packed[row] = packed[row - 300] ^ np.uint64(sum(1 << int(bit) for bit in rng.choice(64, size=rng.integers(0, 8), replace=False)))
+    filepaths = [f"/photos/{row}.jpg" for row in range(len(packed))]
+    paths, start = [], 0
+    for number, size in enumerate(sizes):
+        rows = slice(start, start + size)
+        marked = sequence_rows[rows] if sequence_rows is not None else None
+        index = brute_force_index(filepaths[rows], packed[rows], threshold, {"algorithm": "phash", "hash_size": 8, "reduced_decode": True, "folder": f"/photos/{number}"}, marked)
+        paths.append(str(tmp_path / f"folder{number}.dupidx"))
+        index.save(paths[-1])
+        start += size
+    return paths, brute_force_index(filepaths, packed, threshold, sequence_rows=sequence_rows)
+
+def pair_set(pairs):
+    return {(frozenset((filepath1, filepath2)), distance) for filepath1, filepath2, distance in pairs}
+
+
+@pytest.mark.parametrize("by", ["path", "folder"])
+def test_merged_shards_match_an_unsharded_scan(photos, tmp_path, by):
+    paths = []
+    for number in range(3):
+        paths.append(str(tmp_path / f"shard{number}.dupidx"))
+        scan(photos, 6, Shard(number, 3, by)).save(paths[-1])
+    merged = merge_indexes(paths, block_size=8)
+    whole = scan(photos, 6)
+    assert len(merged) == len(whole) == 36
+    assert whole.pairs(6)
+    assert pair_set(merged.pairs(6)) == pair_set(whole.pairs(6))
+    # Both can be raised to a higher threshold the same way
+    assert pair_set(merged.pairs(12)) == pair_set(whole.pairs(12))
+
+
+# Low thresholds look the other indexes' hashes up in a band table of each index, high ones compare every pair
+@pytest.mark.parametrize("threshold", [4, 6, 12])
+def test_merge_matches_across_indexes_like_one_index(tmp_path, threshold):
+    paths, whole = random_indexes(tmp_path, threshold)
+    assert (lookup_bands(64, threshold, 900, OFFSET_LOOKUP_COST, OFFSET_WIDTH) is None) == (threshold == 12)
+    merged = merge_indexes(paths, block_size=256)
+    assert len(merged) == len(whole)
+    assert pair_set(merged.pairs(threshold)) == pair_set(whole.pairs(threshold))
+
+
+# Files with frame sequences are only paired on those, which a merge can't compare, so it keeps them unpaired
+# across indexes and the merged index knows which they are
+def test_merge_keeps_sequence_rows(tmp_path):
+    sequence_rows = np.zeros(2000, dtype=bool)
+    sequence_rows[::10] = True
+    paths, whole = random_indexes(tmp_path, 6, sequence_rows=sequence_rows)
+    merged = merge_indexes(paths)
+    assert np.array_equal(merged.sequence_rows, sequence_rows)
+    assert pair_set(merged.pairs(6)) == pair_set(whole.pairs(6))
+    assert pair_set(merged.pairs(9)) == pair_set(whole.pairs(9))
+
+
+def test_merge_needs_every_shard(photos, tmp_path):
+    path = str(tmp_path / "shard0.dupidx")
+    scan(photos, 6, Shard(0, 2)).save(path)
+    with pytest.raises(ValueError, match="missing"):
+        merge_indexes([path])
+    assert merge_indexes([path], partial=True).pairs(6) == scan(photos, 6, Shard(0, 2)).pairs(6)
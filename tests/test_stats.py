@@ -0,0 +1,96 @@
+import pstats
+import time
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from duplinator import SUPPORTED_EXTENSIONS
+from duplinator.scanner import DuplicateScanner
+from duplinator.stats import DiagnosticOptions, FileTimer, ScanStats
+
+
+def busy(seconds):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+
+def test_stages_add_up_in_pipeline_order():
+    stats = ScanStats()
+    with stats.stage("match", 3):
+        pass
+    with stats.stage("walk"):
+        busy(0.01)
+    timer = FileTimer()
+    with timer.stage("decode"):
+        pass
+    with timer.stage("decode", 2):
+        pass
+    stats.add_file("/photos/a.jpg", timer.times)
+    stages = stats.snapshot()["stages"]
+    assert list(stages) == ["walk", "decode", "match"]
+    assert stages["walk"]["wall"] >= 0.01 and stages["decode"]["count"] == 3 and stages["match"]["count"] == 3
+
+
+# Time spent waiting for memory isn't held against a file
+def test_slowest_files():
+    stats = ScanStats(slowest_count=2)
+    for filepath, decode, wait in (("a", 0.3, 0.0), ("b", 0.1, 5.0), ("c", 0.2, 0.0), ("d", 0.05, 0.0)):
+        stats.add_file(filepath, {"decode": (decode, decode, 1), "wait": (wait, 0.0, 1)})
+    assert [entry["file"] for entry in stats.snapshot()["slowest"]] == ["a", "c"]
+
+
+def test_snapshot_rates_and_summary():
+    stats = ScanStats()
+    stats.add("decode", 3.0, 3.0, 30)
+    stats.add("hash", 1.0, 1.0, 30)
+    stats.add("wait", 100.0)
+    stats.queue("walk", 40)
+    stats.queue("walk", 10)
+    progress = {"hashed": 30, "cached": 10, "failed": 0, "skipped": 0, "elapsed": 4.0}
+    report = stats.snapshot(progress)
+    assert report["files_per_second"] == 10.0 and report["cache_hit_rate"] == 0.25
+    assert report["queues"] == {"walk": {"depth": 10, "peak": 40}}
+    assert stats.summary(progress) == "decode 75%, hash 25% | 10.0 files/s | walk queue 10 | cache 25% hits"
+
+
+def test_unknown_stage_or_mode():
+    with pytest.raises(ValueError):
+        ScanStats(profile_stage="frobnicate")
+    with pytest.raises(ValueError):
+        ScanStats(profile_stage="decode", profile_mode="perf")
+
+
+# Only the profiled stage is profiled, and the report names what it spent its time in
+@pytest.mark.parametrize("profile_mode", ["cprofile", "sample"])
+def test_profiled_stage(tmp_path, profile_mode):
+    stats = ScanStats(profile_stage="hash", profile_mode=profile_mode, sample_interval=0.001)
+    with stats.stage("decode"):
+        pass
+    with stats.stage("hash"):
+        busy(0.1)
+    stats.stop_profiling()
+    assert "busy" in stats.profile_report()
+    if profile_mode == "cprofile":
+        stats.write_profile(str(tmp_path / "hash.prof"))
+        assert any(function == "busy" for filename, line, function in pstats.Stats(str(tmp_path / "hash.prof")).stats)
+
+
+@pytest.fixture(scope="module")
+def photos(tmp_path_factory):
+    folder = tmp_path_factory.mktemp("photos")
+    rng = np.random.default_rng(0)
+    for number in range(5):
+        Image.fromarray(rng.integers(0, 256, size=(48, 64, 3), dtype=np.uint8)).save(folder / f"{number}.png")
+    return folder
+
+@pytest.mark.parametrize("multi_thread", [False, True])
+def test_scan_times_every_file(photos, multi_thread):
+    scanner = DuplicateScanner(str(photos), 8, 5, 0, SUPPORTED_EXTENSIONS, multi_thread, 2, diagnostics=DiagnosticOptions(slowest_count=3))
+    for event, data in scanner.scan():
+        pass
+    report = scanner.scan_stats.snapshot(scanner.progress)
+    assert all(report["stages"][stage]["count"] == 5 for stage in ("open", "decode", "hash"))
+    assert report["stages"]["walk"]["count"] >= 1 and report["stages"]["index"]["count"] == 5
+    assert len(report["slowest"]) == 3 and report["files_per_second"] > 0
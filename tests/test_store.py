@@ -0,0 +1,84 @@
+import os
+
+import numpy as np
+import pytest
+
+from duplinator.store import FileStat, FileStats, PathTable, read_store, write_store
+
+
+# Paths in several folders, with mixed case extensions and a name that isn't valid UTF-8
+PATHS = [f"/photos/{folder}/{number}.{extension}" for folder in ("a", "b") for number in range(50) for extension in ("jpg", "PNG")] + [os.fsdecode(b"/photos/caf\xe9.jpg")]
+
+def path_table(paths=PATHS):
+    table = PathTable()
+    for path in paths:
+        table.append(path)
+    return table
+
+
+def test_path_table_numbers_paths_in_order():
+    table = path_table()
+    # Looking paths up both before and after the recent ones are merged into the sorted keys
+    table.RECENT_LIMIT = 16
+    assert len(table) == len(PATHS) and list(table) == PATHS and table[-1] == PATHS[-1]
+    assert [table.id_of(path) for path in PATHS] == list(range(len(PATHS)))
+    assert table.id_of("/photos/missing.jpg") is None
+    table.append("/photos/new.jpg")
+    assert table.id_of("/photos/new.jpg") == len(PATHS)
+    with pytest.raises(IndexError):
+        table[len(PATHS) + 1]
+
+
+def test_path_table_endswith_ignores_case():
+    table = path_table()
+    assert table.endswith([".png"]).tolist() == [path.lower().endswith(".png") for path in PATHS]
+    assert table.endswith([".JPG", ".gif"]).tolist() == [path.lower().endswith(".jpg") for path in PATHS]
+
+
+def test_path_tables_round_trip_and_concatenate():
+    table = path_table()
+    restored = PathTable.from_arrays(table.to_arrays())
+    assert list(restored) == PATHS and restored.id_of(PATHS[7]) == 7
+    joined = PathTable.concatenate([table, path_table(["/archive/1.jpg", "/archive/2.jpg"])])
+    assert list(joined) == PATHS + ["/archive/1.jpg", "/archive/2.jpg"]
+    assert joined.id_of("/archive/2.jpg") == len(PATHS) + 1 and joined.id_of(PATHS[3]) == 3
+
+
+def stat(size):
+    return FileStat(size, size * 10, size * 20, 2 ** 63 + size)
+
+def test_file_stats_keep_missing_stats_apart():
+    stats = FileStats()
+    for size in (5, None, 0):
+        stats.append(None if size is None else stat(size))
+    assert [stats.get(file_id) for file_id in range(4)] == [(5, 50, 100, 2 ** 63 + 5), None, (0, 0, 0, 2 ** 63), None]
+    assert stats.get(0).st_mtime == 50 / 1e9
+    restored = FileStats.from_arrays(stats.to_arrays())
+    assert [restored.get(file_id) for file_id in range(3)] == [stats.get(file_id) for file_id in range(3)]
+    # Each part is padded to its number of files
+    joined = FileStats.concatenate([stats, stats], [4, 3])
+    assert len(joined) == 7 and joined.get(3) is None and joined.get(4) == stats.get(0)
+
+
+@pytest.mark.parametrize("mmap", [True, False])
+def test_store_round_trip(tmp_path, mmap):
+    path = tmp_path / "scan.dupidx"
+    arrays = {
+        "packed": np.arange(12, dtype=np.uint64).reshape(6, 2),
+        "distances": np.array([3, 1, 2], dtype=np.uint8),
+        "empty": np.zeros(0, dtype=np.int64),
+        **path_table().to_arrays(),
+    }
+    write_store(path, {"folder": "/photos", "hash_size": 8}, arrays)
+    assert os.listdir(tmp_path) == ["scan.dupidx"]
+    info, read = read_store(path, mmap)
+    assert info == {"folder": "/photos", "hash_size": 8} and set(read) == set(arrays)
+    for name, values in arrays.items():
+        assert read[name].dtype == values.dtype and np.array_equal(read[name], values)
+    assert list(PathTable.from_arrays(read)) == PATHS
+
+
+def test_read_store_rejects_other_files(tmp_path):
+    (tmp_path / "notes.txt").write_text("not a store")
+    with pytest.raises(ValueError):
+        read_store(tmp_path / "notes.txt")
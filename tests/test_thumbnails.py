@@ -0,0 +1,74 @@
+import sqlite3
+from types import SimpleNamespace
+
+from duplinator.thumbnails import ThumbnailCache
+
+
+def stat(size, mtime_ns=1):
+    return SimpleNamespace(st_size=size, st_mtime_ns=mtime_ns)
+
+def last_used(cache_path):
+    connection = sqlite3.connect(cache_path)
+    try:
+        return dict(connection.execute("SELECT path, last_used FROM thumbnails"))
+    finally:
+        connection.close()
+
+# Makes the stored thumbnails (those of paths, or all) look seconds older
+def age(cache_path, seconds, paths=None):
+    connection = sqlite3.connect(cache_path)
+    with connection:
+        if paths is None:
+            connection.execute("UPDATE thumbnails SET last_used = last_used - ?", (seconds,))
+        else:
+            connection.executemany("UPDATE thumbnails SET last_used = last_used - ? WHERE path = ?", ((seconds, path) for path in paths))
+    connection.close()
+
+
+def test_thumbnails_are_only_used_while_the_file_is_unchanged(tmp_path):
+    cache = ThumbnailCache(str(tmp_path / "thumbnails.sqlite"))
+    cache.store([("/photos/a.jpg", 100, 1, 640, 480, b"jpeg")])
+    assert cache.get("/photos/a.jpg", stat(100)) == (640, 480, b"jpeg")
+    assert cache.get("/photos/a.jpg", stat(101)) is None
+    assert cache.get("/photos/a.jpg", stat(100, 2)) is None
+    assert cache.get("/photos/b.jpg", stat(100)) is None
+    cache.close()
+
+
+# Showing a thumbnail doesn't write to the cache each time: recent use times are left alone and older ones
+# are written in batches, or when the cache is pruned or closed
+def test_use_times_are_written_in_batches(tmp_path):
+    cache_path = str(tmp_path / "thumbnails.sqlite")
+    cache = ThumbnailCache(cache_path)
+    cache.TOUCH_BATCH_SIZE = 3
+    cache.store([(f"/photos/{number}.jpg", 100, 1, 640, 480, b"jpeg") for number in range(4)])
+    stored = last_used(cache_path)
+    cache.get("/photos/0.jpg", stat(100))
+    assert not cache.touched
+    age(cache_path, 2 * cache.TOUCH_INTERVAL)
+    aged = last_used(cache_path)
+    for number in range(2):
+        cache.get(f"/photos/{number}.jpg", stat(100))
+    assert last_used(cache_path) == aged
+    cache.get("/photos/2.jpg", stat(100))
+    touched = last_used(cache_path)
+    assert all(touched[f"/photos/{number}.jpg"] >= stored[f"/photos/{number}.jpg"] for number in range(3))
+    assert touched["/photos/3.jpg"] == aged["/photos/3.jpg"]
+    cache.get("/photos/3.jpg", stat(100))
+    cache.close()
+    assert last_used(cache_path)["/photos/3.jpg"] >= stored["/photos/3.jpg"]
+
+
+def test_prune_drops_the_least_recently_used(tmp_path):
+    cache_path = str(tmp_path / "thumbnails.sqlite")
+    cache = ThumbnailCache(cache_path, max_bytes=10_000)
+    cache.store([(f"/photos/{number}.jpg", 100, 1, 640, 480, bytes(2_000)) for number in range(4)])
+    for number in range(4):
+        age(cache_path, (5 - number) * cache.TOUCH_INTERVAL, [f"/photos/{number}.jpg"])
+    # The use times get() holds back still count when pruning
+    cache.get("/photos/0.jpg", stat(100))
+    cache.store([("/photos/4.jpg", 100, 1, 640, 480, bytes(2_000))])
+    cache.store([("/photos/5.jpg", 100, 1, 640, 480, bytes(2_000))])
+    cache.prune()
+    assert set(last_used(cache_path)) == {"/photos/0.jpg", "/photos/3.jpg", "/photos/4.jpg", "/photos/5.jpg"}
+    cache.close()
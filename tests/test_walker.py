@@ -0,0 +1,63 @@
+import os
+
+import pytest
+
+from duplinator.walker import walk_files
+
+
+# photos/               a.jpg, notes.txt
+#   sub/                b.png
+#     deeper/           c.JPG
+#   .hidden/            d.jpg
+#   elsewhere -> ../linked
+#   loop -> .
+# linked/               e.gif
+@pytest.fixture(scope="module")
+def tree(tmp_path_factory):
+    base = tmp_path_factory.mktemp("tree")
+    for path in ("photos/a.jpg", "photos/notes.txt", "photos/sub/b.png", "photos/sub/deeper/c.JPG", "photos/.hidden/d.jpg", "linked/e.gif"):
+        (base / path).parent.mkdir(parents=True, exist_ok=True)
+        (base / path).write_bytes(path.encode())
+    os.symlink(base / "linked", base / "photos/elsewhere")
+    os.symlink(base / "photos", base / "photos/loop")
+    return base
+
+def walked(tree, max_depth, **options):
+    return [os.path.relpath(filepath, tree) for filepath, stat in walk_files(str(tree / "photos"), max_depth, (".jpg", ".png", ".gif"), **options)]
+
+# What os.walk finds down to max_depth levels below photos, in its order
+def os_walk(tree, max_depth):
+    found = []
+    for path, folders, files in os.walk(tree / "photos"):
+        depth = 0 if path == str(tree / "photos") else os.path.relpath(path, tree / "photos").count(os.sep) + 1
+        if max_depth is not None and depth >= max_depth:
+            folders.clear()
+        found.extend(os.path.relpath(os.path.join(path, name), tree) for name in files if name.lower().endswith((".jpg", ".png", ".gif")))
+    return found
+
+
+@pytest.mark.parametrize("max_depth, expected", [
+    (0, {"photos/a.jpg"}),
+    (1, {"photos/a.jpg", "photos/sub/b.png", "photos/.hidden/d.jpg"}),
+    (None, {"photos/a.jpg", "photos/sub/b.png", "photos/sub/deeper/c.JPG", "photos/.hidden/d.jpg"}),
+])
+@pytest.mark.parametrize("num_workers", [1, 8])
+def test_max_depth_limits_the_levels_walked(tree, max_depth, expected, num_workers):
+    found = walked(tree, max_depth, num_workers=num_workers)
+    assert set(found) == expected
+    # Listing folders in parallel doesn't change the order os.walk would give
+    assert found == os_walk(tree, max_depth)
+
+
+def test_skip_hidden(tree):
+    assert set(walked(tree, None, skip_hidden=True)) == {"photos/a.jpg", "photos/sub/b.png", "photos/sub/deeper/c.JPG"}
+
+
+# A linked folder is walked once, and a link back into the walked folder not at all
+def test_follow_symlinks_walks_each_folder_once(tree):
+    found = walked(tree, None, follow_symlinks=True)
+    assert sorted(found) == sorted(["photos/a.jpg", "photos/sub/b.png", "photos/sub/deeper/c.JPG", "photos/.hidden/d.jpg", "photos/elsewhere/e.gif"])
+
+
+def test_with_stat(tree):
+    assert {os.path.relpath(filepath, tree): stat.st_size for filepath, stat in walk_files(str(tree / "photos"), 0, (".jpg",), with_stat=True)} == {"photos/a.jpg": len(b"photos/a.jpg")}